@@ -0,0 +1,177 @@
+"""Пакетная обработка ОСВ: каталог или маска файлов -> пул процессов -> сводка по файлам.
+
+Пример:
+    python batchProcess.py exports/2025-06 --out processed/2025-06 --pct 3.5
+    python batchProcess.py "exports/**/*.xls" --workers 8
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from fileHandler import process_excel
+from historyStore import HistoryTarget, period_from_filename
+
+EXTENSIONS = (".xls", ".xlsx", ".xlsm")
+
+
+def collect_files(patterns: list) -> list:
+    """Каталоги (без вложенных) и маски glob -> отсортированный список файлов ОСВ без повторов."""
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [str(p) for p in Path(pattern).iterdir()]
+        else:
+            candidates = glob.glob(pattern, recursive=True)
+        for path in candidates:
+            name = os.path.basename(path)
+            # ~$... — временные файлы открытой книги Excel
+            if os.path.isfile(path) and name.lower().endswith(EXTENSIONS) and not name.startswith("~$"):
+                found.append(os.path.abspath(path))
+    return sorted(set(found))
+
+
+def output_paths(files: list, out_dir: str) -> dict:
+    """Имя результата — имя входного файла с .xlsx; при совпадении имён из разных каталогов добавляется номер."""
+    paths, used = {}, set()
+    for file_path in files:
+        stem = Path(file_path).stem
+        name, n = f"{stem}.xlsx", 1
+        while name in used:
+            n += 1
+            name = f"{stem} ({n}).xlsx"
+        used.add(name)
+        paths[file_path] = os.path.join(out_dir, name)
+    return paths
+
+
+def history_target(file_path: str, history_path: str, owner: str = None) -> HistoryTarget:
+    """Владелец по умолчанию — имя каталога файла (обычно выгрузки точки лежат в своём каталоге)."""
+    owner = owner or os.path.basename(os.path.dirname(file_path))
+    return HistoryTarget(history_path, owner, period_from_filename(file_path), os.path.basename(file_path))
+
+
+def process_one(file_path: str, output_path: str, allowed_deviation_percentage: float, writer: str,
+                history: HistoryTarget = None) -> dict:
+    """Обрабатывает один файл в процессе пула; ошибка файла не прерывает остальные."""
+    started = time.perf_counter()
+    result = {"file": file_path, "output": output_path, "error": None}
+    stats = {}
+    try:
+        # суммы для сводки нужны при любом writer (книгу с формулами иначе считает только Excel)
+        process_excel(file_path, output_path, allowed_deviation_percentage, writer=writer, stats=stats,
+                      history=history, totals=True)
+    except Exception as e:
+        # многострочные сообщения (например, от read_osv) — в одну строку для сводки
+        result["error"] = f"{type(e).__name__}: " + " | ".join(str(e).splitlines())
+    result.update(stats)
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+
+def run_batch(files: list, out_dir: str, allowed_deviation_percentage: float,
+              writer: str = "streaming", workers: int = None, progress=None,
+              history_path: str = None, owner: str = None) -> list:
+    """Раздаёт файлы по процессам; возвращает результаты в порядке files.
+
+    progress(done, total, result) вызывается после каждого файла. Если задан history_path,
+    результаты по позициям сохраняются в историю (период — по дате в имени файла).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    outputs = output_paths(files, out_dir)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                process_one, f, outputs[f], allowed_deviation_percentage, writer,
+                history_target(f, history_path, owner) if history_path else None,
+            ): f
+            for f in files
+        }
+        for future in as_completed(futures):
+            file_path = futures[future]
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                # процесс упал целиком (например, не хватило памяти) — помечаем файл и идём дальше
+                result = {"file": file_path, "output": None, "error": f"Процесс обработки завершился: {e}",
+                          "seconds": 0.0}
+            results[file_path] = result
+            if progress:
+                progress(len(results), len(files), result)
+    return [results[f] for f in files]
+
+
+def write_summary(results: list, summary_path: str) -> None:
+    """Сводка по файлам в CSV (разделитель «;», UTF-8 с BOM — открывается в Excel как есть)."""
+    os.makedirs(os.path.dirname(summary_path) or ".", exist_ok=True)
+    # нет суммы (ошибка файла) — пустая ячейка, а не 0
+    def amount(r: dict, key: str):
+        return "" if r["error"] or key not in r else round(r[key], 2)
+
+    total_z = sum(r["sum_excess"] for r in results if not r["error"] and "sum_excess" in r)
+    total_aa = sum(r["sum_shortage"] for r in results if not r["error"] and "sum_shortage" in r)
+    with open(summary_path, "w", newline="", encoding="utf-8-sig") as f:
+        w = csv.writer(f, delimiter=";")
+        w.writerow(["Файл", "Сумма превышения нормы излишков", "Сумма превышения нормы недостач",
+                    "Строк", "Секунд", "Ошибка"])
+        for r in results:
+            w.writerow([
+                os.path.basename(r["file"]),
+                amount(r, "sum_excess"),
+                amount(r, "sum_shortage"),
+                r.get("rows", ""),
+                round(r["seconds"], 2),
+                r["error"] or "",
+            ])
+        w.writerow(["Итого", round(total_z, 2), round(total_aa, 2), "", "", ""])
+
+
+def _print_progress(done: int, total: int, result: dict) -> None:
+    name = os.path.basename(result["file"])
+    status = f"ошибка: {result['error']}" if result["error"] else "готово"
+    print(f"[{done}/{total}] {name} — {status} ({result['seconds']:.1f} с)", file=sys.stderr, flush=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Пакетная обработка ОСВ: подсветка отклонений и сводка")
+    parser.add_argument("inputs", nargs="+", help="Каталоги или маски файлов (.xls/.xlsx/.xlsm)")
+    parser.add_argument("--out", default="processed", help="Каталог для результатов (по умолчанию processed)")
+    parser.add_argument("--pct", type=float, default=3.5, help="Допустимый процент (по умолчанию 3.5)")
+    parser.add_argument("--writer", choices=["streaming", "openpyxl", "formulas"], default="streaming",
+                        help="Способ записи результата (по умолчанию streaming)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Число процессов (по умолчанию — число ядер)")
+    parser.add_argument("--summary", default=None,
+                        help="Путь к сводке .csv (по умолчанию <out>/summary.csv)")
+    parser.add_argument("--history", default=None,
+                        help="База истории SQLite: сохранить результаты по позициям для анализа по периодам")
+    parser.add_argument("--owner", default=None,
+                        help="Владелец записей истории (по умолчанию — имя каталога каждого файла)")
+    args = parser.parse_args(argv)
+
+    files = collect_files(args.inputs)
+    if not files:
+        print("Файлы ОСВ не найдены.", file=sys.stderr)
+        return 2
+
+    started = time.perf_counter()
+    results = run_batch(files, args.out, args.pct / 100.0, writer=args.writer,
+                        workers=args.workers, progress=_print_progress,
+                        history_path=args.history, owner=args.owner)
+    summary_path = args.summary or os.path.join(args.out, "summary.csv")
+    write_summary(results, summary_path)
+
+    failed = [r for r in results if r["error"]]
+    print(f"Обработано: {len(results) - len(failed)} из {len(results)} за {time.perf_counter() - started:.1f} с. "
+          f"Сводка: {summary_path}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""Замеры process_excel по этапам: чтение, чистка строк, разбор чисел, расчёт, план оформления, запись.
+
+Сначала замеряется запуск бота: import bot в новом процессе (лучшее из repeat). Модули обработки
+(pandas, numpy, openpyxl, читатели Excel) в процесс бота попадать не должны — они импортируются
+только в рабочих процессах; если попали или запуск стал медленнее базового, это считается регрессией.
+
+Для каждого размера (по умолчанию 1k, 10k, 100k позиций) генерируется синтетическая ОСВ
+(benchmarks/data, создаётся один раз), затем каждый этап запускается repeat раз — берётся лучшее
+время — и ещё один раз под tracemalloc для пикового прироста памяти Python-объектов
+(память внутри calamine/numpy-буферов вне аллокатора Python здесь не видна).
+
+    python benchmarks/bench.py                     # сравнить с benchmarks/baseline.json
+    python benchmarks/bench.py --sizes 1000 10000  # только небольшие файлы
+    python benchmarks/bench.py --startup-only      # только запуск бота
+    python benchmarks/bench.py --save              # записать текущие результаты как базовые
+
+Код возврата 1, если какой-то этап (или запуск бота) медленнее базового больше чем на --tolerance.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))  # корень репозитория
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from engine import ENGINE_VERSION  # noqa: E402
+from fileHandler import clean_frame, evaluate_osv, parse_numeric_frame, style_plan, write_streaming  # noqa: E402
+from generate_osv import generate_osv  # noqa: E402
+from osvReader import read_osv  # noqa: E402
+
+ROOT = os.path.dirname(HERE)
+BASELINE_PATH = os.path.join(HERE, "baseline.json")
+DATA_DIR = os.path.join(HERE, "data")
+DEFAULT_SIZES = [1000, 10000, 100000]
+STAGES = ["read", "to_number", "clean", "compute", "style", "write"]
+# Не должны импортироваться процессом бота (только рабочими процессами, см. workerJobs)
+HEAVY_MODULES = ["pandas", "numpy", "openpyxl", "python_calamine", "xlrd"]
+
+_IMPORT_BOT = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import bot
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def _stage_functions(input_path: str, output_path: str, pct: float) -> dict:
+    """Этап -> (функция от результата предыдущего этапа)."""
+    return {
+        "read": lambda _: read_osv(input_path),
+        "to_number": parse_numeric_frame,
+        "clean": lambda parsed: clean_frame(*parsed),
+        "compute": lambda prepared: (evaluate_osv(prepared, pct), prepared.layout),
+        "style": lambda df_layout: (df_layout[0], style_plan(*df_layout)),
+        "write": lambda df_plan: write_streaming(df_plan[0], output_path, df_plan[1]),
+    }
+
+
+def _inputs(functions: dict) -> dict:
+    """Один прогон всей цепочки: вход каждого этапа (чтобы этапы можно было мерить по отдельности)."""
+    inputs, value = {}, None
+    for stage in STAGES:
+        inputs[stage] = value
+        value = functions[stage](value)
+    return inputs
+
+
+def measure(input_path: str, repeat: int, pct: float = 0.035) -> dict:
+    """{этап: {"seconds": лучшее время, "peak_mb": пик памяти}} плюс "total"."""
+    with tempfile.TemporaryDirectory() as tmp:
+        functions = _stage_functions(input_path, os.path.join(tmp, "out.xlsx"), pct)
+        inputs = _inputs(functions)
+        result = {}
+        for stage in STAGES:
+            fn, arg = functions[stage], inputs[stage]
+            best = float("inf")
+            for _ in range(repeat):
+                gc.collect()
+                started = time.perf_counter()
+                fn(arg)
+                best = min(best, time.perf_counter() - started)
+
+            gc.collect()
+            tracemalloc.start()
+            fn(arg)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result[stage] = {"seconds": round(best, 4), "peak_mb": round(peak / 2**20, 2)}
+
+    result["total"] = {
+        "seconds": round(sum(r["seconds"] for r in result.values()), 4),
+        "peak_mb": max(r["peak_mb"] for r in result.values()),
+    }
+    return result
+
+
+def measure_startup(repeat: int) -> dict:
+    """{"seconds": лучшее время import bot в новом процессе, "heavy_modules": лишние тяжёлые модули}."""
+    code = _IMPORT_BOT.format(root=ROOT, heavy=HEAVY_MODULES)
+    # bot.py требует токен и пишет bot.log в текущий каталог — запускаем во временном
+    env = dict(os.environ, BOT_TOKEN="0:bench", CHANNEL_USERNAME="@bench")
+    best, heavy = float("inf"), []
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, "-c", code], cwd=tmp, env=env, capture_output=True, text=True,
+                                 check=True)
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            best = min(best, result["seconds"])
+            heavy = result["heavy"]
+    return {"seconds": round(best, 4), "heavy_modules": heavy}
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "engine": ENGINE_VERSION,
+        "machine": platform.machine(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def input_for(size: int) -> str:
+    path = os.path.join(DATA_DIR, f"osv_{size}.xlsx")
+    if not os.path.exists(path):
+        print(f"Генерация {path}...", file=sys.stderr, flush=True)
+        generate_osv(path, size)
+    return path
+
+
+def print_report(results: dict, baseline: dict, tolerance: float) -> list:
+    """Таблица по этапам; возвращает список регрессий (размер, этап, во сколько раз медленнее)."""
+    regressions = []
+    for size, stages in results.items():
+        print(f"\n{int(size):,} позиций".replace(",", " "))
+        print(f"  {'этап':<10} {'время, с':>10} {'пик, МБ':>9} {'база, с':>9} {'изм.':>7}")
+        base_stages = baseline.get(size, {})
+        for stage, r in stages.items():
+            base = base_stages.get(stage, {}).get("seconds")
+            line = f"  {stage:<10} {r['seconds']:>10.3f} {r['peak_mb']:>9.1f}"
+            if base:
+                ratio = r["seconds"] / base
+                mark = ""
+                if ratio > 1 + tolerance and stage != "total":
+                    regressions.append((size, stage, ratio))
+                    mark = "  <-- медленнее"
+                line += f" {base:>9.3f} {ratio:>6.2f}x{mark}"
+            print(line)
+    return regressions
+
+
+def print_startup(startup: dict, baseline: dict, tolerance: float) -> list:
+    """Строка о запуске бота; возвращает регрессии в формате print_report."""
+    line = f"\nЗапуск бота (import bot): {startup['seconds']:.3f} с"
+    regressions = []
+    base = baseline.get("seconds")
+    if base:
+        ratio = startup["seconds"] / base
+        line += f", база {base:.3f} с, {ratio:.2f}x"
+        if ratio > 1 + tolerance:
+            regressions.append(("startup", "import_bot", ratio))
+            line += "  <-- медленнее"
+    print(line)
+    if startup["heavy_modules"]:
+        print(f"  Процесс бота импортирует модули обработки: {', '.join(startup['heavy_modules'])}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов обработки ОСВ")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Размеры ОСВ (позиций)")
+    parser.add_argument("--repeat", type=int, default=3, help="Повторов на этап, берётся лучший (по умолчанию 3)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Файл базовых результатов")
+    parser.add_argument("--save", action="store_true", help="Сохранить результаты как базовые")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Допустимое замедление этапа относительно базы (доля, по умолчанию 0.25)")
+    parser.add_argument("--startup-only", action="store_true", help="Замерить только запуск бота")
+    args = parser.parse_args(argv)
+
+    print("Замер запуска бота...", file=sys.stderr, flush=True)
+    startup = measure_startup(args.repeat)
+    results = {}
+    for size in [] if args.startup_only else args.sizes:
+        print(f"Замер {size} позиций...", file=sys.stderr, flush=True)
+        results[str(size)] = measure(input_for(size), args.repeat)
+
+    baseline, baseline_startup = {}, {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline, encoding="utf-8") as f:
+            stored = json.load(f)
+        baseline = stored.get("results", {})
+        baseline_startup = stored.get("startup", {})
+        if stored.get("environment", {}).get("cpus") != os.cpu_count():
+            print("Внимание: базовые результаты сняты на другой машине, сравнение приблизительное.",
+                  file=sys.stderr)
+
+    regressions = print_startup(startup, baseline_startup, args.tolerance)
+    regressions += print_report(results, baseline, args.tolerance)
+
+    if args.save:
+        stored = {"environment": environment(), "startup": {"seconds": startup["seconds"]}, "results": results}
+        if args.startup_only and os.path.exists(args.baseline):  # результаты этапов остаются прежними
+            with open(args.baseline, encoding="utf-8") as f:
+                stored = dict(json.load(f), startup=stored["startup"])
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(stored, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\nБазовые результаты сохранены: {args.baseline}")
+        return 0
+
+    if regressions:
+        print("\nЗамедления: " + ", ".join(f"{s}/{st} {r:.2f}x" for s, st, r in regressions))
+        return 1
+    if startup["heavy_modules"]:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Генератор синтетических ОСВ в формате выгрузки iiko ("Печать с налогами").
+
+Раскладка как у настоящего файла: колонки A..U, шапка и строки подписей на pandas-индексах 7–9
+(Excel-строки 9–11), разделы с "Товар"/"Кол-во", позиции с числами в виде текста
+(неразрывный пробел между разрядами, десятичная запятая) и строка "Итого" в конце.
+
+    python benchmarks/generate_osv.py 10000 -o benchmarks/data/osv_10000.xlsx
+"""
+import argparse
+import os
+import random
+
+from openpyxl import Workbook
+
+NBSP = " "
+NCOLS = 21  # A..U
+ITEMS_PER_SECTION = 100
+
+# Пары (кол-во, сумма): F/G нач. остаток, H/I приход, J/K поступления, L/M внутр. перемещения,
+# N/O расход, P/Q излишки, R/S недостачи, T/U конечный остаток
+HEADER = [
+    "Код", "Товар", "Ед. изм.", "Группа", "Поставщик",
+    "Начальный остаток", "", "Приход", "", "Поступления", "", "Перемещения", "", "Расход", "",
+    "Излишки", "", "Недостачи", "", "Конечный остаток", "",
+]
+SUBHEADER = [""] * 5 + ["Кол-во", "Сумма"] * 8
+
+
+def _fmt(value: float, decimals: int, rnd: random.Random):
+    """Число так, как его пишет iiko: "1 234,50" (NBSP), иногда обычный пробел или настоящее число."""
+    if value == 0 and rnd.random() < 0.5:
+        return None
+    r = rnd.random()
+    if r < 0.1:
+        return round(value, decimals)  # часть ячеек в выгрузке — настоящие числа
+    text = f"{value:,.{decimals}f}".replace(",", NBSP).replace(".", ",")
+    if r < 0.25:
+        text = text.replace(NBSP, " ")
+    return text
+
+
+def _item_row(code: int, rnd: random.Random) -> tuple:
+    """Строка позиции и её суммы (G, U) для строки "Итого"."""
+    price = rnd.uniform(50, 5000)
+    opening = rnd.uniform(0, 200)
+    income = rnd.uniform(0, 100) if rnd.random() < 0.3 else 0.0
+    received = rnd.uniform(0, 500)
+    moved = rnd.uniform(0, 50) if rnd.random() < 0.2 else 0.0
+    consumed = rnd.uniform(0, opening + received)
+    # излишки/недостачи у меньшинства позиций, иногда заметно выше нормы
+    surplus = rnd.uniform(0, 0.1) * (received + consumed) if rnd.random() < 0.15 else 0.0
+    shortage = rnd.uniform(0, 0.1) * (received + consumed) if rnd.random() < 0.2 else 0.0
+    closing = opening + income + received + moved - consumed + surplus - shortage
+
+    row = [f"{code:05d}", f"Позиция {code}", rnd.choice(["кг", "шт", "л", "порц"]), None, None]
+    for qty in (opening, income, received, moved, consumed, surplus, shortage, closing):
+        row.append(_fmt(qty, 3, rnd))
+        row.append(_fmt(qty * price, 2, rnd))
+    return row, opening * price, closing * price
+
+
+def generate_rows(n_items: int, seed: int = 1):
+    """Строки листа (первая — заголовок, как его читает pandas.read_excel(header=0))."""
+    rnd = random.Random(seed)
+    yield ["Расширенная оборотно-сальдовая ведомость"] + [None] * (NCOLS - 1)
+    meta = [
+        "Организация: ООО «Ресторан»", None, "Период: с 01.06.2025 по 30.06.2025", None,
+        "Склад: Основной склад", "Печать с налогами", None,
+    ]
+    for text in meta:  # pandas-индексы 0..6
+        yield [text] + [None] * (NCOLS - 1)
+    yield HEADER                                          # 7 — сюда пишутся подписи V9..AA9
+    yield SUBHEADER                                       # 8
+    yield [str(i) for i in range(1, NCOLS + 1)]           # 9
+
+    total_opening = total_closing = 0.0
+    code = 0
+    while code < n_items:
+        section = code // ITEMS_PER_SECTION + 1
+        yield ["Товар", f"Группа {section}"] + [None] * (NCOLS - 2)
+        yield [None] * 5 + ["Кол-во"] + [None] * (NCOLS - 6)
+        for _ in range(min(ITEMS_PER_SECTION, n_items - code)):
+            code += 1
+            row, opening, closing = _item_row(code, rnd)
+            total_opening += opening
+            total_closing += closing
+            yield row
+
+    total = ["Итого"] + [None] * (NCOLS - 1)
+    total[6] = _fmt(total_opening, 2, rnd)
+    total[20] = _fmt(total_closing, 2, rnd)
+    yield total
+
+
+def generate_osv(path: str, n_items: int, seed: int = 1) -> str:
+    """Записывает синтетическую ОСВ на n_items позиций в .xlsx и возвращает путь."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    for row in generate_rows(n_items, seed):
+        ws.append(row)
+    tmp_path = f"{path}.tmp"
+    wb.save(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Синтетическая ОСВ для бенчмарков")
+    parser.add_argument("items", type=int, help="Число позиций (строк товаров)")
+    parser.add_argument("-o", "--output", default=None, help="Путь к .xlsx (по умолчанию benchmarks/data/osv_<items>.xlsx)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(os.path.dirname(__file__), "data", f"osv_{args.items}.xlsx")
+    print(generate_osv(output, args.items, args.seed))
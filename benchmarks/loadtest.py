@@ -0,0 +1,343 @@
+"""Нагрузочный тест бота без Telegram: локальный поддельный Bot API на aiohttp.
+
+Поддельный сервер отвечает на getMe, getUpdates, getChatMember, getFile, sendMessage и sendDocument
+и отдаёт файлы по /file/bot<token>/<путь>. Бот (обработчики bot.py, пул процессов, кэши — с настройками
+из окружения и .env) работает с ним через polling, как с настоящим API. N пользователей проходят весь
+сценарий: отправляют ОСВ (handle_document), дожидаются ответа и отправляют процент (handle_percentage).
+У каждого пользователя своя синтетическая ОСВ (benchmarks/data, создаётся один раз), поэтому кэш
+результатов не срабатывает.
+
+    python benchmarks/loadtest.py --users 20                 # все пользователи сразу
+    python benchmarks/loadtest.py --users 50 --ramp 30       # равномерно в течение 30 секунд
+    python benchmarks/loadtest.py --users 20 --max-p95 10    # код возврата 1, если p95 больше 10 с
+
+Итог: пропускная способность (файлов в минуту) и задержки p50/p95/p99 — от отправки файла до
+результата и от отправки процента до результата. Присланная ботом книга проверяется: непустой файл .xlsx
+(иначе исход bad_document). Код возврата 1, если были ошибки или p95 выше --max-p95.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)  # корень репозитория
+
+from aiohttp import web  # noqa: E402
+
+from generate_osv import generate_osv  # noqa: E402
+
+DATA_DIR = os.path.join(HERE, "data")
+TOKEN = "123456:loadtest"
+BOT_ID = 123456
+FIRST_CHAT_ID = 10_000
+SETTLE_SECONDS = 1.0
+FILE_NAME = "Расширенная оборотно-сальдовая ведомость 30.06.2025 18.42.10.xlsx"
+
+# Ответы бота, после которых сценарий пользователя заканчивается без результата
+FAILURES = {
+    "Сейчас в очереди уже": "rejected",
+    "Очередь заполнилась": "rejected",
+    "Файл слишком большой": "too_large",
+    "Произошла ошибка": "error",
+    "Файл больше недоступен": "error",
+}
+
+
+class FakeBotAPI:
+    """Поддельный Bot API: очередь обновлений для getUpdates и ответы бота по чатам."""
+
+    def __init__(self, files: dict):
+        self.files = files  # путь файла -> содержимое
+        self.replies: dict = {}  # chat_id -> asyncio.Queue[(метод, текст или имя файла, размер файла)]
+        self._updates: list = []
+        self._new_update = asyncio.Condition()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        return app
+
+    def replies_for(self, chat_id: int) -> asyncio.Queue:
+        return self.replies.setdefault(chat_id, asyncio.Queue())
+
+    async def push(self, chat_id: int, **content) -> None:
+        """Новое сообщение пользователя chat_id (text=... или document=...) для getUpdates."""
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+            **content,
+        }
+        async with self._new_update:
+            self._updates.append({"update_id": next(self._update_ids), "message": message})
+            self._new_update.notify_all()
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        handler = getattr(self, f"api_{method}", None)
+        result = await handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        data = self.files.get(request.match_info["path"])
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=data)
+
+    async def api_getMe(self, params: dict) -> dict:
+        return {"id": BOT_ID, "is_bot": True, "first_name": "CalcPro", "username": "calcpro_loadtest_bot"}
+
+    async def api_getUpdates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        async with self._new_update:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            if not self._updates and timeout:
+                try:
+                    await asyncio.wait_for(self._new_update.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return list(self._updates)
+
+    async def api_getChatMember(self, params: dict) -> dict:
+        user_id = int(params["user_id"])
+        return {"status": "member", "user": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}}
+
+    async def api_getFile(self, params: dict) -> dict:
+        file_id = params["file_id"]
+        return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files[file_id]),
+                "file_path": file_id}
+
+    async def api_sendMessage(self, params: dict) -> dict:
+        return self._reply(params, "sendMessage", params.get("text", ""))
+
+    async def api_sendDocument(self, params: dict) -> dict:
+        document = params.get("document")
+        if isinstance(document, str) and document.startswith("attach://"):
+            # aiogram передаёт document=attach://<поле>, а сам файл — отдельным полем multipart
+            document = params.get(document[len("attach://"):])
+        size = len(document.file.read()) if hasattr(document, "file") else 0
+        return self._reply(params, "sendDocument", getattr(document, "filename", None) or "", size=size)
+
+    def _reply(self, params: dict, method: str, text: str, size: int = 0) -> dict:
+        chat_id = int(params["chat_id"])
+        self.replies_for(chat_id).put_nowait((method, text, size))
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        if method == "sendDocument":
+            message["document"] = {"file_id": f"out{message['message_id']}", "file_unique_id": "out"}
+        else:
+            message["text"] = text
+        return message
+
+
+async def simulate_user(api: FakeBotAPI, chat_id: int, file_id: str, percentage: str, timeout: float) -> dict:
+    """Один пользователь: файл -> ответ бота -> процент -> результат (документ или краткий итог)."""
+    replies = api.replies_for(chat_id)
+    started = time.perf_counter()
+    await api.push(chat_id, document={
+        "file_id": file_id, "file_unique_id": file_id, "file_name": FILE_NAME, "file_size": len(api.files[file_id]),
+    })
+    try:
+        await asyncio.wait_for(replies.get(), timeout)  # "Ваш файл принят..."
+        sent_percentage = time.perf_counter()
+        await api.push(chat_id, text=percentage)
+        while True:
+            method, text, size = await asyncio.wait_for(replies.get(), timeout)
+            if method == "sendDocument" and not (size > 0 and text.endswith(".xlsx")):
+                result = {"result": "bad_document"}  # пустое вложение или не книга .xlsx
+                break
+            if method == "sendDocument" or text.startswith("📊"):
+                finished = time.perf_counter()
+                result = {"result": "ok", "finished": finished, "total": finished - started,
+                          "processing": finished - sent_percentage}
+                break
+            result = next((r for prefix, r in FAILURES.items() if text.startswith(prefix)), None)
+            if result:
+                result = {"result": result}
+                break
+    except asyncio.TimeoutError:
+        return {"result": "timeout"}
+    await _settle(replies)
+    return result
+
+
+async def _settle(replies: asyncio.Queue) -> None:
+    """Ждёт, пока бот допишет пользователю (вложение, подсказка о пересчёте): SETTLE_SECONDS без ответов."""
+    while True:
+        try:
+            await asyncio.wait_for(replies.get(), SETTLE_SECONDS)
+        except asyncio.TimeoutError:
+            return
+
+
+def percentile(values: list, q: float) -> float:
+    """Перцентиль по ближайшему рангу (q от 0 до 100)."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def input_files(users: int, items: int) -> dict:
+    """{file_id: содержимое}: своя ОСВ на каждого пользователя (seed = номер пользователя)."""
+    files = {}
+    for seed in range(1, users + 1):
+        path = os.path.join(DATA_DIR, f"load_{items}_{seed}.xlsx")
+        if not os.path.exists(path):
+            print(f"Генерация {path}...", file=sys.stderr, flush=True)
+            generate_osv(path, items, seed=seed)
+        with open(path, "rb") as f:
+            files[f"osv{seed}"] = f.read()
+    return files
+
+
+async def run(args) -> dict:
+    files = input_files(args.users, args.items)
+    os.environ.update(BOT_TOKEN=TOKEN, CHANNEL_USERNAME="@loadtest", WEBHOOK_URL="")
+
+    import bot  # после настройки окружения: модуль читает его при импорте
+    from aiogram import Bot
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.enums import ParseMode
+
+    api = FakeBotAPI(files)
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}"))
+    tg_bot = Bot(token=TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    dp = bot.create_dispatcher()
+    os.makedirs("temp", exist_ok=True)
+    bot.executor.start()
+    warm_seconds = await bot.executor.warm()
+    polling = asyncio.create_task(dp.start_polling(tg_bot, handle_signals=False, polling_timeout=1))
+
+    started = time.perf_counter()
+    delay = args.ramp / args.users if args.users > 1 else 0.0
+
+    async def delayed(i: int) -> dict:
+        await asyncio.sleep(i * delay)
+        return await simulate_user(api, FIRST_CHAT_ID + i, f"osv{i + 1}", args.percentage, args.timeout)
+
+    results = await asyncio.gather(*(delayed(i) for i in range(args.users)))
+    # время теста — до последнего результата (без ожидания в _settle)
+    wall = max((r["finished"] for r in results if "finished" in r), default=time.perf_counter()) - started
+
+    await dp.stop_polling()
+    await polling
+    await tg_bot.session.close()
+    bot.executor.shutdown()
+    await runner.cleanup()
+    return {
+        "results": results,
+        "wall": wall,
+        "warm": warm_seconds,
+        "workers": bot.executor.max_workers,
+        "queue": bot.executor.max_queue,
+        "mode": bot.OUTPUT_MODE,
+        "stats": bot.metrics.summary(),
+    }
+
+
+def report(run_result: dict, args) -> dict:
+    results = run_result["results"]
+    ok = [r for r in results if r["result"] == "ok"]
+    outcomes = {}
+    for r in results:
+        outcomes[r["result"]] = outcomes.get(r["result"], 0) + 1
+    summary = {
+        "users": args.users,
+        "items": args.items,
+        "mode": run_result["mode"],
+        "workers": run_result["workers"],
+        "queue": run_result["queue"],
+        "outcomes": outcomes,
+        "wall_seconds": round(run_result["wall"], 3),
+        "files_per_minute": round(len(ok) / run_result["wall"] * 60, 1) if ok else 0.0,
+    }
+    for key in ("total", "processing"):
+        values = [r[key] for r in ok]
+        if values:
+            summary[key] = {f"p{q}": round(percentile(values, q), 3) for q in (50, 95, 99)}
+            summary[key]["max"] = round(max(values), 3)
+    return summary
+
+
+def print_summary(summary: dict, run_result: dict) -> None:
+    print(f"\nПользователей: {summary['users']}, позиций в ОСВ: {summary['items']}, режим ответа: {summary['mode']}")
+    print(f"Процессов обработки: {summary['workers']}, очередь: {summary['queue']} "
+          f"(прогрев {run_result['warm']:.1f} с)")
+    print("Исходы: " + ", ".join(f"{k} {v}" for k, v in sorted(summary["outcomes"].items())))
+    print(f"Время теста: {summary['wall_seconds']:.1f} с, пропускная способность: "
+          f"{summary['files_per_minute']:.1f} файлов/мин")
+    labels = {"total": "от файла до результата", "processing": "от процента до результата"}
+    for key, label in labels.items():
+        if key in summary:
+            s = summary[key]
+            print(f"  {label:<26} p50 {s['p50']:>7.2f} с  p95 {s['p95']:>7.2f} с  "
+                  f"p99 {s['p99']:>7.2f} с  max {s['max']:>7.2f} с")
+    print(f"\nМетрики бота:\n{run_result['stats']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с поддельным Bot API")
+    parser.add_argument("--users", type=int, default=20, help="Число пользователей (по умолчанию 20)")
+    parser.add_argument("--items", type=int, default=1000, help="Позиций в ОСВ каждого пользователя (1000)")
+    parser.add_argument("--ramp", type=float, default=0.0,
+                        help="За сколько секунд равномерно приходят пользователи (0 — все сразу)")
+    parser.add_argument("--percentage", default="3.5", help="Что пользователи отвечают на вопрос о проценте")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Сколько ждать каждый ответ бота, с")
+    parser.add_argument("--max-p95", type=float, default=None,
+                        help="Предельная p95 от файла до результата, с (для проверки перед выпуском)")
+    parser.add_argument("--json", default=None, help="Сохранить итоги в JSON")
+    args = parser.parse_args(argv)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    # bot.py пишет bot.log, temp/ и cache/ в текущий каталог — работаем во временном
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    os.chdir(workdir)
+    try:
+        run_result = asyncio.run(run(args))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    summary = report(run_result, args)
+    print_summary(summary, run_result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+
+    failed = sum(v for k, v in summary["outcomes"].items() if k != "ok")
+    if failed:
+        print(f"\nСценарий не завершился у {failed} пользователей.")
+        return 1
+    if args.max_p95 is not None and summary.get("total", {}).get("p95", float("inf")) > args.max_p95:
+        print(f"\np95 выше допустимой ({args.max_p95} с).")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,40 +4,43 @@ import os
 import logging
 from dotenv import load_dotenv
 import re
+import time
 from pathlib import Path
 from datetime import datetime
 from zoneinfo import ZoneInfo  # Python 3.9+
 
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, ChatMember, FSInputFile, Document
+from aiogram.types import Message, ChatMember, FSInputFile, BufferedInputFile, Document
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from fileHandler import process_excel
+# обработка файлов (pandas, openpyxl) импортируется только в рабочих процессах — бот стартует сразу
+from engine import ENGINE_VERSION, MemoryBudgetExceeded
+from workerJobs import ChatSensitivity, ChatSummary, excel_job, sensitivity_job, summary_job, warm_up
+from jobExecutor import JobExecutor, QueueFullError
+from logSetup import current_job_id, new_job_id, set_job_id, setup_logging
+from metrics import BotMetrics, start_metrics_server
+from fsmStorage import create_storage
+from historyStore import HistoryStore, HistoryTarget, period_from_filename
+from resultCache import ResultCache
+from subscriptionCache import SubscriptionCache
+from uploadStore import UploadStore, remove_file
 
 # Загружаем переменные окружения
 load_dotenv()
 
-# Настраиваем логгер
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-# Формат логов
-formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-
-# Обработчик для файла
-file_handler = logging.FileHandler("bot.log")
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-
-# Обработчик для терминала
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
+# Логирование: запись на диск в фоновом потоке через очередь (и из процессов обработки),
+# файл LOG_FILE в JSON с ротацией по размеру и времени, в терминал — текстом
+log_queue = setup_logging(
+    path=os.getenv("LOG_FILE", "bot.log"),
+    max_bytes=int(float(os.getenv("LOG_MAX_MB", "10")) * 1024 * 1024),
+    rotate_seconds=float(os.getenv("LOG_ROTATE_HOURS", "24")) * 3600,
+    backup_count=int(os.getenv("LOG_BACKUPS", "7")),
+    file_format=os.getenv("LOG_FORMAT", "json"),
+)
 
 # Получаем токен из .env
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -49,6 +52,87 @@ CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME")
 if not CHANNEL_USERNAME:
     raise ValueError("CHANNEL_USERNAME not set in .env file")
 
+# Хранилище состояний диалогов: memory (по умолчанию), sqlite:///путь.db или redis://...
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+
+# Режим webhook: если задан WEBHOOK_URL, бот принимает обновления по HTTP вместо polling.
+# Несколько процессов могут слушать один порт (SO_REUSEPORT) с общим FSM_STORAGE.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+# Администраторы (команда /stats): id через запятую
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+
+# Метрики: /stats для администраторов и, если задан METRICS_PORT, локальный HTTP /metrics (Prometheus)
+metrics = BotMetrics()
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Пул процессов для обработки файлов: WORKERS одновременно, ещё QUEUE_SIZE в очереди
+WORKERS = int(os.getenv("WORKERS", "2"))
+QUEUE_SIZE = int(os.getenv("QUEUE_SIZE", "10"))
+# процессы запускаются и прогреваются (импорты, пробная ОСВ) в фоне сразу после старта бота
+executor = JobExecutor(max_workers=WORKERS, max_queue=QUEUE_SIZE, on_wait=metrics.queue_wait_seconds.observe,
+                       initializer=warm_up, initargs=(log_queue,))
+
+# Кэш готовых результатов (одинаковый файл + тот же процент): CACHE_MAX_MB=0 отключает кэш
+result_cache = ResultCache(
+    directory=os.getenv("CACHE_DIR", "cache"),
+    max_bytes=int(float(os.getenv("CACHE_MAX_MB", "200")) * 1024 * 1024),
+    max_age_seconds=float(os.getenv("CACHE_MAX_AGE_HOURS", "72")) * 3600,
+)
+
+# Кэш проверок подписки: подписанных помним дольше, неподписанных — недолго
+subscription_cache = SubscriptionCache(
+    positive_ttl=float(os.getenv("SUBSCRIPTION_TTL_SECONDS", "600")),
+    negative_ttl=float(os.getenv("SUBSCRIPTION_NEGATIVE_TTL_SECONDS", "30")),
+    max_size=int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "10000")),
+)
+
+# Снимки разобранных файлов для пересчёта с другим процентом без повторной загрузки
+SNAPSHOT_DIR = Path("temp") / "snapshots"
+SNAPSHOT_TTL_MINUTES = int(os.getenv("SNAPSHOT_TTL_MINUTES", "30"))
+SNAPSHOT_TTL_SECONDS = SNAPSHOT_TTL_MINUTES * 60
+
+# История результатов по позициям (команда /top): путь к SQLite, пусто — история не ведётся
+HISTORY_DB = os.getenv("HISTORY_DB", "")
+TOP_DEFAULT_PERIODS = 6
+
+# Размер файлов: принимаем до MAX_FILE_MB (Bot API отдаёт ботам файлы до 20 МБ); файлы больше LARGE_FILE_MB
+# обрабатываются в режиме больших файлов — частями, не больше JOB_MEMORY_MB памяти на одно задание
+MAX_FILE_MB = float(os.getenv("MAX_FILE_MB", "20"))
+LARGE_FILE_BYTES = int(float(os.getenv("LARGE_FILE_MB", "2")) * 1024 * 1024)
+JOB_MEMORY_BYTES = int(float(os.getenv("JOB_MEMORY_MB", "512")) * 1024 * 1024)
+
+# Ответ на процент: xlsx — книга с подсветкой, summary — краткий итог в чате (топ SUMMARY_TOP позиций)
+# и таблица превышений вложением (SUMMARY_ATTACHMENT: csv, json или пусто), книга — по команде /xlsx
+OUTPUT_MODE = os.getenv("OUTPUT_MODE", "xlsx").lower()
+SUMMARY_TOP = int(os.getenv("SUMMARY_TOP", "10"))
+SUMMARY_ATTACHMENT = os.getenv("SUMMARY_ATTACHMENT", "csv").lower()
+# Книга: streaming — готовые значения, formulas — формулы Excel от ячейки с процентом (его можно менять в книге;
+# файлы крупнее LARGE_FILE_MB всё равно пишутся значениями). Кэш результатов у способов записи раздельный.
+XLSX_WRITER = os.getenv("XLSX_WRITER", "streaming").lower()
+RESULT_VERSION = ENGINE_VERSION if XLSX_WRITER == "streaming" else f"{ENGINE_VERSION}-{XLSX_WRITER}"
+# /sweep без аргументов сравнивает эти проценты; за раз — не больше SWEEP_MAX_VALUES значений
+SWEEP_PERCENTAGES = os.getenv("SWEEP_PERCENTAGES", "1 2 3.5 5")
+SWEEP_MAX_VALUES = 20
+
+# Загруженные файлы: до SPILL_THRESHOLD_MB — в памяти, больше — во временных файлах (удаляются автоматически).
+# С общим FSM_STORAGE или в режиме webhook следующее сообщение диалога может обработать другой процесс (или
+# процесс после перезапуска), которому память этого недоступна, — тогда все загрузки пишутся в temp/uploads.
+SHARED_UPLOADS = FSM_STORAGE != "memory" or bool(WEBHOOK_URL)
+SPILL_THRESHOLD_MB = 0.0 if SHARED_UPLOADS else float(os.getenv("SPILL_THRESHOLD_MB", "4"))
+UPLOAD_TTL_MINUTES = int(os.getenv("UPLOAD_TTL_MINUTES", "60"))
+uploads = UploadStore(
+    spill_dir=str(Path("temp") / "uploads"),
+    spill_bytes=int(SPILL_THRESHOLD_MB * 1024 * 1024),
+    max_memory_bytes=int(float(os.getenv("UPLOAD_MEMORY_MB", "256")) * 1024 * 1024),
+    max_age_seconds=max(UPLOAD_TTL_MINUTES, SNAPSHOT_TTL_MINUTES) * 60,
+)
+
 FILENAME_PATTERN = re.compile(
     r"^Расширенная оборотно-сальдовая ведомость \d{2}\.\d{2}\.\d{4} \d{2}\.\d{2}\.\d{2}\.xlsx$"
 )
@@ -84,6 +168,10 @@ END_MESSAGE = """📊 Анализ завершён!
 🎯 Рекомендуем обратить внимание на эти строки — они могут указывать на ошибки в учёте, пересортицу или проблемы с инвентаризацией.
 
 Если нужна помощь с расшифровкой отклонений или аудитом — напишите нам, поможем разобраться!"""
+# добавляется к подписи, только если книгу записал writer="formulas" (большие файлы пишутся значениями)
+FORMULAS_NOTE = """
+
+✏️ Допустимый процент можно поменять прямо в файле — ячейка «Допустимое отклонение» справа от подписей в 9-й строке: отклонения, суммы и подсветка пересчитаются."""
 
 # --- FSM Состояния ---
 class FileProcessing(StatesGroup):
@@ -100,16 +188,49 @@ async def handle_document(message: Message, state: FSMContext):
         return
 
 
-    if document.file_size > 1 * 1024 * 1024:
-        await message.answer("Файл слишком большой. Максимальный размер — 1 МБ.")
+    if document.file_size > MAX_FILE_MB * 1024 * 1024:
+        await message.answer(f"Файл слишком большой. Максимальный размер — {MAX_FILE_MB:g} МБ.")
         return
 
 
-    file = await message.bot.get_file(document.file_id)
-    file_path = f"temp/{document.file_name}"
-    await message.bot.download_file(file.file_path, destination=file_path)
+    # предыдущий файл пользователя больше не нужен
+    await reset_state(state)
+    uploads.sweep()
+    job_id = new_job_id()  # помечает записи лога по этому файлу, включая процессы обработки
+    set_job_id(job_id)
 
-    await state.update_data(file_path=file_path, file_name=document.file_name)
+    # ключ уникален для пользователя и файла — одинаковые имена файлов у разных людей не пересекаются
+    upload_key = f"{user_id}_{document.file_unique_id}"
+    file = await message.bot.get_file(document.file_id)
+    started = time.perf_counter()
+    spilled = uploads.wants_spill(document.file_size)  # решение до put: после него память уже занята файлом
+    if spilled:
+        spill_path = uploads.spill_path(upload_key, Path(document.file_name).suffix.lower())
+        await message.bot.download_file(file.file_path, destination=spill_path)
+        uploads.put(upload_key, spill_path)
+    else:
+        buffer = await message.bot.download_file(file.file_path)
+        uploads.put(upload_key, buffer.getvalue())
+    download_seconds = time.perf_counter() - started
+    metrics.download_seconds.observe(download_seconds)
+    logging.info("Файл получен", extra={
+        "event": "upload", "user_id": user_id, "file_name": document.file_name, "file_size": document.file_size,
+        "spilled": spilled, "download_seconds": round(download_seconds, 3),
+    })
+
+    snapshot_path = None
+    if SNAPSHOT_TTL_SECONDS > 0:
+        sweep_snapshots()
+        snapshot_path = str(SNAPSHOT_DIR / f"{upload_key}.npz")
+
+    await state.set_data({
+        "job_id": job_id,
+        "upload_key": upload_key,
+        "file_name": document.file_name,
+        "file_size": document.file_size,
+        "snapshot_path": snapshot_path,
+        "snapshot_expires": None,
+    })
     await message.answer(
         "Ваш файл принят для дальнейшей обработки.\n\n"
         "Пожалуйста, укажите допустимый процент отклонения. Например:\n"
@@ -123,8 +244,10 @@ async def handle_document(message: Message, state: FSMContext):
 async def handle_percentage(message: Message, state: FSMContext):
     user_input = message.text.strip().lower()
     data = await state.get_data()
-    file_path = data["file_path"]
-    file_name = data["file_name"]
+    set_job_id(data.get("job_id"))
+    source = await job_source(message, state, data)
+    if source is None:
+        return
 
     try:
         if user_input == "нет":
@@ -135,26 +258,316 @@ async def handle_percentage(message: Message, state: FSMContext):
         await message.answer("Введите число, например \"4.5\" или \"Нет\".")
         return
 
-    # output_path = f"temp/processed_{file_name}"
-
-    # формируем имя вида: temp/[YYYY-MM-DD_HH-MM-SS] ИмяФайла.xlsx
-    stem = Path(file_name).stem
+    await state.update_data(percentage=percentage)  # для /xlsx после краткого итога
+    logging.info("Процент получен", extra={"event": "percentage", "percentage": percentage, "mode": OUTPUT_MODE})
+    if OUTPUT_MODE == "summary":
+        await send_summary(message, state, data, source, percentage)
+    else:
+        await send_workbook(message, state, data, source, percentage)
+
+async def job_source(message: Message, state: FSMContext, data: dict):
+    """Загруженный файл из состояния; None (и ответ пользователю), если он истёк или недоступен."""
+    expires = data.get("snapshot_expires")
+    if expires and time.time() > expires:
+        await reset_state(state)
+        await message.answer("Время для пересчёта этого файла истекло. Пожалуйста, отправьте файл заново.")
+        return None
+
+    source = uploads.get(data.get("upload_key"))
+    if source is None:
+        await reset_state(state)
+        await message.answer("Файл больше недоступен. Пожалуйста, отправьте его заново.")
+    return source
+
+def history_target(message: Message, data: dict):
+    if not HISTORY_DB:
+        return None
+    file_name = data["file_name"]
+    return HistoryTarget(HISTORY_DB, str(message.from_user.id), period_from_filename(file_name), file_name)
+
+async def send_workbook(message: Message, state: FSMContext, data: dict, source, percentage: float,
+                        record_history: bool = True):
+    """Полная книга с подсветкой (OUTPUT_MODE=xlsx или команда /xlsx)."""
+    upload_key = data["upload_key"]
+    # формируем имя вида: [YYYY-MM-DD_HH-MM-SS] ИмяФайла.xlsx
+    stem = Path(data["file_name"]).stem
     ts = datetime.now(ZoneInfo("Asia/Almaty")).strftime("%Y-%m-%d_%H-%M-%S")
     output_name = f"[{ts}] {stem}.xlsx"
-    output_path = str(Path("temp") / output_name)
-
-    await message.answer("Идет обработка файла, пожалуйста подождите...")
+    # результат большого (выгруженного на диск) файла тоже пишем на диск, небольшого — возвращаем в памяти
+    output_path = uploads.spill_path(f"{upload_key}_result", ".xlsx") if isinstance(source, str) else None
+
+    history = history_target(message, data) if record_history else None
+    memory_budget = job_memory_budget(data)
+    # largeFile пишет только значения: ячейки с процентом в такой книге нет
+    caption = END_MESSAGE + FORMULAS_NOTE if XLSX_WRITER == "formulas" and memory_budget is None else END_MESSAGE
+
+    cache_key = None
+    # с историей кэш не используем: результаты по позициям нужно сохранить и при повторной обработке
+    if result_cache.enabled and history is None:
+        cache_key = await asyncio.to_thread(ResultCache.make_key, source, percentage, RESULT_VERSION)
+        cached_path = result_cache.get(cache_key)
+        if cached_path:
+            logging.info(
+                f"Результат из кэша для пользователя id={message.from_user.id} "
+                f"(попаданий: {result_cache.hits}, промахов: {result_cache.misses})",
+                extra={"event": "job", "outcome": "cache_hit"},
+            )
+            await message.answer_document(FSInputFile(cached_path, filename=output_name), caption=caption)
+            metrics.jobs.inc(result="cache_hit")
+            await finish_job(message, state)
+            return
 
     try:
-        process_excel(file_path, output_path, allowed_deviation_percentage=percentage)
-        await message.answer_document(FSInputFile(output_path), caption=END_MESSAGE)
+        result = await run_job(
+            message, state, excel_job, source, output_path,
+            allowed_deviation_percentage=percentage, writer=XLSX_WRITER, snapshot_path=data.get("snapshot_path"),
+            history=history, memory_budget=memory_budget,
+        )
+        if result is None:
+            return
+        if isinstance(result, bytes):
+            document = BufferedInputFile(result, filename=output_name)
+        else:
+            document = FSInputFile(result, filename=output_name)
+        await message.answer_document(document, caption=caption)
+        logging.info("Результат отправлен", extra={"event": "sent", "mode": "xlsx"})
+        if cache_key:
+            await asyncio.to_thread(result_cache.put, cache_key, result)
+    finally:
+        remove_file(output_path)
+
+    await finish_job(message, state)
+
+async def send_summary(message: Message, state: FSMContext, data: dict, source, percentage: float):
+    """Краткий итог в чате без построения книги (OUTPUT_MODE=summary) и таблица превышений вложением."""
+    summary = await run_job(
+        message, state, summary_job, source, percentage, top=SUMMARY_TOP, attachment=SUMMARY_ATTACHMENT,
+        snapshot_path=data.get("snapshot_path"), history=history_target(message, data),
+        memory_budget=job_memory_budget(data),
+    )
+    if summary is None:
+        return
+    await message.answer(format_summary(summary, percentage), parse_mode=None)
+    if summary.table:
+        file_name = f"Превышения {Path(data['file_name']).stem}.{SUMMARY_ATTACHMENT}"
+        await message.answer_document(BufferedInputFile(summary.table, filename=file_name))
+    logging.info("Результат отправлен", extra={"event": "sent", "mode": "summary"})
+    await finish_job(message, state)
+
+def job_memory_budget(data: dict):
+    """Большие файлы — частями в пределах бюджета памяти (без снимка: пересчёт читает файл заново)."""
+    return JOB_MEMORY_BYTES if (data.get("file_size") or 0) > LARGE_FILE_BYTES else None
+
+async def run_job(message: Message, state: FSMContext, func, *args, **kwargs):
+    """Выполняет func в пуле процессов; возвращает результат или None, если об ошибке уже сообщено.
+
+    Итог задания (outcome, время этапов) пишется в лог одной записью с event="job".
+    """
+    if executor.is_full:
+        metrics.jobs.inc(result="rejected")
+        logging.warning("Очередь заполнена", extra={
+            "event": "job", "outcome": "rejected", "pending": executor.pending,
+        })
+        await message.answer(
+            f"Сейчас в очереди уже {executor.pending} файлов. "
+            "Пожалуйста, отправьте процент ещё раз через пару минут."
+        )
+        return None
+
+    position = executor.queue_position
+    if position:
+        await message.answer(f"Ваш файл в очереди на обработку, место в очереди: {position}. Пожалуйста, подождите...")
+    elif OUTPUT_MODE != "summary":
+        await message.answer("Идет обработка файла, пожалуйста подождите...")
+
+    started = time.perf_counter()
+    try:
+        result, stats = await executor.run(func, *args, job_id=current_job_id(), **kwargs)
+    except QueueFullError:
+        metrics.jobs.inc(result="rejected")
+        logging.warning("Очередь заполнена", extra={
+            "event": "job", "outcome": "rejected", "pending": executor.pending,
+        })
+        await message.answer(
+            "Очередь заполнилась, пока мы отвечали. Пожалуйста, отправьте процент ещё раз через пару минут."
+        )
+        return None
+    except MemoryBudgetExceeded as e:
+        logging.warning(f"Файл пользователя id={message.from_user.id} не уложился в бюджет памяти: {e}", extra={
+            "event": "job", "outcome": "too_large", "seconds": round(time.perf_counter() - started, 3),
+        })
+        metrics.jobs.inc(result="too_large")
+        await message.answer(
+            "Файл слишком большой для обработки. Попробуйте сформировать ОСВ за меньший период "
+            "или по отдельным складам."
+        )
+        await reset_state(state)
+        return None
     except Exception as e:
-        logging.exception("Ошибка при обработке файла:")
+        logging.exception("Ошибка при обработке файла:", extra={
+            "event": "job", "outcome": "error", "seconds": round(time.perf_counter() - started, 3),
+        })
+        metrics.jobs.inc(result="error")
         await message.answer("Произошла ошибка при обработке файла.")
+        await reset_state(state)
+        return None
+    metrics.observe_job(stats)
+    metrics.jobs.inc(result="ok")
+    logging.info("Задание выполнено", extra={
+        "event": "job", "outcome": "ok", "seconds": round(time.perf_counter() - started, 3),
+        "stages": {stage: round(sec, 4) for stage, sec in stats.get("timings", {}).items()},
+        "file_bytes": stats.get("file_bytes"), "rows": stats.get("rows"),
+        # в книге с формулами (XLSX_WRITER=formulas) суммы считает Excel — в stats их нет
+        **{key: round(stats[key], 2) for key in ("sum_excess", "sum_shortage") if key in stats},
+    })
+    return result
+
+def format_summary(summary: ChatSummary, percentage: float) -> str:
+    lines = [
+        f"📊 Анализ завершён (допустимое отклонение {percentage * 100:g}%).",
+        "",
+        f"Позиций: {summary.items}. Превышение по излишкам: {summary.surplus}, по недостачам: {summary.shortage}.",
+        f"Итого сумма превышения: излишки {format_money(summary.sum_excess)}, "
+        f"недостачи {format_money(summary.sum_shortage)}.",
+    ]
+    if summary.top:
+        lines += ["", f"Наибольшие суммы превышения (топ-{len(summary.top)}):"]
+        for i, row in enumerate(summary.top, 1):
+            amounts = [
+                f"{label} {format_money(value)}"
+                for label, value in (("излишки", row.z), ("недостачи", row.aa)) if value
+            ]
+            if not amounts:  # без цены сумму не посчитать — показываем количество
+                amounts = [f"превышение {format_money(row.y)}"]
+            lines.append(f"{i}. {row.name or row.item_key} (код {row.item_key}) — {', '.join(amounts)}")
+    return "\n".join(lines)
+
+# Обработчик команды /sweep [проценты] — превышения и суммы сразу при нескольких процентах
+async def cmd_sweep(message: Message, state: FSMContext):
+    data = await state.get_data()
+    set_job_id(data.get("job_id"))
+    if not data.get("upload_key"):
+        await message.answer("Сначала отправьте файл ОСВ.")
+        return
+    args = message.text.split(maxsplit=1)
+    try:
+        percentages = parse_percentages(args[1] if len(args) > 1 else SWEEP_PERCENTAGES)
+    except ValueError:
+        await message.answer(
+            "Укажите проценты через пробел, например: /sweep 1 2 3.5 5, или диапазон с шагом: /sweep 1-5:0.5 "
+            f"(не больше {SWEEP_MAX_VALUES} значений).",
+            parse_mode=None,
+        )
+        return
+    source = await job_source(message, state, data)
+    if source is None:
+        return
 
+    logging.info("Проценты для сравнения получены", extra={"event": "percentage", "percentages": percentages,
+                                                           "mode": "sensitivity"})
+    result = await run_job(
+        message, state, sensitivity_job, source, [p / 100.0 for p in percentages],
+        snapshot_path=data.get("snapshot_path"), memory_budget=job_memory_budget(data),
+    )
+    if result is None:
+        return
+    await message.answer(format_sensitivity(result))
+    logging.info("Результат отправлен", extra={"event": "sent", "mode": "sensitivity"})
+    await finish_job(message, state)
+
+SWEEP_RANGE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)-(\d+(?:\.\d+)?)(?::(\d+(?:\.\d+)?))?$")
+
+def parse_percentages(text: str) -> list:
+    """"1 2 3,5 5" или диапазон "1-5:0,5" (шаг по умолчанию 1) -> [1.0, 2.0, 3.5, 5.0] — проценты по возрастанию.
+
+    ValueError, если значение не число, диапазон пустой или значений больше SWEEP_MAX_VALUES.
+    """
+    values = set()
+    for token in text.replace(",", ".").replace(";", " ").split():
+        match = SWEEP_RANGE_PATTERN.match(token)
+        if match is None:
+            values.add(float(token))
+            continue
+        start, stop, step = float(match[1]), float(match[2]), float(match[3] or 1)
+        if step <= 0 or stop < start or (stop - start) / step >= SWEEP_MAX_VALUES:
+            raise ValueError(f"Неверный диапазон: {token}")
+        count = int((stop - start) / step + 1e-9) + 1
+        values.update(round(start + i * step, 6) for i in range(count))
+    if not values or len(values) > SWEEP_MAX_VALUES or not all(0 <= v < float("inf") for v in values):
+        raise ValueError(f"Нужно от 1 до {SWEEP_MAX_VALUES} неотрицательных процентов")
+    return sorted(values)
+
+def format_sensitivity(result: ChatSensitivity) -> str:
+    """Таблица /sweep моноширинным шрифтом (HTML <pre>): процент, число превышений и суммы "Итого"."""
+    header = ["Процент", "Изл.", "Нед.", "Сумма изл.", "Сумма нед."]
+    rows = [
+        [
+            f"{row.percentage * 100:g}".replace(".", ",") + "%",
+            str(row.surplus),
+            str(row.shortage),
+            f"{row.sum_excess:,.0f}".replace(",", " "),
+            f"{row.sum_shortage:,.0f}".replace(",", " "),
+        ]
+        for row in result.rows
+    ]
+    widths = [max(len(line[i]) for line in [header] + rows) for i in range(len(header))]
+    table = "\n".join("  ".join(cell.rjust(width) for cell, width in zip(line, widths)) for line in [header] + rows)
+    return (
+        f"📈 Превышения нормы при разных процентах (позиций: {result.items}):\n\n"
+        f"<pre>{table}</pre>\n\n"
+        "Изл./Нед. — позиций с превышением по излишкам и недостачам, суммы — «Итого» превышения нормы. "
+        "Чтобы получить результат, отправьте выбранный процент."
+    )
+
+# Обработчик команды /xlsx — полная книга с подсветкой после краткого итога
+async def cmd_xlsx(message: Message, state: FSMContext):
+    data = await state.get_data()
+    set_job_id(data.get("job_id"))
+    percentage = data.get("percentage")
+    if percentage is None:
+        await message.answer("Сначала отправьте файл ОСВ и процент отклонения.")
+        return
+    source = await job_source(message, state, data)
+    if source is None:
+        return
+    # история уже записана при расчёте итога
+    await send_workbook(message, state, data, source, percentage, record_history=False)
+
+async def finish_job(message: Message, state: FSMContext):
+    """После отправки результата оставляем файл для пересчёта с другим процентом (на SNAPSHOT_TTL_MINUTES)."""
+    if SNAPSHOT_TTL_SECONDS <= 0:
+        await reset_state(state)
+        return
+    await state.update_data(snapshot_expires=time.time() + SNAPSHOT_TTL_SECONDS)
+    hint = " Полный файл с подсветкой — командой /xlsx." if OUTPUT_MODE == "summary" else ""
+    await message.answer(
+        "Чтобы пересчитать этот же файл с другим процентом, просто отправьте новое число "
+        f"в течение {SNAPSHOT_TTL_MINUTES} мин.{hint} Сравнить несколько процентов сразу — /sweep 1 2 3.5 5."
+    )
+
+async def reset_state(state: FSMContext):
+    """Сбрасывает диалог и удаляет загруженный файл и его снимок."""
+    data = await state.get_data()
+    uploads.discard(data.get("upload_key"))
+    remove_file(data.get("snapshot_path"))
     await state.clear()
 
+def sweep_snapshots():
+    """Удаляет снимки старше SNAPSHOT_TTL_MINUTES."""
+    if not SNAPSHOT_DIR.exists():
+        return
+    deadline = time.time() - SNAPSHOT_TTL_SECONDS
+    for path in SNAPSHOT_DIR.glob("*.npz"):
+        try:
+            if path.stat().st_mtime < deadline:
+                path.unlink()
+        except OSError:
+            pass
+
 async def check_subscription(bot: Bot, user_id: int) -> bool:
+    return await subscription_cache.get(user_id, lambda: fetch_subscription(bot, user_id))
+
+async def fetch_subscription(bot: Bot, user_id: int) -> bool:
     try:
         member: ChatMember = await bot.get_chat_member(chat_id=CHANNEL_USERNAME, user_id=user_id)
         return member.status in ("member", "administrator", "creator")
@@ -173,29 +586,127 @@ async def cmd_help(message: Message):
 async def check_user_subscription(message: Message, bot: Bot):
     user_id = message.from_user.id
     logging.info(f"Получена команда /check от пользователя id={user_id}")
+    subscription_cache.invalidate(user_id)  # пользователь мог только что подписаться
     if await check_subscription(bot, user_id):
         await message.answer("Вы подписаны на канал. Теперь вы можете отправлять файл на обработку.")
     else:
         await message.answer("Подписка не найдена. Пожалуйста, подпишитесь на канал.")
 
+# Обработчик команды /top [N] — позиции с превышением нормы в нескольких из последних N периодов
+async def cmd_top(message: Message):
+    if not HISTORY_DB:
+        await message.answer("История обработок не ведётся.")
+        return
+    parts = message.text.split()
+    periods = max(1, int(parts[1])) if len(parts) > 1 else TOP_DEFAULT_PERIODS
+    owner = str(message.from_user.id)
+
+    def query():
+        with HistoryStore(HISTORY_DB) as store:
+            return store.periods(owner, periods), store.top_offenders(owner, periods=periods, limit=10)
+
+    recent, offenders = await asyncio.to_thread(query)
+    if not recent:
+        await message.answer("История пуста: обработайте хотя бы одну ОСВ.")
+        return
+    if not offenders:
+        await message.answer(f"За последние периоды ({len(recent)}) повторных превышений нормы нет.")
+        return
+    lines = [f"Чаще всего превышают норму (последние периоды: {', '.join(reversed(recent))}):", ""]
+    for i, o in enumerate(offenders, 1):
+        lines.append(
+            f"{i}. {o.name or o.item_key} (код {o.item_key}) — {o.periods_over} из {len(recent)}; "
+            f"излишки {format_money(o.sum_excess)}, недостачи {format_money(o.sum_shortage)}"
+        )
+    await message.answer("\n".join(lines), parse_mode=None)
+
+def format_money(value: float) -> str:
+    """1234567.5 -> "1 234 567,50" """
+    return f"{value:,.2f}".replace(",", " ").replace(".", ",")
+
+# Обработчик команды /stats (только для ADMIN_IDS)
+async def cmd_stats(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await message.answer(
+        f"{metrics.summary()}\n\n"
+        f"Очередь: {executor.pending} (процессов {executor.max_workers}, мест {executor.max_queue}).\n"
+        f"Кэш результатов: попаданий {result_cache.hits}, промахов {result_cache.misses}.\n"
+        f"Кэш подписок: попаданий {subscription_cache.hits}, промахов {subscription_cache.misses}.",
+        parse_mode=None,
+    )
+
 def is_valid_filename(filename: str) -> bool:
     return bool(FILENAME_PATTERN.match(filename))
 
 # Основная функция
-async def main():
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    # await bot.delete_webhook(drop_pending_updates=True)
-
-    dp = Dispatcher(storage=MemoryStorage())
+def create_dispatcher() -> Dispatcher:
+    """Dispatcher с хранилищем FSM_STORAGE и всеми обработчиками бота."""
+    dp = Dispatcher(storage=create_storage(FSM_STORAGE))
     dp.message.register(cmd_start, F.text == "/start")
     dp.message.register(check_user_subscription, F.text == "/check")
     dp.message.register(cmd_help, F.text == "/help")
+    dp.message.register(cmd_stats, F.text == "/stats")
+    dp.message.register(cmd_top, F.text.regexp(r"^/top(\s+\d{1,3})?$"))
+    dp.message.register(cmd_xlsx, F.text == "/xlsx")
+    dp.message.register(cmd_sweep, F.text.regexp(r"^/sweep(\s|$)"))
     dp.message.register(handle_document, F.document)
     dp.message.register(handle_percentage, F.text, FileProcessing.waiting_for_percentage)
+    return dp
+
+async def main():
+    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # await bot.delete_webhook(drop_pending_updates=True)
+
+    dp = create_dispatcher()
 
     os.makedirs("temp", exist_ok=True)
-    logging.info("Бот запущен.")
-    await dp.start_polling(bot)
+    executor.start()
+    warm_task = asyncio.create_task(warm_workers())
+    metrics_runner = await start_metrics_server(metrics, METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    logging.info(f"Бот запущен. Процессов обработки: {executor.max_workers}, очередь: {executor.max_queue}.")
+    if SHARED_UPLOADS:
+        logging.info("Общий FSM_STORAGE или webhook: загрузки сохраняются в temp/uploads (SPILL_THRESHOLD_MB=0).")
+    try:
+        if WEBHOOK_URL:
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        warm_task.cancel()
+        executor.shutdown()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+
+async def warm_workers():
+    """Поднимает процессы обработки в фоне: бот отвечает сразу, а первое задание не ждёт импортов."""
+    try:
+        seconds = await executor.warm()
+    except Exception:
+        logging.exception("Не удалось запустить процессы обработки заранее:")
+        return
+    logging.info(f"Процессы обработки готовы за {seconds:.1f} с.")
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Принимает обновления на WEBHOOK_HOST:WEBHOOK_PORT{WEBHOOK_PATH} до остановки процесса."""
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    # адрес одинаковый для всех процессов, поэтому повторная установка безопасна
+    await bot.set_webhook(f"{WEBHOOK_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=True).start()
+    logging.info(f"Webhook: {WEBHOOK_URL}{WEBHOOK_PATH}, слушаем {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 # Запуск
 if __name__ == "__main__":
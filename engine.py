@@ -0,0 +1,8 @@
+"""Общее для расчёта, заданий пула и бота — без тяжёлых зависимостей (импортируется и процессом бота)."""
+
+# Версия логики обработки: увеличивайте при любом изменении результата — от неё зависит ключ кэша результатов
+ENGINE_VERSION = "2"
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """Задание не укладывается в бюджет памяти (см. largeFile.MemoryBudget)."""
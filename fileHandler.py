@@ -1,11 +1,25 @@
+import datetime
+import io
+import json
+import logging
 import os
 import re
-from typing import Optional
+import time
+from contextlib import contextmanager
+from copy import copy
+from typing import BinaryIO, Callable, NamedTuple, Optional, Union
 
 import numpy as np
 import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.formatting.rule import FormulaRule
 from openpyxl.utils import get_column_letter
-from openpyxl.styles import Alignment, PatternFill, Border, Side, Font
+from openpyxl.styles import Alignment, PatternFill, Border, Side, Font, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
+
+from historyStore import HistoryStore, HistoryTarget
+from osvReader import Source, read_osv, read_source
 
 # -------------------------------
 # Helpers
@@ -53,240 +67,699 @@ def to_number(val):
         return val
 
 
-def _read_excel_auto(file_path: str) -> pd.DataFrame:
-    """Читает ТОЛЬКО .xls (это осознанная логика бота) и приводит всё к str для единообразной чистки.
-    - .xls => engine="xlrd" (нужен xlrd==1.2.0). Если его нет — подсказываем пользователю.
-    - Любые другие расширения (.xlsx/.xlsm и т.д.) — вызывают понятную ошибку.
+# те же символы, что в _space_re
+_space_codes = np.array([0x20, 0xA0, *range(0x2000, 0x200C), 0x202F, 0x205F], dtype=np.uint32)
+_empty_tokens = ["", "nan", "none", "null"]
+_number_starts = ["+", "-", "(", "\u2212"]
+
+
+def _squeeze_number_chars(s: np.ndarray) -> np.ndarray:
+    """Удаляет пробелы/разделители тысяч и меняет запятую на точку во всём массиве строк разом.
+
+    Работает по матрице кодов символов (numpy str_ хранит строку как UCS-4), без вызова Python на ячейку.
     """
-    ext = os.path.splitext(file_path)[1].lower()
-    if ext == ".xls":
-        try:
-            return pd.read_excel(file_path, sheet_name=0, dtype=str, engine="xlrd")
-        except Exception as e:
-            raise RuntimeError(
-                "Не удалось прочитать .xls. Убедитесь, что установлен xlrd==1.2.0 (в xlrd>=2.0 поддержка .xls удалена).\n"
-                "Команда: pip install 'xlrd==1.2.0'"
-            ) from e
-    # Нам намеренно НЕ нужны .xlsx/.xlsm и прочие форматы на входе
-    raise RuntimeError(
-        "Поддерживается только входной формат .xls. По задумке бота .xlsx/.xlsm не отправляются."
+    width = s.dtype.itemsize // 4
+    if width == 0:
+        return s
+    codes = np.ascontiguousarray(s).view(np.uint32).reshape(len(s), width)
+    codes = np.where(codes == ord(","), np.uint32(ord(".")), codes)
+    keep = ~np.isin(codes, _space_codes)
+    if not keep.all():
+        rows, cols = np.nonzero(keep)
+        packed = np.zeros_like(codes)
+        packed[rows, (np.cumsum(keep, axis=1) - 1)[rows, cols]] = codes[rows, cols]
+        codes = packed
+    return codes.view(f"<U{width}").ravel()
+
+
+def _parse_number_strings(s: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Разбор массива строк (numpy str_, уже без пробелов по краям) теми же правилами, что в to_number.
+
+    Возвращает (ok, numbers): ok — строка является числом, numbers — значения (NaN, где не ok).
+    """
+    s = np.strings.replace(s, "\u2212", "-")
+    # Отрицательные в скобках: (123,45) -> -123,45
+    is_neg = np.strings.startswith(s, "(") & np.strings.endswith(s, ")")
+    if is_neg.any():
+        s[is_neg] = np.strings.strip(np.strings.slice(s[is_neg], 1, -1))
+    s = _squeeze_number_chars(s)
+
+    # Эквивалент re.fullmatch(r"[+-]?\d+(?:\.\d+)?"): знак убираем, остаётся одна точка между цифрами
+    signed = np.strings.startswith(s, "+") | np.strings.startswith(s, "-")
+    body = np.where(signed, np.strings.slice(s, 1, np.strings.str_len(s)), s)
+    dots = np.strings.count(body, ".")
+    digits = np.strings.replace(body, ".", "", 1)
+    ok = (
+        np.strings.isdecimal(digits)
+        & (dots <= 1)
+        & ~np.strings.startswith(body, ".")
+        & ~np.strings.endswith(body, ".")
     )
 
+    numbers = np.full(s.shape, np.nan)
+    parsed = s[ok].astype(np.float64)
+    numbers[ok] = np.where(is_neg[ok], -parsed, parsed)
+    return ok, numbers
+
+
+def _parse_number_column(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Колоночный аналог to_number для одной object-колонки.
+
+    Возвращает (numbers, is_text): numbers — float64 (NaN для пустых и нечисловых ячеек),
+    is_text — маска ячеек, которые to_number вернул бы как есть (не число).
+    Строки, которые не могут начинаться как число, в разбор не идут — текстовые колонки
+    пропускаются после одной дешёвой проверки.
+    """
+    n = len(values)
+    numbers = np.full(n, np.nan)
+    is_text = np.zeros(n, dtype=bool)
+    missing = pd.isna(values)
+    if pd.api.types.infer_dtype(values[~missing], skipna=False) in ("string", "empty"):
+        is_str = ~missing  # обычный случай: строки и пропуски
+    else:
+        is_str = np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=n)
+
+    # пропуски: None/NaN -> NaN, а pd.NA/NaT to_number возвращает как есть
+    na_idx = np.flatnonzero(missing)
+    is_text[na_idx] = [not (v is None or isinstance(v, float)) for v in values[na_idx]]
+
+    # прочие не-строки: числа -> float, остальное (даты и т.п.) — текст
+    other = np.flatnonzero(~is_str & ~missing)
+    if other.size:
+        other_vals = values[other]
+        is_num = np.fromiter((isinstance(v, (int, float)) for v in other_vals), dtype=bool, count=other.size)
+        numbers[other[is_num]] = other_vals[is_num].astype(np.float64)
+        is_text[other[~is_num]] = True
+
+    str_idx = np.flatnonzero(is_str)
+    if str_idx.size == 0:
+        return numbers, is_text
+
+    s = np.strings.strip(values[str_idx].astype(str))
+    # "", "nan", "none", "null" -> NaN (регистр приводим только у коротких строк)
+    empty = np.strings.str_len(s) <= 4
+    empty[empty] = np.isin(np.strings.lower(s[empty]), _empty_tokens)
+    first = np.strings.slice(s, 0, 1)
+    maybe = ~empty & (np.strings.isdecimal(first) | np.isin(first, _number_starts))
+    is_text[str_idx[~empty & ~maybe]] = True
+    if not maybe.any():
+        return numbers, is_text
+
+    cand_idx = str_idx[maybe]
+    ok, parsed = _parse_number_strings(s[maybe])
+    numbers[cand_idx] = parsed
+    is_text[cand_idx[~ok]] = True
+    return numbers, is_text
+
+
+def parse_numeric_frame(df: pd.DataFrame) -> tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    """Колоночная замена ``df.map(to_number)``.
+
+    Возвращает (frame, numbers, text_mask):
+      frame     — тот же DataFrame, где числовые ячейки заменены на float (как после df.map(to_number));
+      numbers   — матрица float64 (строки x колонки), NaN — пусто или не число;
+      text_mask — матрица bool, True — ячейка осталась текстом.
+    """
+    n_rows, n_cols = df.shape
+    numbers = np.full((n_rows, n_cols), np.nan)
+    text_mask = np.zeros((n_rows, n_cols), dtype=bool)
+    out = {}
+    for col_idx in range(n_cols):
+        values = df.iloc[:, col_idx].to_numpy(dtype=object)
+        col_numbers, col_text = _parse_number_column(values)
+        numbers[:, col_idx] = col_numbers
+        text_mask[:, col_idx] = col_text
+        if col_text.any():
+            merged = col_numbers.astype(object)
+            merged[col_text] = values[col_text]
+            out[col_idx] = merged
+        else:
+            out[col_idx] = col_numbers
+    frame = pd.DataFrame(out, index=df.index)
+    frame.columns = df.columns
+    return frame, numbers, text_mask
+
+
+def _read_excel_auto(file_path: Source) -> pd.DataFrame:
+    """Читает первый лист ОСВ (.xls или .xlsx) через osvReader — по пути или из содержимого файла.
+
+    Ячейки приходят уже «родных» типов (числа — float, текст — str, пусто — NaN), без промежуточного
+    приведения всего листа к str; parse_numeric_frame затем разбирает только текстовые числа.
+    """
+    return read_osv(file_path)
+
 
 # -------------------------------
-# Основная функция для бота
+# Расчёт отклонений (векторно)
 # -------------------------------
+# Индексы столбцов (pandas 0-based)
+A_IDX = 0
+F_IDX, G_IDX = 5, 6
+H_IDX, I_IDX = 7, 8
+J_IDX, K_IDX = 9, 10
+L_IDX, M_IDX = 11, 12
+N_IDX, O_IDX = 13, 14
+P_IDX, R_IDX = 15, 17
+T_IDX, U_IDX = 19, 20
+V_IDX, W_IDX, X_IDX, Y_IDX, Z_IDX, AA_IDX = 21, 22, 23, 24, 25, 26
 
-def process_excel(
-    file_path: str,
-    output_path: str,
-    allowed_deviation_percentage: float = 0.035,
-) -> str:
+LABEL_ROW = 7  # строка с подписями V9..AA9 (pandas-индекс)
+EPS = 1e-9
+RESULT_COLUMNS = (X_IDX, V_IDX, W_IDX, Y_IDX, Z_IDX, AA_IDX)  # колонки, которые заполняет расчёт
+# Подписи в строке LABEL_ROW (9-я строка Excel)
+LABELS = [
+    (V_IDX, "Отклонение излишков"),              # V9
+    (W_IDX, "Отклонение недостач"),              # W9
+    (X_IDX, "Норма отклонения"),                 # X9
+    (Y_IDX, "Кол-во превышения нормы"),          # Y9
+    (Z_IDX, "Сумма превышения нормы излишков"),  # Z9
+    (AA_IDX, "Сумма превышения нормы недостач"),  # AA9
+]
+
+
+def _nzf(x: object) -> float:
+    """Нестрогое число: пусто/не число -> 0.0."""
+    try:
+        if x is None or (isinstance(x, float) and np.isnan(x)):
+            return 0.0
+        return float(x)
+    except Exception:
+        return 0.0
+
+
+# Значение текстовой ячейки (строка, колонка): df.iat или его аналог для компактного хранения (largeFile)
+CellReader = Callable[[int, int], object]
+
+
+def _source_columns(
+    cell: CellReader, numbers: np.ndarray, text_mask: np.ndarray, rows: np.ndarray, col_idx: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Значения колонки col_idx в строках rows как два float64-массива.
+
+    Первый — строгие числа: NaN везде, где ячейка не число (текст, пусто).
+    Второй — нестрогие числа: как первый, но NaN -> 0.0, а для текста — попытка ``float()``.
     """
-    Обрабатывает ОСВ-файл и сохраняет результат в output_path.
+    if col_idx >= numbers.shape[1]:  # колонка добавлена пустой
+        return np.full(rows.size, np.nan), np.zeros(rows.size)
+    strict = numbers[rows, col_idx]
+    lenient = np.where(np.isnan(strict), 0.0, strict)
+    text_rows = np.flatnonzero(text_mask[rows, col_idx])
+    for i in text_rows:
+        lenient[i] = _nzf(cell(rows[i], col_idx))
+    return strict, lenient
 
-    :param file_path: путь к входному Excel (.xls)
-    :param output_path: путь к выходному .xlsx
-    :param allowed_deviation_percentage: допустимое отклонение от оборота (доля, например 0.035 для 3.5%)
-    :return: output_path (для удобства)
+
+# (количество, сумма, по модулю) — порядок выбора цены за единицу
+_RATIO_PAIRS = [
+    (T_IDX, U_IDX, True),
+    (F_IDX, G_IDX, False),  # F/G — без модуля (как в исходной формуле)
+    (H_IDX, I_IDX, True),
+    (J_IDX, K_IDX, True),
+    (L_IDX, M_IDX, True),
+    (N_IDX, O_IDX, True),
+]
+
+
+def _tiered_ratio(cols: dict) -> tuple[np.ndarray, np.ndarray]:
+    """Цена за единицу по цепочке T/U -> F/G -> H/I -> J/K -> L/M -> N/O.
+
+    Берётся первая пара, где количество ненулевое, а сумма — число.
+    Возвращает (ratio, has_ratio).
     """
-    # --- читаем входной файл ---
-    df = _read_excel_auto(file_path)
-
-    # --- переименуем "Unnamed" колонки (кроме самой первой) ---
-    cols = list(df.columns)
-    if cols:
-        first = cols[0]
-        new_cols = [first]
-        for c in cols[1:]:
-            name = "" if (c is None or str(c).startswith("Unnamed")) else c
-            new_cols.append(name)
-        df.columns = new_cols
-
-    # --- удаляем строки, где ЛЮБАЯ ячейка содержит целые слова "Товар" или "кол-во" (без учета регистра) ---
-    compiled = re.compile(r"\b(?:товар|кол-во)\b", flags=re.IGNORECASE)
-    mask_has_words = df.apply(lambda s: s.astype(str).str.contains(compiled, na=False)).any(axis=1)
-
-    # Защитим некоторые строки от удаления (по индексам pandas)
-    protected_rows = [7, 8, 9]
-    mask_to_drop = mask_has_words & ~df.index.isin(protected_rows)
-    df = df.loc[~mask_to_drop].reset_index(drop=True)
-
-    # --- конвертируем все ячейки в числа, где это возможно ---
-    df = df.map(to_number)
+    conds, choices = [], []
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for qty_idx, sum_idx, use_abs in _RATIO_PAIRS:
+            qty = cols[qty_idx][1]
+            amount = cols[sum_idx][0]
+            conds.append((np.abs(qty) > EPS) & ~np.isnan(amount))
+            choices.append(np.abs(amount) / np.abs(qty) if use_abs else amount / qty)
+    has_ratio = np.logical_or.reduce(conds)
+    ratio = np.select(conds, choices, default=np.nan)
+    return ratio, has_ratio
 
-    # --- Вписываем подписи в строку 7 (pandas) — это 9-я строка Excel ---
-    needed_last_col_index = 26  # AA (0-based индекс)
-    if df.shape[1] - 1 < needed_last_col_index:
-        for _ in range(needed_last_col_index + 1 - df.shape[1]):
-            df[f"Unnamed_{df.shape[1]}"] = pd.NA
 
-    labels = [
-        (7, 21, "Отклонение излишков"),              # V9
-        (7, 22, "Отклонение недостач"),              # W9
-        (7, 23, "Норма отклонения"),                 # X9
-        (7, 24, "Кол-во превышения нормы"),          # Y9
-        (7, 25, "Сумма превышения нормы излишков"),  # Z9
-        (7, 26, "Сумма превышения нормы недостач"),  # AA9
-    ]
-    for r, c, val in labels:
-        df.iat[r, c] = val
-
-    # --- Индексы столбцов (pandas 0-based) ---
-    A_IDX = 0
-    J_IDX, K_IDX = 9, 10
-    L_IDX, M_IDX = 11, 12
-    N_IDX, O_IDX = 13, 14
-    P_IDX, R_IDX = 15, 17
-    T_IDX, U_IDX = 19, 20
-    V_IDX, W_IDX, X_IDX, Y_IDX, Z_IDX, AA_IDX = 21, 22, 23, 24, 25, 26
-
-    EPS = 1e-9
-
-    def is_number(x) -> bool:
-        return isinstance(x, (int, float)) and not (isinstance(x, float) and np.isnan(x))
-
-    def nzf(x: object) -> float:
-        try:
-            if x is None or (isinstance(x, float) and np.isnan(x)):
-                return 0.0
-            return float(x)
-        except Exception:
-            return 0.0
+def _put_column(df: pd.DataFrame, col_idx: int, rows: np.ndarray, values: np.ndarray) -> None:
+    """Записывает значения в строки rows колонки col_idx (по позиции — имена колонок не уникальны)."""
+    col = df.iloc[:, col_idx].to_numpy(dtype=object, copy=True)
+    col[rows] = values
+    df.isetitem(col_idx, col)
 
-    pct_display = (f"{allowed_deviation_percentage * 100:.1f}".replace(".", ",") + "%")
 
-    for i in range(df.shape[0]):
-        if i == 7:  # пропускаем строку с подписями
+# -------------------------------
+# Разметка строк (один проход по текстовым ячейкам)
+# -------------------------------
+HEADER_ROWS = (7, 8, 9)  # шапка таблицы в исходном листе (pandas-индексы): не удаляется при чистке
+ROW_OTHER, ROW_HEADER, ROW_ITEM, ROW_TOTAL, ROW_SERVICE = 0, 1, 2, 3, 4
+
+# Нормализуем типографские дефисы к обычному "-" (кол-во/кол–во и т.п.)
+_dash_map = str.maketrans({
+    "\u2011": "-",  # non-breaking hyphen
+    "\u2013": "-",  # en dash
+    "\u2014": "-",  # em dash
+    "\u2212": "-",  # minus sign
+})
+_section_re = re.compile(r"\b(?:товар|кол-во)\b", flags=re.IGNORECASE)  # служебные строки разделов
+_bold_re = re.compile(r"\b(?:итого|товар|кол-во)\b", flags=re.IGNORECASE)
+
+
+class RowLayout(NamedTuple):
+    """Разметка строк очищенной ОСВ — общая для расчёта и оформления.
+
+    kind      — int8 по строкам: ROW_ITEM (в колонке A число, в B название), ROW_SERVICE (число в A,
+                но это шапка — строка нумерации колонок — или нет названия), ROW_HEADER (шапка),
+                ROW_TOTAL ("Итого"), ROW_OTHER; строки разделов "Товар"/"Кол-во" удаляются ещё при чистке.
+                V..AA считаются для ROW_ITEM и ROW_SERVICE (calc_rows), позициями считаются только ROW_ITEM;
+    bold      — bool: строка результата жирная (в ней есть "Итого", "Товар" или "Кол-во");
+    total_row — последняя строка с "Итого", куда пишутся суммы Z и AA (-1 — такой строки нет).
+    """
+    kind: np.ndarray
+    bold: np.ndarray
+    total_row: int
+
+
+class RowText(NamedTuple):
+    """Что найдено в тексте строк (_scan_text). *_kept — без колонок V..AA:
+    в строках-позициях и в строке подписей их перезаписывает расчёт; named — в колонке B есть текст."""
+    section: np.ndarray
+    total: np.ndarray
+    total_kept: np.ndarray
+    bold: np.ndarray
+    bold_kept: np.ndarray
+    named: np.ndarray
+
+
+def _scan_text(df: pd.DataFrame, text_mask: np.ndarray) -> RowText:
+    """Один проход по текстовым ячейкам df (числа в разбор не попадают)."""
+    row_parts, col_parts, text_parts = [], [], []
+    for col_idx in range(df.shape[1]):
+        rows = np.flatnonzero(text_mask[:, col_idx])
+        if rows.size == 0:
             continue
+        values = df.iloc[:, col_idx].to_numpy(dtype=object)[rows]
+        is_str = np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=rows.size)
+        row_parts.append(rows[is_str])
+        col_parts.append(np.full(int(is_str.sum()), col_idx))
+        text_parts.append(values[is_str])
 
-        first_val = df.iat[i, A_IDX] if A_IDX < df.shape[1] else None
-        if not is_number(first_val):
-            continue  # считаем только строки, где первая колонка — число
-
-        # исходные значения
-        j = nzf(df.iat[i, J_IDX]) if J_IDX < df.shape[1] else 0.0
-        l = nzf(df.iat[i, L_IDX]) if L_IDX < df.shape[1] else 0.0
-        n = nzf(df.iat[i, N_IDX]) if N_IDX < df.shape[1] else 0.0
-        p = nzf(df.iat[i, P_IDX]) if P_IDX < df.shape[1] else 0.0
-        r_ = nzf(df.iat[i, R_IDX]) if R_IDX < df.shape[1] else 0.0
-        t = nzf(df.iat[i, T_IDX]) if T_IDX < df.shape[1] else 0.0
-        u = df.iat[i, U_IDX] if U_IDX < df.shape[1] else None
-        f = nzf(df.iat[i, 5]) if 5 < df.shape[1] else 0.0  # F
-        g = df.iat[i, 6] if 6 < df.shape[1] else None      # G
-        h = nzf(df.iat[i, 7]) if 7 < df.shape[1] else 0.0  # H
-        ii = df.iat[i, 8] if 8 < df.shape[1] else None     # I
-        k = df.iat[i, K_IDX] if K_IDX < df.shape[1] else None
-        m = df.iat[i, M_IDX] if M_IDX < df.shape[1] else None
-        o = df.iat[i, O_IDX] if O_IDX < df.shape[1] else None
-
-        # оборот и X
-        turnover = abs(j) + abs(l) + abs(n)
-        x_val = allowed_deviation_percentage * turnover
-        df.iat[i, X_IDX] = x_val
-
-        # V по P (излишки)
-        if turnover <= EPS and abs(p) > EPS:
-            df.iat[i, V_IDX] = "Излишек при нулевом обороте"
-        elif abs(p) > x_val:
-            df.iat[i, V_IDX] = f"Превышение {pct_display} от оборота"
-        else:
-            df.iat[i, V_IDX] = "Норма"
+    rows = np.concatenate(row_parts) if row_parts else np.zeros(0, dtype=np.intp)
+    cols = np.concatenate(col_parts) if col_parts else np.zeros(0, dtype=np.intp)
+    return scan_cells(df.shape[0], rows, cols, np.concatenate(text_parts) if text_parts else [])
 
-        # W по R (недостачи)
-        if turnover <= EPS and abs(r_) > EPS:
-            df.iat[i, W_IDX] = "Недостача при нулевом обороте"
-        elif abs(r_) > x_val:
-            df.iat[i, W_IDX] = f"Превышение {pct_display} от оборота"
-        else:
-            df.iat[i, W_IDX] = "Норма"
-
-        # Y = MIN exceedance for P/R vs X, иначе "Норма"
-        cond_p = abs(p) > x_val
-        cond_r = abs(r_) > x_val
-        if cond_p or cond_r:
-            d_p = abs(p) - x_val if cond_p else float("inf")
-            d_r = abs(r_) - x_val if cond_r else float("inf")
-            df.iat[i, Y_IDX] = min(d_p, d_r)
-        else:
-            df.iat[i, Y_IDX] = "Норма"
-
-        # Z = ЕСЛИ(|P|>X; (|P|-X) * tiered_ratio; "")
-        z_val: Optional[float | str] = ""
-        if abs(p) > x_val:
-            ratio = None
-            if abs(t) > EPS and is_number(u):
-                ratio = abs(float(u)) / abs(t)
-            elif abs(f) > EPS and is_number(g):
-                ratio = float(g) / f
-            elif abs(h) > EPS and is_number(ii):
-                ratio = abs(float(ii)) / abs(h)
-            elif abs(j) > EPS and is_number(k):
-                ratio = abs(float(k)) / abs(j)
-            elif abs(l) > EPS and is_number(m):
-                ratio = abs(float(m)) / abs(l)
-            elif abs(n) > EPS and is_number(o):
-                ratio = abs(float(o)) / abs(n)
-
-            if ratio is not None:
-                z_val = (abs(p) - x_val) * ratio
-            else:
-                z_val = ""
-        df.iat[i, Z_IDX] = z_val
-
-        # AA = ЕСЛИ(|R|>X; (|R|-X) * tiered_ratio; "")
-        aa_val: Optional[float | str] = ""
-        if abs(r_) > x_val:
-            ratio = None
-            if abs(t) > EPS and is_number(u):
-                ratio = abs(float(u)) / abs(t)
-            elif abs(f) > EPS and is_number(g):
-                ratio = float(g) / f
-            elif abs(h) > EPS and is_number(ii):
-                ratio = abs(float(ii)) / abs(h)
-            elif abs(j) > EPS and is_number(k):
-                ratio = abs(float(k)) / abs(j)
-            elif abs(l) > EPS and is_number(m):
-                ratio = abs(float(m)) / abs(l)
-            elif abs(n) > EPS and is_number(o):
-                ratio = abs(float(o)) / abs(n)
-
-            if ratio is not None:
-                aa_val = (abs(r_) - x_val) * ratio
-            else:
-                aa_val = ""
-        df.iat[i, AA_IDX] = aa_val
 
-    # --- Суммы по колонкам Z и AA и запись в строку "Итого" ---
-    z_series = pd.to_numeric(df.iloc[:, Z_IDX], errors="coerce").fillna(0)
-    aa_series = pd.to_numeric(df.iloc[:, AA_IDX], errors="coerce").fillna(0)
+def scan_cells(n_rows: int, rows: np.ndarray, cols: np.ndarray, values) -> RowText:
+    """RowText по строковым ячейкам (строка, колонка, текст): все тексты собираются в одну Series,
+    и каждое правило проверяется одним векторным str.contains."""
+    texts = pd.Series(values, dtype=object)
+    kept = (cols < V_IDX) | (cols > AA_IDX)
 
-    def _row_has_itogo(row) -> bool:
-        for v in row:
-            if isinstance(v, str) and "итого" in v.casefold():
-                return True
-        return False
+    def per_row(hit: np.ndarray, only: Optional[np.ndarray] = None) -> np.ndarray:
+        mask = np.zeros(n_rows, dtype=bool)
+        mask[rows[hit if only is None else hit & only]] = True
+        return mask
 
-    itogo_mask = df.apply(_row_has_itogo, axis=1)
-    if itogo_mask.any():
-        itogo_idx = itogo_mask[itogo_mask].index[-1]  # последняя строка "Итого"
-        # не включаем саму строку "Итого" в сумму
-        sum_z = z_series[z_series.index != itogo_idx].sum()
-        sum_aa = aa_series[aa_series.index != itogo_idx].sum()
-        df.iat[itogo_idx, Z_IDX] = float(sum_z)
-        df.iat[itogo_idx, AA_IDX] = float(sum_aa)
+    section = texts.str.contains(_section_re).to_numpy(dtype=bool)
+    total = texts.str.casefold().str.contains("итого", regex=False).to_numpy(dtype=bool)
+    bold = texts.str.translate(_dash_map).str.contains(_bold_re).to_numpy(dtype=bool)
+    named = (cols == 1) & (texts.str.strip().str.len() > 0).to_numpy(dtype=bool)
+    return RowText(
+        per_row(section), per_row(total), per_row(total, kept), per_row(bold), per_row(bold, kept),
+        per_row(named),
+    )
+
+
+def layout_rows(text: RowText, numbers: np.ndarray, header: np.ndarray) -> RowLayout:
+    """RowLayout по найденному тексту и числам очищенной ОСВ."""
+    n_rows = numbers.shape[0]
+    # V..AA считаются для всех строк с числом в первой колонке (кроме строки с подписями) — так расчёт
+    # работал всегда; позиции — только с названием в B и вне шапки (строка нумерации колонок — не товар)
+    calc = ~np.isnan(numbers[:, A_IDX]) if numbers.shape[1] else np.zeros(n_rows, dtype=bool)
+    overwritten = calc.copy()
+    if n_rows > LABEL_ROW:
+        calc[LABEL_ROW] = False
+        overwritten[LABEL_ROW] = True
+    named = (text.named | ~np.isnan(numbers[:, 1])) if numbers.shape[1] > 1 else text.named
+    is_item = calc & named & ~header
+
+    total = np.where(overwritten, text.total_kept, text.total)
+    bold = np.where(overwritten, text.bold_kept, text.bold)
+    if n_rows > LABEL_ROW:
+        bold[LABEL_ROW] = True  # подпись Y9 "Кол-во превышения нормы"
+    kind = np.select(
+        [is_item, calc, header, total], [ROW_ITEM, ROW_SERVICE, ROW_HEADER, ROW_TOTAL], ROW_OTHER
+    ).astype(np.int8)
+    total_rows = np.flatnonzero(total)
+    return RowLayout(kind, bold, int(total_rows[-1]) if total_rows.size else -1)
+
+
+def calc_rows(layout: RowLayout) -> np.ndarray:
+    """Индексы строк, для которых считаются V..AA: позиции и служебные строки с числом в колонке A."""
+    return np.flatnonzero(np.isin(layout.kind, (ROW_ITEM, ROW_SERVICE)))
+
+
+def item_results(df: pd.DataFrame, numbers: np.ndarray, layout: RowLayout) -> pd.DataFrame:
+    """Результаты по позициям после расчёта (для истории): код, название, X, Y, Z, AA и статусы V/W.
+
+    Только строки ROW_ITEM (без строки нумерации колонок и строк без названия);
+    item_key — код из колонки A (целые без ".0"); over — превышение по излишкам или недостачам.
+    """
+    rows = np.flatnonzero(layout.kind == ROW_ITEM)
+    names = df.iloc[rows, 1].to_numpy(dtype=object) if df.shape[1] > 1 else np.full(rows.size, None)
+    results = {col_idx: df.iloc[rows, col_idx].to_numpy(dtype=object) for col_idx in RESULT_COLUMNS}
+    return item_table(numbers[rows, A_IDX], names, results)
+
+
+def item_table(codes: np.ndarray, names: np.ndarray, results: dict) -> pd.DataFrame:
+    """Таблица item_results по кодам (колонка A), названиям и колонкам результата {индекс: значения}."""
+    status_v, status_w = results[V_IDX], results[W_IDX]
+    over = str_contains(status_v, V_HIT_RE) | str_contains(status_w, W_HIT_RE)
+    return pd.DataFrame({
+        "item_key": [str(int(c)) if float(c).is_integer() else str(c) for c in codes],
+        "name": [v if isinstance(v, str) else None for v in names],
+        "x": results[X_IDX],
+        "y": results[Y_IDX],
+        "z": results[Z_IDX],
+        "aa": results[AA_IDX],
+        "status_v": status_v,
+        "status_w": status_w,
+        "over": over,
+    })
+
+
+class Deviations(NamedTuple):
+    """Результат расчёта для строк-позиций rows в компактном виде (числа и коды статусов);
+    значения ячеек V..AA собирает column."""
+    rows: np.ndarray
+    x: np.ndarray          # X, float64
+    v: np.ndarray          # статус V (излишки) — индекс в statuses
+    w: np.ndarray          # статус W (недостачи) — индекс в statuses
+    y: np.ndarray          # минимальное превышение над X, float64 (где over)
+    over: np.ndarray       # bool: в Y число, иначе "Норма"
+    z: np.ndarray          # сумма превышения излишков, float64 (где z_set, иначе "")
+    z_set: np.ndarray
+    aa: np.ndarray         # сумма превышения недостач, float64 (где aa_set, иначе "")
+    aa_set: np.ndarray
+    statuses: np.ndarray   # object: тексты статусов V/W
+
+    def column(self, col_idx: int, sel: slice = slice(None)) -> np.ndarray:
+        """Значения колонки col_idx (X, V, W, Y, Z или AA) для строк rows[sel] — как их пишет расчёт."""
+        if col_idx == X_IDX:
+            return self.x[sel]
+        if col_idx == V_IDX:
+            return self.statuses[self.v[sel]]
+        if col_idx == W_IDX:
+            return self.statuses[self.w[sel]]
+        if col_idx == Y_IDX:
+            return _either(self.over[sel], self.y[sel], "Норма")
+        if col_idx == Z_IDX:
+            return _either(self.z_set[sel], self.z[sel], "")
+        if col_idx == AA_IDX:
+            return _either(self.aa_set[sel], self.aa[sel], "")
+        raise ValueError(f"Колонка {col_idx} не входит в результат расчёта")
+
+
+def _either(mask: np.ndarray, values: np.ndarray, default: str) -> np.ndarray:
+    out = np.full(mask.size, default, dtype=object)
+    out[mask] = values[mask]
+    return out
+
+
+def _compute_deviations(
+    df: pd.DataFrame, numbers: np.ndarray, text_mask: np.ndarray, rows: np.ndarray,
+    allowed_deviation_percentage: float,
+) -> None:
+    """Заполняет V..AA для строк-позиций rows (см. RowLayout) одним проходом по массивам.
+
+    numbers/text_mask — результат parse_numeric_frame для исходных колонок df.
+    """
+    if rows.size == 0:
+        return
+    deviations = item_deviations(lambda r, c: df.iat[r, c], numbers, text_mask, rows, allowed_deviation_percentage)
+    for col_idx in RESULT_COLUMNS:
+        _put_column(df, col_idx, rows, deviations.column(col_idx))
+
+
+class ItemArrays(NamedTuple):
+    """Не зависящая от процента часть расчёта по строкам-позициям (float64/bool по позициям)."""
+    turnover: np.ndarray   # |J| + |L| + |N|
+    abs_p: np.ndarray      # |P| — излишки
+    abs_r: np.ndarray      # |R| — недостачи
+    ratio: np.ndarray      # цена за единицу (_tiered_ratio)
+    has_ratio: np.ndarray
+
+
+def item_arrays(cell: CellReader, numbers: np.ndarray, text_mask: np.ndarray, rows: np.ndarray) -> ItemArrays:
+    """ItemArrays для строк-позиций rows: исходные колонки читаются один раз для любого числа процентов."""
+    used = [F_IDX, G_IDX, H_IDX, I_IDX, J_IDX, K_IDX, L_IDX, M_IDX, N_IDX, O_IDX, P_IDX, R_IDX, T_IDX, U_IDX]
+    cols = {idx: _source_columns(cell, numbers, text_mask, rows, idx) for idx in used}
+
+    j, l, n = cols[J_IDX][1], cols[L_IDX][1], cols[N_IDX][1]
+    ratio, has_ratio = _tiered_ratio(cols)
+    return ItemArrays(
+        turnover=np.abs(j) + np.abs(l) + np.abs(n),
+        abs_p=np.abs(cols[P_IDX][1]),
+        abs_r=np.abs(cols[R_IDX][1]),
+        ratio=ratio,
+        has_ratio=has_ratio,
+    )
+
+
+def item_deviations(
+    cell: CellReader, numbers: np.ndarray, text_mask: np.ndarray, rows: np.ndarray,
+    allowed_deviation_percentage: float,
+) -> Deviations:
+    """Расчёт V..AA для строк-позиций rows одним проходом по массивам.
+
+    Логика совпадает с формулами Excel:
+      X  = % * (|J| + |L| + |N|)
+      V  = статус излишка по P, W — статус недостачи по R
+      Y  = минимальное превышение |P|/|R| над X, иначе "Норма"
+      Z  = (|P| - X) * цена, AA = (|R| - X) * цена (цена — см. _tiered_ratio), иначе ""
+    """
+    turnover, abs_p, abs_r, ratio, has_ratio = item_arrays(cell, numbers, text_mask, rows)
+
+    # X
+    x_val = allowed_deviation_percentage * turnover
+    zero_turnover = turnover <= EPS
+    cond_p = abs_p > x_val
+    cond_r = abs_r > x_val
+
+    pct_display = (f"{allowed_deviation_percentage * 100:.1f}".replace(".", ",") + "%")
+    exceeded = f"Превышение {pct_display} от оборота"
+
+    # V по P (излишки), W по R (недостачи): 0 — "Норма", 1 — превышение, 2/3 — при нулевом обороте
+    statuses = np.array(
+        ["Норма", exceeded, "Излишек при нулевом обороте", "Недостача при нулевом обороте"], dtype=object
+    )
+    v_code = np.select([zero_turnover & (abs_p > EPS), cond_p], [2, 1], default=0).astype(np.int8)
+    w_code = np.select([zero_turnover & (abs_r > EPS), cond_r], [3, 1], default=0).astype(np.int8)
+
+    # Y = MIN exceedance for P/R vs X, иначе "Норма"
+    exceed = np.minimum(np.where(cond_p, abs_p - x_val, np.inf), np.where(cond_r, abs_r - x_val, np.inf))
+
+    # Z/AA = ЕСЛИ(|P|>X; (|P|-X) * tiered_ratio; "") — цена считается один раз для обеих колонок
+    return Deviations(
+        rows=rows,
+        x=x_val,
+        v=v_code,
+        w=w_code,
+        y=exceed,
+        over=cond_p | cond_r,
+        z=(abs_p - x_val) * ratio,
+        z_set=cond_p & has_ratio,
+        aa=(abs_r - x_val) * ratio,
+        aa_set=cond_r & has_ratio,
+        statuses=statuses,
+    )
+
+
+# -------------------------------
+# Запись и оформление результата
+# -------------------------------
+# При header=True pandas-строка 7 оказывается на 9-й строке Excel (+1 заголовок, +1 нумерация с единицы)
+EXCEL_LABEL_ROW = LABEL_ROW + 2
+COLOR_V = "FFD9E1F2"  # излишки (голубой)
+COLOR_W = "FFF4CCCC"  # недостачи (розовый)
+FILL_NONE, FILL_V, FILL_W = 0, 1, 2
+
+V_HIT_RE = re.compile("превышение|излишек", flags=re.IGNORECASE)
+W_HIT_RE = re.compile("превышение|недостача", flags=re.IGNORECASE)
+
+_thin = Side(style="thin", color="FF000000")
+_border = Border(left=_thin, right=_thin, top=_thin, bottom=_thin)
+
+
+def str_contains(values: np.ndarray, pattern: re.Pattern, translate: Optional[dict] = None) -> np.ndarray:
+    """Маска: ячейка — строка и в ней есть совпадение с pattern (нестроковые ячейки — False)."""
+    n = len(values)
+    is_str = np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=n)
+    hit = np.zeros(n, dtype=bool)
+    if is_str.any():
+        s = pd.Series(values[is_str], dtype=object)
+        if translate is not None:
+            s = s.str.translate(translate)
+        hit[is_str] = s.str.contains(pattern).to_numpy(dtype=bool)
+    return hit
 
-    # --- Сохраняем и форматируем ---
-    # Важно: при header=True (по умолчанию) pandas-строка 7 окажется на 9-й строке Excel.
-    header_written = True
-    startrow = 0
-    row_in_df = 7
-    excel_label_row = startrow + (1 if header_written else 0) + row_in_df + 1  # = 9
 
-    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+def style_plan(df: pd.DataFrame, layout: RowLayout) -> tuple[np.ndarray, np.ndarray]:
+    """План оформления по колонкам V/W результата и разметке строк (без чтения ячеек листа).
+
+    Возвращает (row_fill, bold): заливку каждой строки (FILL_NONE/FILL_V/FILL_W; недостача важнее)
+    и признак жирного шрифта из layout.bold.
+    """
+    v_hit = str_contains(df.iloc[:, V_IDX].to_numpy(dtype=object), V_HIT_RE)
+    w_hit = str_contains(df.iloc[:, W_IDX].to_numpy(dtype=object), W_HIT_RE)
+    row_fill = np.where(w_hit, FILL_W, np.where(v_hit, FILL_V, FILL_NONE))
+    return row_fill, layout.bold
+
+
+def _excel_value(val: object) -> tuple[object, Optional[str]]:
+    """Значение ячейки и формат числа — так же, как их пишет DataFrame.to_excel."""
+    if val is None or (pd.api.types.is_scalar(val) and pd.isna(val)):
+        return "", None
+    if isinstance(val, bool):
+        return val, None
+    if isinstance(val, (int, np.integer)):
+        return int(val), None
+    if isinstance(val, (float, np.floating)):
+        if np.isinf(val):
+            return ("inf" if val > 0 else "-inf"), None
+        return float(val), None
+    if isinstance(val, datetime.datetime):
+        return val, "YYYY-MM-DD HH:MM:SS"
+    if isinstance(val, datetime.date):
+        return val, "YYYY-MM-DD"
+    if isinstance(val, datetime.timedelta):
+        return val.total_seconds() / 86400, "0"
+    return str(val), None
+
+
+class TableSheet(NamedTuple):
+    """Дополнительный лист книги — простая таблица с заголовком (например, чувствительность к проценту)."""
+    title: str
+    headers: list
+    rows: list
+    number_formats: dict  # {индекс колонки: формат числа}
+
+
+class SheetExtras(NamedTuple):
+    """Дополнительное оформление книги для write_rows (книга с формулами, дополнительные листы)."""
+    cell_formats: dict  # {(строка, колонка): формат числа}, строки — как у rows
+    conditional: list   # [(диапазон, правило условного форматирования)]
+    widths: dict        # {индекс колонки: ширина}
+    sheets: tuple = ()  # TableSheet после основного листа
+
+
+def write_streaming(
+    df: pd.DataFrame, output_path: Union[str, BinaryIO], plan: tuple, extras: Optional[SheetExtras] = None,
+) -> None:
+    """Потоковая запись (openpyxl write-only): план оформления считается заранее,
+    каждой ячейке назначается один из нескольких общих именованных стилей.
+    Выглядит так же, как _write_openpyxl, но без повторных проходов по листу.
+    plan — результат style_plan(df, layout).
+    """
+    write_rows(list(df.columns), df.itertuples(index=False, name=None), plan, output_path, extras)
+
+
+def write_rows(
+    columns: list, rows, plan: tuple, output_path: Union[str, BinaryIO], extras: Optional[SheetExtras] = None,
+) -> None:
+    """Запись листа по строкам (итератор последовательностей значений) — общая для write_streaming,
+    книги с формулами и режима больших файлов: в памяти одновременно только текущая строка."""
+    row_fill, bold = plan
+    extras = extras or SheetExtras({}, [], {})
+    format_rows = {r for r, _ in extras.cell_formats}
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    # Ширина колонок V..AA (22..27)
+    for col_idx in range(22, 28):
+        ws.column_dimensions[get_column_letter(col_idx)].width = 35
+    for col_idx, width in extras.widths.items():
+        ws.column_dimensions[get_column_letter(col_idx + 1)].width = width
+
+    fills = {
+        FILL_NONE: PatternFill(),
+        FILL_V: PatternFill(start_color=COLOR_V, end_color=COLOR_V, fill_type="solid"),
+        FILL_W: PatternFill(start_color=COLOR_W, end_color=COLOR_W, fill_type="solid"),
+    }
+    wrap_top = Alignment(wrap_text=True, vertical="top")
+    header_alignment = Alignment(horizontal="center", vertical="top")  # как у заголовка pandas
+    styles: dict = {}
+
+    def style(fill: int, is_bold: bool, alignment: Alignment = Alignment()) -> str:
+        key = (fill, is_bold, repr(alignment))
+        name = styles.get(key)
+        if name is None:
+            name = f"osv_{len(styles)}"
+            wb.add_named_style(NamedStyle(
+                name=name,
+                font=Font(bold=True) if is_bold else copy(DEFAULT_FONT),
+                fill=fills[fill],
+                border=_border,
+                alignment=alignment,
+            ))
+            styles[key] = name
+        return name
+
+    def cells(values, names, sheet=ws) -> list:
+        out = []
+        for val, name in zip(values, names):
+            value, number_format = _excel_value(val)
+            cell = WriteOnlyCell(sheet, value=value)
+            cell.style = name
+            if number_format:
+                cell.number_format = number_format
+            out.append(cell)
+        return out
+
+    n_cols = len(columns)
+    header_style = style(FILL_NONE, True, header_alignment)
+    ws.append(cells(columns, [header_style] * n_cols))
+
+    for r, values in enumerate(rows):
+        row_style = style(int(row_fill[r]), bool(bold[r]))
+        names = [row_style] * n_cols
+        if r == LABEL_ROW:
+            # подписи V9..AA9: перенос текста, у V9/W9 — свой цвет (если строка не закрашена целиком)
+            for col_idx in range(V_IDX, AA_IDX + 1):
+                fill = int(row_fill[r])
+                if fill == FILL_NONE and col_idx in (V_IDX, W_IDX):
+                    fill = FILL_V if col_idx == V_IDX else FILL_W
+                names[col_idx] = style(fill, bool(bold[r]), wrap_top)
+        row_cells = cells(values, names)
+        if r in format_rows:
+            for (fr, col_idx), number_format in extras.cell_formats.items():
+                if fr == r:
+                    row_cells[col_idx].number_format = number_format
+        ws.append(row_cells)
+
+    for cell_range, rule in extras.conditional:
+        ws.conditional_formatting.add(cell_range, rule)
+
+    for table in extras.sheets:
+        sheet = wb.create_sheet(table.title)
+        width = len(table.headers)
+        for col_idx in range(1, width + 1):
+            sheet.column_dimensions[get_column_letter(col_idx)].width = 22
+        sheet.append(cells(table.headers, [style(FILL_NONE, True, Alignment(wrap_text=True, vertical="top"))] * width,
+                           sheet))
+        body_style = style(FILL_NONE, False)
+        for values in table.rows:
+            row_cells = cells(values, [body_style] * width, sheet)
+            for col_idx, number_format in table.number_formats.items():
+                row_cells[col_idx].number_format = number_format
+            sheet.append(row_cells)
+    wb.save(output_path)
+
+
+def _write_openpyxl(df: pd.DataFrame, output_path: Union[str, BinaryIO], sheets: tuple = ()) -> None:
+    """Прежняя запись: DataFrame.to_excel, затем оформление ячеек листа несколькими проходами.
+    sheets — дополнительные листы TableSheet (без оформления)."""
+    excel_label_row = EXCEL_LABEL_ROW
 
     with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, startrow=startrow)
+        df.to_excel(writer, index=False, startrow=0)
         ws = writer.book.active
 
         # Ширина колонок V..AA (22..27) и перенос текста
@@ -296,57 +769,721 @@ def process_excel(
             ws[f"{col_letter}{excel_label_row}"].alignment = Alignment(wrap_text=True, vertical="top")
 
         # Цвета для V9 и W9
-        fill_v = PatternFill(start_color="FFD9E1F2", end_color="FFD9E1F2", fill_type="solid")  # V9
-        fill_w = PatternFill(start_color="FFF4CCCC", end_color="FFF4CCCC", fill_type="solid")  # W9
+        fill_v = PatternFill(start_color=COLOR_V, end_color=COLOR_V, fill_type="solid")  # V9
+        fill_w = PatternFill(start_color=COLOR_W, end_color=COLOR_W, fill_type="solid")  # W9
         ws[f"V{excel_label_row}"].fill = fill_v
         ws[f"W{excel_label_row}"].fill = fill_w
 
         # Закраска всей строки, если слово "Превышение" встречается в V или W
-        fill_v_row = PatternFill(start_color="FFD9E1F2", end_color="FFD9E1F2", fill_type="solid")  # для V
-        fill_w_row = PatternFill(start_color="FFF4CCCC", end_color="FFF4CCCC", fill_type="solid")  # для W
-
         for row_idx in range(2, ws.max_row + 1):  # начиная со 2-й строки (после заголовка df)
             v_val = str(ws[f"V{row_idx}"].value or "").lower()
             w_val = str(ws[f"W{row_idx}"].value or "").lower()
             has_prev_v = "превышение" in v_val or "излишек" in v_val
             has_prev_w = "превышение" in w_val or "недостача" in w_val
             if has_prev_v or has_prev_w:
-                row_fill = fill_w_row if has_prev_w else fill_v_row
+                row_fill = fill_w if has_prev_w else fill_v
                 for col_idx in range(1, ws.max_column + 1):
                     ws.cell(row=row_idx, column=col_idx).fill = row_fill
 
         # Тонкие границы для всех ячеек с данными
-        thin = Side(style="thin", color="FF000000")
-        border = Border(left=thin, right=thin, top=thin, bottom=thin)
         for row in ws.iter_rows(min_row=1, max_row=ws.max_row, min_col=1, max_col=ws.max_column):
             for cell in row:
-                cell.border = border
+                cell.border = _border
 
         # --- Жирным строки, где встречается "Итого", "Товар" или "Кол-во" ---
-        # Нормализуем типографские дефисы к обычному "-" (кол-во/кол–во и т.п.)
-        _dash_map = str.maketrans({
-            "\u2011": "-",  # non-breaking hyphen
-            "\u2013": "-",  # en dash
-            "\u2014": "-",  # em dash
-            "\u2212": "-",  # minus sign
-        })
-
-        pattern = re.compile(r"\b(итого|товар|кол-во)\b", flags=re.IGNORECASE)
-
         for row_idx in range(2, ws.max_row + 1):  # со 2-й строки, чтобы не трогать заголовок DF
             make_bold = False
             for col_idx in range(1, ws.max_column + 1):
                 val = ws.cell(row=row_idx, column=col_idx).value
                 if isinstance(val, str):
                     s = val.translate(_dash_map)
-                    if pattern.search(s):
+                    if _bold_re.search(s):
                         make_bold = True
                         break
             if make_bold:
                 for col_idx in range(1, ws.max_column + 1):
                     ws.cell(row=row_idx, column=col_idx).font = Font(bold=True)
 
-    return output_path
+        for table in sheets:
+            extra = writer.book.create_sheet(table.title)
+            extra.append(table.headers)
+            for values in table.rows:
+                extra.append([_excel_value(val)[0] for val in values])
+            for col_idx, number_format in table.number_formats.items():
+                for (cell,) in extra.iter_rows(min_row=2, min_col=col_idx + 1, max_col=col_idx + 1):
+                    cell.number_format = number_format
+
+
+# -------------------------------
+# Основная функция для бота
+# -------------------------------
+
+class PreparedOSV(NamedTuple):
+    """Прочитанная и очищенная ОСВ — всё, что не зависит от допустимого процента.
+
+    frame     — DataFrame после чистки строк и разбора чисел;
+    numbers   — матрица float64 тех же размеров (NaN — пусто или не число);
+    text_mask — матрица bool: ячейка осталась текстом;
+    layout    — разметка строк (RowLayout): позиции, шапка, "Итого", жирные строки.
+    """
+    frame: pd.DataFrame
+    numbers: np.ndarray
+    text_mask: np.ndarray
+    layout: RowLayout
+
+
+@contextmanager
+def timed(stats: Optional[dict], stage: str):
+    """Добавляет длительность блока в stats["timings"][stage] (секунды), если stats передан."""
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = stats.setdefault("timings", {})
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+
+def prepare_osv(file_path: Source, stats: Optional[dict] = None) -> PreparedOSV:
+    """Чтение, разбор чисел, разметка и чистка строк (первая половина process_excel).
+
+    file_path — путь, содержимое файла (bytes) или открытый двоичный файл.
+    Если передан stats, в него записываются file_bytes, columns и время этапов read, parse, clean.
+    """
+    # --- читаем входной файл ---
+    with timed(stats, "read"):
+        source = read_source(file_path)
+        df = _read_excel_auto(source)
+
+    # --- конвертируем все ячейки в числа, где это возможно (по колонкам) ---
+    with timed(stats, "parse"):
+        df, numbers, text_mask = parse_numeric_frame(df)
+    with timed(stats, "clean"):
+        prepared = clean_frame(df, numbers, text_mask)
+    if stats is not None:
+        stats["file_bytes"] = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+        stats["columns"] = int(prepared.frame.shape[1])
+    return prepared
+
+
+def clean_frame(df: pd.DataFrame, numbers: np.ndarray, text_mask: np.ndarray) -> PreparedOSV:
+    """Имена колонок, разметка строк и удаление служебных строк "Товар"/"Кол-во" (кроме шапки).
+
+    Принимает результат parse_numeric_frame: разметка смотрит только на текстовые ячейки.
+    """
+    df.columns = column_names(list(df.columns))
+
+    # --- удаляем строки, где ЛЮБАЯ ячейка содержит целые слова "Товар" или "кол-во" (без учета регистра),
+    # кроме шапки таблицы (по индексам pandas) ---
+    text = _scan_text(df, text_mask)
+    header = df.index.isin(HEADER_ROWS)
+    keep = ~(text.section & ~header)
+    if not keep.all():
+        df = df.loc[keep].reset_index(drop=True)
+        numbers, text_mask = numbers[keep], text_mask[keep]
+        text = RowText(*(flags[keep] for flags in text))
+        header = header[keep]
+    return PreparedOSV(df, numbers, text_mask, layout_rows(text, numbers, header))
+
+
+def column_names(cols: list) -> list:
+    """Переименовывает "Unnamed" колонки (кроме самой первой) в пустые."""
+    if not cols:
+        return cols
+    new_cols = [cols[0]]
+    for c in cols[1:]:
+        name = "" if (c is None or str(c).startswith("Unnamed")) else c
+        new_cols.append(name)
+    return new_cols
+
+
+# Куда писать результат: путь, открытый двоичный файл или None — вернуть содержимое .xlsx как bytes
+Output = Union[str, BinaryIO, None]
+
+
+def render_osv(
+    prepared: PreparedOSV,
+    output_path: Output,
+    allowed_deviation_percentage: float = 0.035,
+    writer: str = "streaming",
+    stats: Optional[dict] = None,
+    history: Optional[HistoryTarget] = None,
+    sensitivity: Optional[list] = None,
+    totals: bool = False,
+) -> Union[str, BinaryIO, bytes]:
+    """Расчёт отклонений и запись результата (вторая половина process_excel).
+
+    Возвращает output_path, а если он None — содержимое .xlsx (bytes).
+    prepared не изменяется — одну и ту же ОСВ можно пересчитать с разными процентами.
+    Если передан stats, в него записываются итоги: rows, sum_excess (Z), sum_shortage (AA)
+    и время этапов compute, style, write (для writer="openpyxl" оформление входит в write).
+    Если передан history, результаты по позициям сохраняются в HistoryStore (этап history).
+    writer="formulas" — книга с формулами (_formula_sheet): V..AA и "Итого" считает Excel, поэтому без history
+    и totals значения в Python не считаются вовсе (в stats — только rows и время этапов, без сумм);
+    totals=True — всё равно посчитать sum_excess/sum_shortage для stats (сводка batchProcess).
+    sensitivity — проценты (доли) для листа «Чувствительность» (sensitivity_osv).
+    """
+    if writer == "formulas" and history is None and not totals:
+        df = _result_frame(prepared)
+        if stats is not None:
+            stats["rows"] = int(df.shape[0])
+    else:
+        with timed(stats, "compute"):
+            df = evaluate_osv(prepared, allowed_deviation_percentage, stats)
+
+    if history is not None:
+        with timed(stats, "history"), HistoryStore(history.path) as store:
+            store.record(history, item_results(df, prepared.numbers, prepared.layout),
+                         allowed_deviation_percentage)
+
+    sheets = ()
+    if sensitivity:
+        sheets = (_sensitivity_sheet(sensitivity_osv(prepared, sensitivity, stats)),)
+
+    # --- Сохраняем и форматируем ---
+    target = io.BytesIO() if output_path is None else output_path
+    if isinstance(target, str):
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    if writer == "openpyxl":
+        with timed(stats, "write"):
+            _write_openpyxl(df, target, sheets)
+    elif writer == "formulas":
+        with timed(stats, "style"):
+            df, plan, extras = _formula_sheet(df, prepared.layout, allowed_deviation_percentage)
+        with timed(stats, "write"):
+            write_rows(list(df.columns), df.itertuples(index=False, name=None), plan, target,
+                        extras._replace(sheets=sheets))
+    else:
+        with timed(stats, "style"):
+            plan = style_plan(df, prepared.layout)
+        with timed(stats, "write"):
+            write_streaming(df, target, plan, SheetExtras({}, [], {}, sheets))
+
+    return target.getvalue() if output_path is None else output_path
+
+
+def evaluate_osv(
+    prepared: PreparedOSV, allowed_deviation_percentage: float, stats: Optional[dict] = None,
+) -> pd.DataFrame:
+    """Копия prepared.frame с подписями, колонками V..AA и суммами в строке "Итого"."""
+    df = _result_frame(prepared)
+    numbers, text_mask, layout = prepared.numbers, prepared.text_mask, prepared.layout
+
+    # --- Расчёт отклонений (V..AA) по всем строкам сразу ---
+    _compute_deviations(df, numbers, text_mask, calc_rows(layout), allowed_deviation_percentage)
+
+    # --- Суммы по колонкам Z и AA и запись в строку "Итого" ---
+    z_series = pd.to_numeric(df.iloc[:, Z_IDX], errors="coerce").fillna(0)
+    aa_series = pd.to_numeric(df.iloc[:, AA_IDX], errors="coerce").fillna(0)
+    if layout.total_row >= 0:
+        itogo_idx = layout.total_row  # последняя строка "Итого"
+        # не включаем саму строку "Итого" в сумму
+        sum_z = z_series[z_series.index != itogo_idx].sum()
+        sum_aa = aa_series[aa_series.index != itogo_idx].sum()
+        df.iat[itogo_idx, Z_IDX] = float(sum_z)
+        df.iat[itogo_idx, AA_IDX] = float(sum_aa)
+    else:
+        sum_z, sum_aa = z_series.sum(), aa_series.sum()
+
+    if stats is not None:
+        stats["rows"] = int(df.shape[0])
+        stats["sum_excess"] = float(sum_z)
+        stats["sum_shortage"] = float(sum_aa)
+    return df
+
+
+def _result_frame(prepared: PreparedOSV) -> pd.DataFrame:
+    """Копия prepared.frame, дополненная колонками до AA, с подписями в строке LABEL_ROW."""
+    df = prepared.frame.copy()
+
+    # --- Вписываем подписи в строку 7 (pandas) — это 9-я строка Excel ---
+    needed_last_col_index = 26  # AA (0-based индекс)
+    if df.shape[1] - 1 < needed_last_col_index:
+        for _ in range(needed_last_col_index + 1 - df.shape[1]):
+            df[f"Unnamed_{df.shape[1]}"] = pd.NA
+
+    # V..AA получают текст (подписи, статусы): колонки из исходного файла бывают чисто float64
+    for col_idx in range(V_IDX, needed_last_col_index + 1):
+        if df.iloc[:, col_idx].dtype != object:
+            df.isetitem(col_idx, df.iloc[:, col_idx].astype(object))
+
+    for c, val in LABELS:
+        df.iat[LABEL_ROW, c] = val
+    return df
+
+
+def process_excel(
+    file_path: Source,
+    output_path: Output,
+    allowed_deviation_percentage: float = 0.035,
+    writer: str = "streaming",
+    snapshot_path: Optional[str] = None,
+    stats: Optional[dict] = None,
+    history: Optional[HistoryTarget] = None,
+    memory_budget: Optional[int] = None,
+    sensitivity: Optional[list] = None,
+    totals: bool = False,
+) -> Union[str, BinaryIO, bytes]:
+    """
+    Обрабатывает ОСВ-файл и сохраняет результат в output_path.
+
+    :param file_path: путь к входному Excel (.xls или .xlsx), его содержимое (bytes) или открытый двоичный файл
+    :param output_path: путь к выходному .xlsx, открытый двоичный файл или None — вернуть результат как bytes
+    :param allowed_deviation_percentage: допустимое отклонение от оборота (доля, например 0.035 для 3.5%)
+    :param writer: "streaming" — потоковая запись с общими стилями (по умолчанию),
+                   "openpyxl" — прежняя запись через pandas + поячеечное оформление,
+                   "formulas" — V..AA формулами Excel от ячейки допустимого отклонения
+                   и подсветка условным форматированием (процент можно менять в самой книге)
+    :param snapshot_path: снимок разобранной ОСВ (.npz). Если он есть — файл не читается заново;
+                          если нет — создаётся после разбора, чтобы следующий пересчёт был быстрым
+    :param stats: необязательный словарь, куда записываются итоги и время этапов
+                  (см. prepare_osv и render_osv)
+    :param history: куда сохранить результаты по позициям для анализа по периодам (historyStore)
+    :param memory_budget: режим больших файлов (largeFile): чтение, расчёт и запись частями в пределах
+                          memory_budget байт; writer, snapshot_path и sensitivity при этом не используются
+    :param sensitivity: проценты (доли) для дополнительного листа «Чувствительность»: сколько позиций
+                        превышают норму и суммы превышения при каждом из них (см. sensitivity_table)
+    :param totals: для writer="formulas" — всё равно посчитать суммы Z/AA в stats (см. render_osv)
+    :return: output_path (для удобства) или содержимое .xlsx, если output_path=None
+    """
+    if memory_budget is not None:
+        from largeFile import process_large
+
+        return process_large(file_path, output_path, allowed_deviation_percentage, memory_budget,
+                             stats=stats, history=history)
+
+    prepared = _prepare_cached(file_path, snapshot_path, stats)
+    return render_osv(prepared, output_path, allowed_deviation_percentage, writer=writer, stats=stats,
+                      history=history, sensitivity=sensitivity, totals=totals)
+
+
+def _prepare_cached(file_path: Source, snapshot_path: Optional[str], stats: Optional[dict]) -> PreparedOSV:
+    """prepare_osv через снимок: загружает его, если он есть, иначе разбирает файл и сохраняет снимок."""
+    prepared = None
+    if snapshot_path and os.path.exists(snapshot_path):
+        with timed(stats, "snapshot_load"):
+            prepared = load_snapshot(snapshot_path)
+        if prepared is not None and stats is not None:
+            stats["columns"] = int(prepared.frame.shape[1])
+    if prepared is None:
+        prepared = prepare_osv(file_path, stats)
+        if snapshot_path:
+            with timed(stats, "snapshot_save"):
+                try:
+                    save_snapshot(prepared, snapshot_path)
+                except Exception:
+                    # снимок только ускоряет пересчёт — без него задание всё равно выполняется
+                    logging.exception(f"Не удалось сохранить снимок ОСВ {snapshot_path}")
+    return prepared
+
+
+def process_excel_with_stats(*args, **kwargs) -> tuple:
+    """process_excel для пула процессов: возвращает (результат process_excel, stats) —
+    словарь из дочернего процесса иначе не вернуть."""
+    stats = {}
+    result = process_excel(*args, stats=stats, **kwargs)
+    return result, stats
+
+
+# -------------------------------
+# Книга с формулами (writer="formulas")
+# -------------------------------
+# Допустимое отклонение — в строке подписей сразу после AA: подпись в AB9, значение в AC9
+# (строка подписей никогда не бывает позицией). Формулы V..AA ссылаются на AC9.
+THRESHOLD_LABEL = "Допустимое отклонение"
+THRESHOLD_FORMAT = "0.0%"
+
+
+def _col(col_idx: int) -> str:
+    return get_column_letter(col_idx + 1)
+
+
+def _formula_templates(threshold: str) -> dict:
+    """Формулы V..AA для строки-позиции ({n} — номер строки Excel) — та же логика, что в item_deviations;
+    threshold — абсолютная ссылка на ячейку допустимого отклонения.
+
+    Нечисловые ячейки считаются нулём (Ч/N), сумма для цены — только число (ЕЧИСЛО/ISNUMBER).
+    """
+    def num(col_idx: int) -> str:
+        return f"N({_col(col_idx)}{{n}})"
+
+    def absn(col_idx: int) -> str:
+        return f"ABS({num(col_idx)})"
+
+    x = f"{_col(X_IDX)}{{n}}"
+    p, r = absn(P_IDX), absn(R_IDX)
+    turnover = f"({absn(J_IDX)}+{absn(L_IDX)}+{absn(N_IDX)})"
+    exceeded = f'"Превышение "&SUBSTITUTE(FIXED({threshold}*100,1),".",",")&"% от оборота"'
+
+    def status(value: str, zero_text: str) -> str:
+        return f'=IF(AND({turnover}<=1E-9,{value}>1E-9),"{zero_text}",IF({value}>{x},{exceeded},"Норма"))'
+
+    # цена за единицу — вложенные ЕСЛИ по парам _RATIO_PAIRS, "" если ни одна не подошла
+    ratio = '""'
+    for qty_idx, sum_idx, use_abs in reversed(_RATIO_PAIRS):
+        amount = f"{_col(sum_idx)}{{n}}"
+        price = f"ABS({amount})/{absn(qty_idx)}" if use_abs else f"{amount}/{num(qty_idx)}"
+        ratio = f"IF(AND({absn(qty_idx)}>1E-9,ISNUMBER({amount})),{price},{ratio})"
+
+    def excess(value: str) -> str:
+        return f'=IF({value}>{x},IFERROR(({value}-{x})*{ratio},""),"")'
+
+    none = "1E+307"  # «нет превышения» для МИН
+    return {
+        X_IDX: f"={threshold}*{turnover}",
+        V_IDX: status(p, "Излишек при нулевом обороте"),
+        W_IDX: status(r, "Недостача при нулевом обороте"),
+        Y_IDX: f'=IF(OR({p}>{x},{r}>{x}),MIN(IF({p}>{x},{p}-{x},{none}),IF({r}>{x},{r}-{x},{none})),"Норма")',
+        Z_IDX: excess(p),
+        AA_IDX: excess(r),
+    }
+
+
+def _highlight_rule(col_idx: int, pattern: re.Pattern, color: str) -> FormulaRule:
+    """Условное форматирование строки: в колонке col_idx есть одно из слов pattern (как style_plan)."""
+    cell = f"${_col(col_idx)}2"
+    hits = ",".join(f'ISNUMBER(SEARCH("{word}",{cell}))' for word in pattern.pattern.split("|"))
+    fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+    return FormulaRule(formula=[f"OR({hits})"], fill=fill, stopIfTrue=True)
+
+
+def _formula_sheet(df: pd.DataFrame, layout: RowLayout, allowed_deviation_percentage: float) -> tuple:
+    """Лист с формулами вместо значений V..AA: (df, план оформления, SheetExtras).
+
+    В строках-позициях — формулы _formula_templates, в строке "Итого" — СУММ по Z и AA без неё самой,
+    после последней колонки строки подписей — допустимое отклонение. Заливку строк задают правила
+    условного форматирования (недостача важнее), поэтому после изменения процента в книге
+    пересчитываются и значения, и подсветка.
+    """
+    n_cols = df.shape[1]
+    label_col, value_col = n_cols, n_cols + 1
+    label = np.full(df.shape[0], "", dtype=object)
+    value = np.full(df.shape[0], "", dtype=object)
+    if df.shape[0] > LABEL_ROW:
+        label[LABEL_ROW], value[LABEL_ROW] = THRESHOLD_LABEL, float(allowed_deviation_percentage)
+    df.insert(label_col, "", label, allow_duplicates=True)
+    df.insert(value_col, "", value, allow_duplicates=True)
+    threshold = f"${_col(value_col)}${EXCEL_LABEL_ROW}"
+
+    rows = calc_rows(layout)
+    excel_rows = rows + 2
+    for col_idx, template in _formula_templates(threshold).items():
+        _put_column(df, col_idx, rows, np.array([template.format(n=n) for n in excel_rows], dtype=object))
+
+    last = df.shape[0] + 1
+    if layout.total_row >= 0:
+        total = layout.total_row + 2
+        for col_idx in (Z_IDX, AA_IDX):
+            c = _col(col_idx)
+            parts = [f"SUM({c}{a}:{c}{b})" for a, b in ((2, total - 1), (total + 1, last)) if a <= b]
+            _put_column(df, col_idx, np.array([layout.total_row]), ["=" + "+".join(parts) if parts else 0.0])
+
+    conditional = []
+    if last >= 2:
+        cell_range = f"A2:{_col(n_cols - 1)}{last}"
+        conditional = [
+            (cell_range, _highlight_rule(W_IDX, W_HIT_RE, COLOR_W)),
+            (cell_range, _highlight_rule(V_IDX, V_HIT_RE, COLOR_V)),
+        ]
+    extras = SheetExtras({(LABEL_ROW, value_col): THRESHOLD_FORMAT}, conditional, {label_col: 25})
+    plan = (np.full(df.shape[0], FILL_NONE), layout.bold)
+    return df, plan, extras
+
+
+# -------------------------------
+# Краткий итог без записи книги (ответ в чате)
+# -------------------------------
+class OsvSummary(NamedTuple):
+    """Итоги расчёта без построения книги Excel.
+
+    items      — число позиций;
+    surplus    — позиций с превышением по излишкам (подсветка V), shortage — по недостачам (W);
+    sum_excess, sum_shortage — суммы Z и AA, как в строке "Итого";
+    violations — позиции с превышением (колонки item_results, x/y/z/aa — числа, пустые Z/AA — 0)
+                 по убыванию суммы превышения Z + AA.
+    """
+    items: int
+    surplus: int
+    shortage: int
+    sum_excess: float
+    sum_shortage: float
+    violations: pd.DataFrame
+
+
+SUMMARY_COLUMNS = ["item_key", "name", "status_v", "status_w", "x", "y", "z", "aa"]
+SUMMARY_HEADERS = ["Код", "Наименование"] + [label for _, label in LABELS]  # заголовки CSV — как V9..AA9
+
+
+def summarize_items(items: pd.DataFrame, sum_excess: float, sum_shortage: float) -> OsvSummary:
+    """OsvSummary по таблице item_results и суммам "Итого"."""
+    v_hit = str_contains(items["status_v"].to_numpy(dtype=object), V_HIT_RE)
+    w_hit = str_contains(items["status_w"].to_numpy(dtype=object), W_HIT_RE)
+    violations = items.loc[items["over"].to_numpy(dtype=bool), SUMMARY_COLUMNS].copy()
+    for col in ("x", "y"):
+        violations[col] = pd.to_numeric(violations[col], errors="coerce")
+    for col in ("z", "aa"):
+        violations[col] = pd.to_numeric(violations[col], errors="coerce").fillna(0.0)
+    rank = violations["z"] + violations["aa"]
+    order = np.lexsort((-violations["y"].fillna(0.0).to_numpy(), -rank.to_numpy()))
+    return OsvSummary(
+        items=int(len(items)),
+        surplus=int(v_hit.sum()),
+        shortage=int(w_hit.sum()),
+        sum_excess=float(sum_excess),
+        sum_shortage=float(sum_shortage),
+        violations=violations.iloc[order].reset_index(drop=True),
+    )
+
+
+def summarize_osv(
+    prepared: PreparedOSV,
+    allowed_deviation_percentage: float = 0.035,
+    stats: Optional[dict] = None,
+    history: Optional[HistoryTarget] = None,
+) -> OsvSummary:
+    """Расчёт как в render_osv, но вместо записи .xlsx — OsvSummary (stats и history — как в render_osv)."""
+    totals = {} if stats is None else stats  # evaluate_osv кладёт суммы "Итого" в stats
+    with timed(stats, "compute"):
+        df = evaluate_osv(prepared, allowed_deviation_percentage, totals)
+        items = item_results(df, prepared.numbers, prepared.layout)
+    if history is not None:
+        with timed(stats, "history"), HistoryStore(history.path) as store:
+            store.record(history, items, allowed_deviation_percentage)
+    return summarize_items(items, totals["sum_excess"], totals["sum_shortage"])
+
+
+def process_summary(
+    file_path: Source,
+    allowed_deviation_percentage: float = 0.035,
+    snapshot_path: Optional[str] = None,
+    stats: Optional[dict] = None,
+    history: Optional[HistoryTarget] = None,
+    memory_budget: Optional[int] = None,
+) -> OsvSummary:
+    """process_excel без записи книги: возвращает OsvSummary (параметры — как у process_excel)."""
+    if memory_budget is not None:
+        from largeFile import process_large_summary
+
+        return process_large_summary(file_path, allowed_deviation_percentage, memory_budget,
+                                     stats=stats, history=history)
+
+    prepared = _prepare_cached(file_path, snapshot_path, stats)
+    return summarize_osv(prepared, allowed_deviation_percentage, stats=stats, history=history)
+
+
+def process_summary_with_stats(*args, **kwargs) -> tuple:
+    """process_summary для пула процессов: возвращает (OsvSummary, stats)."""
+    stats = {}
+    result = process_summary(*args, stats=stats, **kwargs)
+    return result, stats
+
+
+def summary_table(summary: OsvSummary, fmt: str = "csv") -> bytes:
+    """Позиции с превышением для вложения: "csv" (разделитель «;», UTF-8 с BOM — открывается в Excel)
+    или "json" (итоги и список позиций)."""
+    violations = summary.violations
+    if fmt == "json":
+        payload = {
+            "items": summary.items,
+            "surplus": summary.surplus,
+            "shortage": summary.shortage,
+            "sum_excess": round(summary.sum_excess, 2),
+            "sum_shortage": round(summary.sum_shortage, 2),
+            "violations": json.loads(violations.to_json(orient="records", force_ascii=False)),
+        }
+        return json.dumps(payload, ensure_ascii=False, indent=1).encode("utf-8")
+    if fmt != "csv":
+        raise ValueError(f"Неизвестный формат сводки: {fmt}")
+    table = violations.rename(columns=dict(zip(SUMMARY_COLUMNS, SUMMARY_HEADERS)))
+    return table.to_csv(sep=";", index=False, float_format="%.2f").encode("utf-8-sig")
+
+
+# -------------------------------
+# Чувствительность к проценту (несколько порогов за один расчёт)
+# -------------------------------
+SENSITIVITY_COLUMNS = ["percentage", "surplus", "shortage", "items_over", "sum_excess", "sum_shortage"]
+SENSITIVITY_HEADERS = [
+    THRESHOLD_LABEL,
+    "Превышений по излишкам",
+    "Превышений по недостачам",
+    "Позиций с превышением",
+    "Сумма превышения нормы излишков",
+    "Сумма превышения нормы недостач",
+]
+SENSITIVITY_SHEET = "Чувствительность"
+# Сколько ячеек «процент × позиция» считается за раз (по 8 байт на матрицу float64)
+SENSITIVITY_BLOCK = 2_000_000
+
+
+class Sensitivity(NamedTuple):
+    """Итоги расчёта при нескольких процентах: число позиций и таблица SENSITIVITY_COLUMNS
+    (строка на процент; percentage — доля, как allowed_deviation_percentage)."""
+    items: int
+    table: pd.DataFrame
+
+
+def sensitivity_table(
+    arrays: ItemArrays, percentages: list, other_sums: tuple = (0.0, 0.0), counted: Optional[np.ndarray] = None,
+) -> pd.DataFrame:
+    """Превышения и суммы Z/AA для каждого процента — матрицами «процент × позиция».
+
+    Подсветка и суммы совпадают с расчётом при каждом проценте по отдельности (item_deviations):
+    излишек/недостача при нулевом обороте тоже считается превышением. other_sums — числа в колонках
+    Z/AA вне строк расчёта, которые "Итого" учитывает при любом проценте; counted — какие из строк
+    arrays считать позициями (служебные строки ROW_SERVICE входят только в суммы, как в "Итого").
+    """
+    pct = np.asarray(sorted(set(float(p) for p in percentages)), dtype=np.float64)
+    turnover, abs_p, abs_r, ratio, has_ratio = arrays
+    zero_turnover = turnover <= EPS
+    zero_p, zero_r = zero_turnover & (abs_p > EPS), zero_turnover & (abs_r > EPS)
+
+    parts = []
+    block = max(1, SENSITIVITY_BLOCK // max(turnover.size, 1))
+    for start in range(0, pct.size, block):
+        x_val = pct[start:start + block, None] * turnover
+        cond_p, cond_r = abs_p > x_val, abs_r > x_val
+        v_hit, w_hit = cond_p | zero_p, cond_r | zero_r
+        if counted is not None:
+            v_hit, w_hit = v_hit & counted, w_hit & counted
+        # как в "Итого": пустые Z/AA и суммы без цены (NaN) считаются нулём
+        z = np.nansum(np.where(cond_p & has_ratio, (abs_p - x_val) * ratio, 0.0), axis=1) + other_sums[0]
+        aa = np.nansum(np.where(cond_r & has_ratio, (abs_r - x_val) * ratio, 0.0), axis=1) + other_sums[1]
+        parts.append(np.column_stack([
+            v_hit.sum(axis=1), w_hit.sum(axis=1), (v_hit | w_hit).sum(axis=1), z, aa,
+        ]))
+
+    values = np.vstack(parts) if parts else np.zeros((0, 5))
+    table = pd.DataFrame(values, columns=SENSITIVITY_COLUMNS[1:])
+    for col in ("surplus", "shortage", "items_over"):
+        table[col] = table[col].astype(np.int64)
+    table.insert(0, "percentage", pct)
+    return table
+
+
+def sensitivity_osv(prepared: PreparedOSV, percentages: list, stats: Optional[dict] = None) -> Sensitivity:
+    """Sensitivity по разобранной ОСВ (этап sensitivity в stats)."""
+    with timed(stats, "sensitivity"):
+        rows = calc_rows(prepared.layout)
+        counted = prepared.layout.kind[rows] == ROW_ITEM
+        frame = prepared.frame
+        arrays = item_arrays(lambda r, c: frame.iat[r, c], prepared.numbers, prepared.text_mask, rows)
+        table = sensitivity_table(arrays, percentages, _other_sums(prepared), counted)
+        result = Sensitivity(int(counted.sum()), table)
+    if stats is not None:
+        stats["rows"] = int(frame.shape[0])
+    return result
+
+
+def _other_sums(prepared: PreparedOSV) -> tuple:
+    """Суммы Z и AA вне строк-позиций, подписей и "Итого" — как их считает evaluate_osv."""
+    frame, layout = prepared.frame, prepared.layout
+    other = ~np.isin(layout.kind, (ROW_ITEM, ROW_SERVICE))
+    other[LABEL_ROW:LABEL_ROW + 1] = False
+    if layout.total_row >= 0:
+        other[layout.total_row] = False
+    return tuple(
+        float(pd.to_numeric(frame.iloc[other, col_idx], errors="coerce").fillna(0).sum())
+        if col_idx < frame.shape[1] else 0.0
+        for col_idx in (Z_IDX, AA_IDX)
+    )
+
+
+def process_sensitivity(
+    file_path: Source,
+    percentages: list,
+    snapshot_path: Optional[str] = None,
+    stats: Optional[dict] = None,
+    memory_budget: Optional[int] = None,
+) -> Sensitivity:
+    """Итоги ОСВ сразу для нескольких процентов (доли) — по цене одного расчёта, без записи книги.
+
+    snapshot_path, stats и memory_budget — как у process_excel.
+    """
+    if memory_budget is not None:
+        from largeFile import process_large_sensitivity
+
+        return process_large_sensitivity(file_path, percentages, memory_budget, stats=stats)
+
+    prepared = _prepare_cached(file_path, snapshot_path, stats)
+    return sensitivity_osv(prepared, percentages, stats)
+
+
+def process_sensitivity_with_stats(*args, **kwargs) -> tuple:
+    """process_sensitivity для пула процессов: возвращает (Sensitivity, stats)."""
+    stats = {}
+    result = process_sensitivity(*args, stats=stats, **kwargs)
+    return result, stats
+
+
+def _sensitivity_sheet(sensitivity: Sensitivity) -> TableSheet:
+    """Лист «Чувствительность» книги результата."""
+    rows = list(sensitivity.table.itertuples(index=False, name=None))
+    return TableSheet(SENSITIVITY_SHEET, SENSITIVITY_HEADERS, rows, {0: THRESHOLD_FORMAT})
+
+
+# -------------------------------
+# Снимок разобранной ОСВ (пересчёт с другим процентом без повторного чтения)
+# -------------------------------
+def save_snapshot(prepared: PreparedOSV, path: str) -> None:
+    """Сохраняет PreparedOSV в сжатый .npz: матрица чисел, маска текста, текстовые ячейки и разметка строк."""
+    frame, numbers, text_mask, layout = prepared
+    rows, cols = np.nonzero(text_mask)
+    texts = frame.to_numpy(dtype=object)[rows, cols]
+    is_str = np.fromiter((isinstance(v, str) for v in texts), dtype=bool, count=len(texts))
+    arrays = {
+        "numbers": numbers,
+        "text_mask": text_mask,
+        "text_is_str": is_str,
+        "text_str": np.array(texts[is_str].tolist(), dtype=str),
+        "columns": np.array(json.dumps(list(frame.columns), ensure_ascii=False, default=str)),
+        "row_kind": layout.kind,
+        "row_bold": layout.bold,
+        "total_row": np.array(layout.total_row),
+    }
+    if not is_str.all():
+        arrays["text_other"] = texts[~is_str]  # даты, pd.NA и т.п. — редко, хранятся через pickle
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_snapshot(path: str) -> Optional[PreparedOSV]:
+    """Загружает снимок, сохранённый save_snapshot; None, если файл повреждён (обрезан, не zip, ошибка
+    распаковки) или записан прежней версией — тогда ОСВ разбирается заново."""
+    try:
+        with np.load(path, allow_pickle=True) as z:
+            numbers = z["numbers"]
+            text_mask = z["text_mask"]
+            is_str = z["text_is_str"]
+            texts = np.empty(len(is_str), dtype=object)
+            texts[is_str] = z["text_str"].tolist()
+            if not is_str.all():
+                texts[~is_str] = z["text_other"]
+            columns = json.loads(str(z["columns"]))
+            layout = RowLayout(z["row_kind"], z["row_bold"], int(z["total_row"]))
+    except Exception:  # BadZipFile, zlib.error, EOFError, KeyError и т.п.
+        logging.warning(f"Снимок ОСВ {path} не читается — файл будет разобран заново", exc_info=True)
+        return None
+
+    cells = numbers.astype(object)
+    cells[text_mask] = texts
+    data = {
+        c: cells[:, c] if text_mask[:, c].any() else numbers[:, c].copy()
+        for c in range(numbers.shape[1])
+    }
+    frame = pd.DataFrame(data, index=pd.RangeIndex(numbers.shape[0]))
+    frame.columns = columns
+    return PreparedOSV(frame, numbers, text_mask, layout)
 
 
 # --------------------------------------
@@ -356,11 +1493,17 @@ if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="Обработка ОСВ: подсветка отклонений")
-    parser.add_argument("input", help="Путь к входному Excel (.xls)")
+    parser.add_argument("input", help="Путь к входному Excel (.xls/.xlsx)")
     parser.add_argument("output", help="Путь к выходному .xlsx")
     parser.add_argument("--pct", type=float, default=3.5, help="Допустимый процент (по умолчанию 3.5)")
+    parser.add_argument("--writer", choices=["streaming", "openpyxl", "formulas"], default="streaming",
+                        help="Способ записи результата (по умолчанию streaming)")
+    parser.add_argument("--sensitivity", type=float, nargs="+", metavar="PCT",
+                        help="Добавить лист «Чувствительность» для этих процентов (например: 1 2 3.5 5)")
     args = parser.parse_args()
 
     pct_fraction = args.pct / 100.0
-    result_path = process_excel(args.input, args.output, allowed_deviation_percentage=pct_fraction)
+    result_path = process_excel(args.input, args.output, allowed_deviation_percentage=pct_fraction,
+                                writer=args.writer,
+                                sensitivity=[p / 100.0 for p in args.sensitivity] if args.sensitivity else None)
     print(f"Готово: {result_path}")
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище aiogram в файле SQLite: состояние диалогов переживает перезапуск
+    и общее для нескольких процессов бота на одной машине (WAL, запись в транзакции).
+
+    Данные состояния хранятся как JSON, поэтому в state.set_data/update_data — только
+    строки, числа, bool, None, списки и словари. Записи, не менявшиеся max_age_seconds, удаляются
+    при открытии.
+    """
+
+    def __init__(self, path: str, key_builder: Optional[KeyBuilder] = None, max_age_seconds: float = 7 * 24 * 3600):
+        self.path = path
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        # одно соединение на процесс; запросы идут из потоков asyncio.to_thread по очереди (под замком)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            " key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', updated REAL NOT NULL)"
+        )
+        self._db.execute("DELETE FROM fsm WHERE updated < ?", (time.time() - max_age_seconds,))
+
+    async def _run(self, fn, *args):
+        def locked():
+            with self._lock:
+                return fn(*args)
+        return await asyncio.to_thread(locked)
+
+    # --- синхронные операции (выполняются в потоке) ---
+    def _read(self, key: str) -> tuple:
+        row = self._db.execute("SELECT state, data FROM fsm WHERE key = ?", (key,)).fetchone()
+        return row if row else (None, "{}")
+
+    def _write(self, key: str, column: str, value: Optional[str]) -> None:
+        db = self._db
+        db.execute(
+            f"INSERT INTO fsm (key, {column}, updated) VALUES (?, ?, ?) "
+            f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}, updated = excluded.updated",
+            (key, value, time.time()),
+        )
+        # пустые записи (нет ни состояния, ни данных) не храним
+        db.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+
+    def _update(self, key: str, patch: str) -> str:
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")  # чтение и запись одной транзакцией — без гонок между процессами
+        try:
+            row = db.execute("SELECT data FROM fsm WHERE key = ?", (key,)).fetchone()
+            data = json.loads(row[0]) if row else {}
+            data.update(json.loads(patch))
+            encoded = json.dumps(data, ensure_ascii=False)
+            db.execute(
+                "INSERT INTO fsm (key, data, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+                (key, encoded, time.time()),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return encoded
+
+    # --- BaseStorage ---
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._run(self._write, self.key_builder.build(key), "state", value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._run(self._read, self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        encoded = json.dumps(dict(data), ensure_ascii=False)
+        await self._run(self._write, self.key_builder.build(key), "data", encoded)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._run(self._read, self.key_builder.build(key))
+        return json.loads(data)
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        encoded = await self._run(self._update, self.key_builder.build(key), json.dumps(dict(data), ensure_ascii=False))
+        return json.loads(encoded)
+
+    async def close(self) -> None:
+        await self._run(self._db.close)
+
+
+def create_storage(url: str) -> BaseStorage:
+    """Хранилище FSM по строке FSM_STORAGE:
+
+    - "memory" — в памяти процесса (по умолчанию; теряется при перезапуске);
+    - "sqlite:///путь/к/fsm.db" — SQLiteStorage, общий файл для процессов на одной машине;
+    - "redis://..." — RedisStorage из aiogram (нужен пакет redis), общий для нескольких машин.
+    """
+    if not url or url == "memory":
+        return MemoryStorage()
+    if url.startswith("sqlite:///"):
+        return SQLiteStorage(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        from aiogram.fsm.storage.redis import RedisStorage  # требует pip install redis
+
+        return RedisStorage.from_url(url)
+    raise ValueError(f"Неизвестное хранилище FSM_STORAGE={url!r}: ожидается memory, sqlite:///... или redis://...")
@@ -0,0 +1,176 @@
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+if TYPE_CHECKING:  # pandas нужен только рабочим процессам — бот импортирует модуль ради /top
+    import pandas as pd
+
+# Дата выгрузки в имени файла iiko: "... ведомость 30.06.2025 18.42.10.xlsx"
+_period_re = re.compile(r"(\d{2})\.(\d{2})\.(\d{4})")
+
+
+def period_from_filename(file_name: str, default: Optional[str] = None) -> str:
+    """Период "ГГГГ-ММ" по первой дате ДД.ММ.ГГГГ в имени файла; иначе default или текущий месяц."""
+    m = _period_re.search(os.path.basename(file_name or ""))
+    if m:
+        day, month, year = m.groups()
+        if 1 <= int(month) <= 12:
+            return f"{year}-{month}"
+    return default or datetime.now().strftime("%Y-%m")
+
+
+class HistoryTarget(NamedTuple):
+    """Куда и под каким ключом сохранить результаты позиций (передаётся в process_excel).
+
+    owner  — чей это учёт (id пользователя бота, название точки и т.п.);
+    period — "ГГГГ-ММ", обычно period_from_filename(имя файла).
+    """
+    path: str
+    owner: str
+    period: str
+    file_name: str = ""
+
+
+class Offender(NamedTuple):
+    item_key: str
+    name: str
+    periods_over: int      # в скольких из последних периодов было превышение
+    periods_seen: int      # в скольких периодах позиция вообще встречалась
+    sum_excess: float      # сумма Z за эти периоды
+    sum_shortage: float    # сумма AA за эти периоды
+    last_period: str
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    period TEXT NOT NULL,
+    file_name TEXT,
+    pct REAL NOT NULL,
+    processed_at REAL NOT NULL,
+    UNIQUE (owner, period)
+);
+CREATE TABLE IF NOT EXISTS items (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    owner TEXT NOT NULL,
+    period TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    name TEXT,
+    x REAL,
+    y REAL,
+    z REAL,
+    aa REAL,
+    status_v TEXT,
+    status_w TEXT,
+    over INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_owner_item_period ON items (owner, item_key, period);
+CREATE INDEX IF NOT EXISTS items_owner_period_over ON items (owner, period, over);
+"""
+
+
+class HistoryStore:
+    """Результаты по позициям из каждой обработанной ОСВ в SQLite — для анализа по периодам.
+
+    Один прогон на (owner, period): повторная обработка того же периода заменяет прежние данные,
+    чтобы пересчёт с другим процентом не удваивал статистику.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, target: HistoryTarget, items: "pd.DataFrame", allowed_deviation_percentage: float) -> int:
+        """Сохраняет результаты позиций (см. fileHandler.item_results); возвращает число строк."""
+        columns = [
+            (key, name, x, y, z, aa, v, w, int(over))
+            for key, name, x, y, z, aa, v, w, over in zip(
+                items["item_key"], items["name"], _floats(items["x"]), _floats(items["y"]),
+                _floats(items["z"]), _floats(items["aa"]), items["status_v"], items["status_w"], items["over"],
+            )
+        ]
+        with self._db:
+            self._db.execute("DELETE FROM runs WHERE owner = ? AND period = ?", (target.owner, target.period))
+            run_id = self._db.execute(
+                "INSERT INTO runs (owner, period, file_name, pct, processed_at) VALUES (?, ?, ?, ?, ?)",
+                (target.owner, target.period, target.file_name, allowed_deviation_percentage, time.time()),
+            ).lastrowid
+            self._db.executemany(
+                "INSERT INTO items (run_id, owner, period, item_key, name, x, y, z, aa, status_v, status_w, over)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((run_id, target.owner, target.period, *row) for row in columns),
+            )
+        return len(columns)
+
+    def periods(self, owner: str, limit: Optional[int] = None) -> list:
+        """Периоды владельца от последнего к первому."""
+        sql = "SELECT period FROM runs WHERE owner = ? ORDER BY period DESC"
+        params = (owner,)
+        if limit:
+            sql += " LIMIT ?"
+            params += (limit,)
+        return [p for (p,) in self._db.execute(sql, params)]
+
+    def top_offenders(self, owner: str, periods: int = 6, limit: int = 10, min_periods: int = 2) -> list:
+        """Позиции, чаще всего выходившие за норму за последние periods периодов.
+
+        Сортировка: число периодов с превышением, затем сумма превышений (Z + AA). Позиция может
+        встречаться в одной ОСВ несколько раз (один код в разных группах) — периоды считаются без повторов.
+        """
+        recent = self.periods(owner, periods)
+        if not recent:
+            return []
+        min_periods = min(min_periods, len(recent))
+        marks = ",".join("?" * len(recent))
+        rows = self._db.execute(
+            f"""
+            SELECT item_key, MAX(name), COUNT(DISTINCT CASE WHEN over THEN period END) AS periods_over,
+                   COUNT(DISTINCT period),
+                   COALESCE(SUM(CASE WHEN over THEN z END), 0), COALESCE(SUM(CASE WHEN over THEN aa END), 0),
+                   MAX(CASE WHEN over THEN period END)
+            FROM items
+            WHERE owner = ? AND period IN ({marks})
+            GROUP BY item_key
+            HAVING periods_over >= ?
+            ORDER BY periods_over DESC, COALESCE(SUM(z), 0) + COALESCE(SUM(aa), 0) DESC
+            LIMIT ?
+            """,
+            (owner, *recent, min_periods, limit),
+        ).fetchall()
+        return [Offender(*row) for row in rows]
+
+    def item_history(self, owner: str, item_key: str) -> list:
+        """[(period, x, y, z, aa, status_v, status_w)] по позиции, от раннего периода к позднему."""
+        return self._db.execute(
+            "SELECT period, x, y, z, aa, status_v, status_w FROM items"
+            " WHERE owner = ? AND item_key = ? ORDER BY period",
+            (owner, item_key),
+        ).fetchall()
+
+
+def _floats(values) -> list:
+    """Числа — float, всё остальное ("", "Норма", NaN) — NULL."""
+    out = []
+    for v in values:
+        if isinstance(v, (int, float)) and not isinstance(v, bool) and v == v:
+            out.append(float(v))
+        else:
+            out.append(None)
+    return out
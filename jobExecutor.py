@@ -0,0 +1,94 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+
+class QueueFullError(RuntimeError):
+    """Очередь заданий заполнена — новое задание не принято."""
+
+    def __init__(self, pending: int):
+        super().__init__(f"Очередь заданий заполнена ({pending})")
+        self.pending = pending
+
+
+class JobExecutor:
+    """Выполняет тяжёлые задания (process_excel) в пуле процессов, не блокируя event loop бота.
+
+    Одновременно работают не более max_workers заданий, ещё max_queue ждут своей очереди.
+    Если и очередь заполнена, run() сразу бросает QueueFullError.
+    on_wait(секунды) вызывается, когда задание дождалось свободного процесса (для метрик очереди).
+    initializer(*initargs) выполняется в каждом рабочем процессе при его запуске (например, прогрев импортов).
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, on_wait: Optional[Callable[[float], None]] = None,
+                 initializer: Optional[Callable[..., None]] = None, initargs: tuple = ()):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.on_wait = on_wait
+        self.initializer = initializer
+        self.initargs = initargs
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._pending = 0  # выполняются + ждут
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def queue_position(self) -> int:
+        """Место нового задания в очереди (0 — свободный процесс есть, начнётся сразу)."""
+        return max(0, self._pending - self.max_workers + 1)
+
+    @property
+    def is_full(self) -> bool:
+        return self._pending >= self.max_workers + self.max_queue
+
+    def start(self) -> None:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=self.initializer, initargs=self.initargs
+            )
+
+    async def warm(self) -> float:
+        """Запускает все рабочие процессы сразу (с initializer), не дожидаясь первых заданий.
+
+        Возвращает время запуска в секундах. Пул может создавать процессы по одному на задание, пока нет
+        свободных, поэтому отправляем сразу max_workers пустых заданий — это поднимает все процессы.
+        """
+        if self._pool is None:
+            raise RuntimeError("JobExecutor не запущен (вызовите start())")
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, _ready) for _ in range(self.max_workers)))
+        return time.perf_counter() - started
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Выполняет fn(*args, **kwargs) в отдельном процессе и возвращает результат."""
+        if self._pool is None:
+            raise RuntimeError("JobExecutor не запущен (вызовите start())")
+        if self.is_full:
+            raise QueueFullError(self._pending)
+
+        self._pending += 1
+        queued = time.perf_counter()
+        try:
+            async with self._slots:
+                if self.on_wait:
+                    self.on_wait(time.perf_counter() - queued)
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self._pending -= 1
+
+    def shutdown(self) -> None:
+        """Останавливает пул: ждущие задания отменяются, текущие — дорабатывают."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+def _ready() -> None:
+    """Пустое задание для JobExecutor.warm."""
@@ -0,0 +1,411 @@
+import io
+import os
+import sys
+from typing import NamedTuple, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from engine import MemoryBudgetExceeded
+from fileHandler import (
+    AA_IDX, A_IDX, FILL_NONE, FILL_V, FILL_W, HEADER_ROWS, LABELS, LABEL_ROW, RESULT_COLUMNS, ROW_ITEM,
+    SENSITIVITY_BLOCK, V_HIT_RE, V_IDX, W_HIT_RE, W_IDX, Z_IDX, CellReader, Deviations, OsvSummary, Output,
+    RowLayout, RowText, Sensitivity, calc_rows, column_names, item_arrays, item_deviations, item_table,
+    layout_rows, parse_numeric_frame, scan_cells, sensitivity_table, str_contains, summarize_items, timed,
+    write_rows,
+)
+from historyStore import HistoryStore, HistoryTarget
+from osvReader import OsvChunks, Source, read_source
+
+# Строк в одной части при чтении и записи (меньше, если не хватает бюджета памяти)
+CHUNK_ROWS = 20000
+MIN_CHUNK_ROWS = 1000
+# Оценки для бюджета памяти: лист в памяти читателя (calamine) на байт файла,
+# одна ячейка части в object-виде (указатель + объект Python)
+READER_BYTES_PER_FILE_BYTE = 10
+OBJECT_CELL_BYTES = 64
+
+
+class MemoryBudget:
+    """Учёт памяти одного задания в режиме больших файлов.
+
+    Крупные массивы «оплачиваются» через charge до того, как будут созданы; если сумма превышает
+    limit_bytes, обработка останавливается с MemoryBudgetExceeded, а не доводит процесс до нехватки
+    памяти машины. Размер частей при записи тоже подбирается по остатку бюджета.
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self.used = 0
+        self.peak = 0
+
+    @property
+    def available(self) -> int:
+        return max(0, self.limit_bytes - self.used)
+
+    def charge(self, nbytes: int, what: str) -> None:
+        if self.used + nbytes > self.limit_bytes:
+            raise MemoryBudgetExceeded(
+                f"Не хватает памяти ({what}): нужно ещё {nbytes / 2**20:.0f} МБ, "
+                f"занято {self.used / 2**20:.0f} из {self.limit_bytes / 2**20:.0f} МБ"
+            )
+        self.used += nbytes
+        self.peak = max(self.peak, self.used)
+
+    def release(self, nbytes: int) -> None:
+        self.used = max(0, self.used - nbytes)
+
+
+class CompactOSV(NamedTuple):
+    """Очищенная ОСВ без object-таблицы: то же, что PreparedOSV, в типизированных массивах.
+
+    numbers     — float64 (строки x колонки), NaN — пусто или не число;
+    text_mask   — bool: ячейка — текст;
+    text_rows, text_cols, text_values — текстовые ячейки в порядке строк (как np.nonzero(text_mask));
+                  одинаковые строки хранятся одним объектом (названия групп, единицы измерения и т.п.);
+    columns     — имена колонок; layout — разметка строк (RowLayout).
+    """
+    columns: list
+    numbers: np.ndarray
+    text_mask: np.ndarray
+    text_rows: np.ndarray
+    text_cols: np.ndarray
+    text_values: np.ndarray
+    layout: RowLayout
+
+    def text_column(self, col_idx: int, rows: np.ndarray) -> np.ndarray:
+        """Тексты колонки col_idx в строках rows (object; None, где ячейка не текст)."""
+        out = np.full(rows.size, None, dtype=object)
+        sel = np.flatnonzero(self.text_cols == col_idx)
+        if sel.size and rows.size:
+            col_rows = self.text_rows[sel]
+            pos = np.minimum(np.searchsorted(col_rows, rows), sel.size - 1)
+            found = col_rows[pos] == rows
+            out[found] = self.text_values[sel[pos[found]]]
+        return out
+
+
+def _intern_texts(values: np.ndarray, interned: dict) -> int:
+    """Заменяет повторяющиеся строки в values одним объектом (interned — уже встреченные строки)
+    и возвращает, сколько памяти добавят эти ячейки: указатели плюс новые строки."""
+    total = values.nbytes
+    for i, v in enumerate(values):
+        if isinstance(v, str):
+            known = interned.setdefault(v, v)
+            if known is v:
+                total += sys.getsizeof(v)
+            else:
+                values[i] = known
+    return total
+
+
+def prepare_osv_large(
+    file_path: Source, budget: MemoryBudget, stats: Optional[dict] = None, chunk_rows: int = CHUNK_ROWS
+) -> CompactOSV:
+    """Чтение и разбор ОСВ частями по chunk_rows строк (аналог fileHandler.prepare_osv).
+
+    Каждая часть разбирается parse_numeric_frame и сразу сворачивается в числа и текстовые ячейки,
+    так что object-таблица есть в памяти только для одной части.
+    """
+    with timed(stats, "read"):
+        source = read_source(file_path)
+        file_bytes = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+        budget.charge(file_bytes * READER_BYTES_PER_FILE_BYTE, "чтение листа")
+        chunks = OsvChunks(source, chunk_rows)
+        parts = iter(chunks)
+
+    number_parts, mask_parts, row_parts, col_parts, value_parts = [], [], [], [], []
+    interned: dict = {}
+    offset = 0
+    while True:
+        with timed(stats, "read"):
+            chunk = next(parts, None)
+        if chunk is None:
+            break
+        with timed(stats, "parse"):
+            _, numbers, text_mask = parse_numeric_frame(chunk)
+            rows, cols = np.nonzero(text_mask)
+            values = chunk.to_numpy(dtype=object)[rows, cols]
+            del chunk
+            budget.charge(
+                numbers.nbytes + text_mask.nbytes + rows.nbytes + cols.nbytes + _intern_texts(values, interned),
+                "разбор",
+            )
+            number_parts.append(numbers)
+            mask_parts.append(text_mask)
+            row_parts.append(rows + offset)
+            col_parts.append(cols)
+            value_parts.append(values)
+            offset += numbers.shape[0]
+    del interned
+
+    with timed(stats, "parse"):
+        width = chunks.used_width
+        n_cells = offset * chunks.width
+        budget.charge(n_cells * 9, "сборка частей")  # float64 + bool на ячейку, пока части не освобождены
+        numbers = _stack(number_parts, (offset, chunks.width), np.float64)[:, :width]
+        text_mask = _stack(mask_parts, (offset, chunks.width), bool)[:, :width]
+        budget.release(n_cells * 9)
+        rows = np.concatenate(row_parts) if row_parts else np.zeros(0, dtype=np.intp)
+        cols = np.concatenate(col_parts) if col_parts else np.zeros(0, dtype=np.intp)
+        values = np.concatenate(value_parts) if value_parts else np.zeros(0, dtype=object)
+        del number_parts, mask_parts, row_parts, col_parts, value_parts
+
+    with timed(stats, "clean"):
+        compact = _clean_compact(column_names(chunks.columns), numbers, text_mask, rows, cols, values)
+    if stats is not None:
+        stats["file_bytes"] = file_bytes
+        stats["columns"] = int(width)
+    return compact
+
+
+def _stack(parts: list, shape: tuple, dtype) -> np.ndarray:
+    if not parts:
+        return np.zeros(shape, dtype=dtype)
+    return np.vstack(parts) if len(parts) > 1 else parts[0]
+
+
+def _clean_compact(
+    columns: list, numbers: np.ndarray, text_mask: np.ndarray, rows: np.ndarray, cols: np.ndarray,
+    values: np.ndarray,
+) -> CompactOSV:
+    """Разметка строк и удаление строк разделов — как fileHandler.clean_frame."""
+    n_rows = numbers.shape[0]
+    is_str = np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=values.size)
+    text = scan_cells(n_rows, rows[is_str], cols[is_str], values[is_str])
+    header = np.isin(np.arange(n_rows), HEADER_ROWS)
+    keep = ~(text.section & ~header)
+    if not keep.all():
+        numbers, text_mask = numbers[keep], text_mask[keep]
+        text = RowText(*(flags[keep] for flags in text))
+        header = header[keep]
+        cell_keep = keep[rows]
+        rows = (np.cumsum(keep) - 1)[rows[cell_keep]]
+        cols, values = cols[cell_keep], values[cell_keep]
+    layout = layout_rows(text, numbers, header)
+    return CompactOSV(columns, numbers, text_mask, rows, cols, values, layout)
+
+
+def render_osv_large(
+    compact: CompactOSV,
+    output_path: Output,
+    allowed_deviation_percentage: float,
+    budget: MemoryBudget,
+    stats: Optional[dict] = None,
+    history: Optional[HistoryTarget] = None,
+) -> Union[str, bytes]:
+    """Расчёт и запись частями (аналог fileHandler.render_osv для CompactOSV).
+
+    Результат по позициям хранится в Deviations (числа и коды статусов), а строки листа собираются
+    в object-вид по частям прямо перед записью.
+    """
+    numbers, layout = compact.numbers, compact.layout
+    n_rows, n_cols = numbers.shape
+    deviations, sum_z, sum_aa = _compute_large(compact, allowed_deviation_percentage, budget, stats)
+
+    if history is not None:
+        with timed(stats, "history"), HistoryStore(history.path) as store:
+            store.record(history, _item_results_large(compact, deviations), allowed_deviation_percentage)
+
+    with timed(stats, "style"):
+        v_hit = _column_hits(compact, deviations, V_IDX, V_HIT_RE)
+        w_hit = _column_hits(compact, deviations, W_IDX, W_HIT_RE)
+        plan = (np.where(w_hit, FILL_W, np.where(v_hit, FILL_V, FILL_NONE)), layout.bold)
+
+    width = max(n_cols, AA_IDX + 1)
+    columns = list(compact.columns) + [f"Unnamed_{i}" for i in range(n_cols, width)]
+    block_rows = max(MIN_CHUNK_ROWS, min(CHUNK_ROWS, budget.available // (width * OBJECT_CELL_BYTES)))
+    budget.charge(block_rows * width * OBJECT_CELL_BYTES, "запись")
+
+    target = io.BytesIO() if output_path is None else output_path
+    if isinstance(target, str):
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    with timed(stats, "write"):
+        rows = _result_rows(compact, deviations, (sum_z, sum_aa), width, block_rows)
+        write_rows(columns, rows, plan, target)
+    if stats is not None:
+        stats["memory_budget_peak"] = budget.peak
+    return target.getvalue() if output_path is None else output_path
+
+
+def _compute_large(
+    compact: CompactOSV, allowed_deviation_percentage: float, budget: MemoryBudget, stats: Optional[dict],
+) -> tuple:
+    """Deviations по позициям и суммы Z/AA для строки "Итого"; итоги — в stats, как в fileHandler.evaluate_osv."""
+    numbers, layout = compact.numbers, compact.layout
+    with timed(stats, "compute"):
+        item_rows = calc_rows(layout)
+        budget.charge(item_rows.size * 64, "расчёт")  # 6 float64 + 5 флагов/кодов на позицию и запас
+        deviations = item_deviations(_text_cell(compact), numbers, compact.text_mask, item_rows,
+                                 allowed_deviation_percentage)
+        sum_z = _column_sum(compact, deviations, Z_IDX)
+        sum_aa = _column_sum(compact, deviations, AA_IDX)
+    if stats is not None:
+        stats["rows"] = int(numbers.shape[0])
+        stats["sum_excess"] = float(sum_z)
+        stats["sum_shortage"] = float(sum_aa)
+    return deviations, sum_z, sum_aa
+
+
+def _text_cell(compact: CompactOSV) -> CellReader:
+    """Чтение текстовой ячейки (строка, колонка) CompactOSV для fileHandler._source_columns."""
+    text_cache: dict = {}
+
+    def cell(r: int, c: int) -> object:
+        column = text_cache.get(c)
+        if column is None:
+            sel = np.flatnonzero(compact.text_cols == c)
+            column = text_cache[c] = (compact.text_rows[sel], compact.text_values[sel])
+        col_rows, col_values = column
+        return col_values[np.searchsorted(col_rows, r)]
+
+    return cell
+
+
+def _item_results_large(compact: CompactOSV, deviations: Deviations) -> pd.DataFrame:
+    """fileHandler.item_results для CompactOSV."""
+    counted = compact.layout.kind[deviations.rows] == ROW_ITEM
+    results = {col_idx: deviations.column(col_idx)[counted] for col_idx in RESULT_COLUMNS}
+    rows = deviations.rows[counted]
+    return item_table(compact.numbers[rows, A_IDX], compact.text_column(1, rows), results)
+
+
+def _column_sum(compact: CompactOSV, deviations: Deviations, col_idx: int) -> float:
+    """Сумма колонки Z или AA результата без строки "Итого" — как в fileHandler.evaluate_osv."""
+    values = _source_values(compact, col_idx)
+    if col_idx == Z_IDX:
+        z, z_set = deviations.z, deviations.z_set
+    else:
+        z, z_set = deviations.aa, deviations.aa_set
+    values[deviations.rows] = np.where(z_set & ~np.isnan(z), z, 0.0)
+    return _sum_without_total(values, compact.layout.total_row)
+
+
+def _other_sums(compact: CompactOSV) -> tuple:
+    """fileHandler._other_sums для CompactOSV: суммы Z и AA вне строк-позиций, подписей и "Итого"."""
+    item_rows = calc_rows(compact.layout)
+    sums = []
+    for col_idx in (Z_IDX, AA_IDX):
+        values = _source_values(compact, col_idx)
+        values[item_rows] = 0.0
+        sums.append(_sum_without_total(values, compact.layout.total_row))
+    return tuple(sums)
+
+
+def _sum_without_total(values: np.ndarray, total_row: int) -> float:
+    series = pd.Series(values)
+    if total_row >= 0:
+        return float(series[series.index != total_row].sum())
+    return float(series.sum())
+
+
+def _source_values(compact: CompactOSV, col_idx: int) -> np.ndarray:
+    """Исходные числа колонки col_idx (текст — через pd.to_numeric, пусто — 0), в строке подписей — 0."""
+    numbers = compact.numbers
+    n_rows = numbers.shape[0]
+    if col_idx < numbers.shape[1]:
+        values = np.where(np.isnan(numbers[:, col_idx]), 0.0, numbers[:, col_idx])
+        sel = np.flatnonzero(compact.text_cols == col_idx)
+        if sel.size:
+            parsed = pd.to_numeric(pd.Series(compact.text_values[sel], dtype=object), errors="coerce")
+            values[compact.text_rows[sel]] = parsed.fillna(0).to_numpy(dtype=np.float64)
+    else:
+        values = np.zeros(n_rows)
+    if n_rows > LABEL_ROW:
+        values[LABEL_ROW] = 0.0  # подпись
+    return values
+
+
+def _column_hits(compact: CompactOSV, deviations: Deviations, col_idx: int, pattern) -> np.ndarray:
+    """Маска строк, где в колонке V или W результата есть совпадение с pattern (см. style_plan)."""
+    hit = np.zeros(compact.numbers.shape[0], dtype=bool)
+    sel = np.flatnonzero(compact.text_cols == col_idx)
+    if sel.size:
+        hit[compact.text_rows[sel]] = str_contains(compact.text_values[sel], pattern)
+    if hit.size > LABEL_ROW:
+        hit[LABEL_ROW] = str_contains(np.array([dict(LABELS)[col_idx]], dtype=object), pattern)[0]
+    codes = deviations.v if col_idx == V_IDX else deviations.w
+    hit[deviations.rows] = str_contains(deviations.statuses, pattern)[codes]
+    return hit
+
+
+def _result_rows(compact: CompactOSV, deviations: Deviations, sums: tuple, width: int, block_rows: int):
+    """Строки листа результата по частям: исходные числа и тексты, подписи, V..AA и суммы "Итого"."""
+    numbers, total_row = compact.numbers, compact.layout.total_row
+    n_rows, n_cols = numbers.shape
+    for start in range(0, n_rows, block_rows):
+        stop = min(start + block_rows, n_rows)
+        grid = np.empty((stop - start, width), dtype=object)  # добавленные колонки остаются None (пусто)
+        grid[:, :n_cols] = numbers[start:stop]
+        lo, hi = np.searchsorted(compact.text_rows, [start, stop])
+        grid[compact.text_rows[lo:hi] - start, compact.text_cols[lo:hi]] = compact.text_values[lo:hi]
+        if start <= LABEL_ROW < stop:
+            for c, val in LABELS:
+                grid[LABEL_ROW - start, c] = val
+        lo, hi = np.searchsorted(deviations.rows, [start, stop])
+        if hi > lo:
+            rows = deviations.rows[lo:hi] - start
+            for col_idx in RESULT_COLUMNS:
+                grid[rows, col_idx] = deviations.column(col_idx, slice(lo, hi))
+        if start <= total_row < stop:
+            grid[total_row - start, Z_IDX], grid[total_row - start, AA_IDX] = sums
+        yield from grid
+
+
+def process_large(
+    file_path: Source,
+    output_path: Output,
+    allowed_deviation_percentage: float,
+    memory_budget: int,
+    stats: Optional[dict] = None,
+    history: Optional[HistoryTarget] = None,
+) -> Union[str, bytes]:
+    """process_excel для больших файлов: чтение, расчёт и запись частями в пределах memory_budget байт.
+
+    Результат тот же, что у process_excel с writer="streaming". Снимки для пересчёта не создаются —
+    при другом проценте файл читается заново.
+    """
+    budget = MemoryBudget(memory_budget)
+    compact = prepare_osv_large(file_path, budget, stats)
+    return render_osv_large(compact, output_path, allowed_deviation_percentage, budget, stats, history)
+
+
+def process_large_summary(
+    file_path: Source,
+    allowed_deviation_percentage: float,
+    memory_budget: int,
+    stats: Optional[dict] = None,
+    history: Optional[HistoryTarget] = None,
+) -> OsvSummary:
+    """fileHandler.process_summary для больших файлов: чтение частями, расчёт без записи книги."""
+    budget = MemoryBudget(memory_budget)
+    compact = prepare_osv_large(file_path, budget, stats)
+    deviations, sum_z, sum_aa = _compute_large(compact, allowed_deviation_percentage, budget, stats)
+    items = _item_results_large(compact, deviations)
+    if history is not None:
+        with timed(stats, "history"), HistoryStore(history.path) as store:
+            store.record(history, items, allowed_deviation_percentage)
+    return summarize_items(items, sum_z, sum_aa)
+
+
+def process_large_sensitivity(
+    file_path: Source,
+    percentages: list,
+    memory_budget: int,
+    stats: Optional[dict] = None,
+) -> Sensitivity:
+    """fileHandler.process_sensitivity для больших файлов: чтение частями, матрицы «процент × позиция»
+    блоками по SENSITIVITY_BLOCK ячеек."""
+    budget = MemoryBudget(memory_budget)
+    compact = prepare_osv_large(file_path, budget, stats)
+    with timed(stats, "sensitivity"):
+        item_rows = calc_rows(compact.layout)
+        counted = compact.layout.kind[item_rows] == ROW_ITEM
+        budget.charge(item_rows.size * 64 + SENSITIVITY_BLOCK * 40, "расчёт")  # массивы позиций и блок матриц
+        arrays = item_arrays(_text_cell(compact), compact.numbers, compact.text_mask, item_rows)
+        table = sensitivity_table(arrays, percentages, _other_sums(compact), counted)
+        result = Sensitivity(int(counted.sum()), table)
+    if stats is not None:
+        stats["rows"] = int(compact.numbers.shape[0])
+        stats["memory_budget_peak"] = budget.peak
+    return result
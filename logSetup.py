@@ -0,0 +1,172 @@
+"""Логирование бота: очередь вместо записи на диск в event loop, ротация и JSON-записи с id задания.
+
+Все процессы (бот и процессы обработки) кладут записи в одну multiprocessing-очередь; на диск и в
+терминал их пишет фоновый поток QueueListener процесса бота. Файл ротируется и по размеру, и по
+времени. id задания (job_id) хранится в contextvars: его видят все записи, сделанные внутри
+обработчика одного файла, в том числе в процессе обработки (см. workerJobs).
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import math
+import multiprocessing
+import os
+import secrets
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+_job_id: contextvars.ContextVar = contextvars.ContextVar("job_id", default=None)
+
+# Атрибуты LogRecord, которые не выводятся отдельными полями JSON (остальные — поля из extra=...)
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "job_id", "job_prefix"}
+
+
+def new_job_id() -> str:
+    """Короткий случайный id задания (8 шестнадцатеричных символов)."""
+    return secrets.token_hex(4)
+
+
+def set_job_id(job_id: Optional[str]) -> None:
+    """id задания для записей текущей задачи asyncio (или потока) и всего, что она запускает."""
+    _job_id.set(job_id)
+
+
+def current_job_id() -> Optional[str]:
+    return _job_id.get()
+
+
+@contextmanager
+def job_context(job_id: Optional[str]):
+    """Записи внутри блока помечаются job_id (для заданий в процессах обработки)."""
+    token = _job_id.set(job_id)
+    try:
+        yield
+    finally:
+        _job_id.reset(token)
+
+
+class JobIdFilter(logging.Filter):
+    """Добавляет к записи job_id из контекста, в котором она сделана (до передачи в очередь)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "job_id", None) is None:
+            record.job_id = _job_id.get()
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не склеивает traceback с сообщением: он уходит в exc_text отдельно."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        record.stack_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, сообщение, job_id, поля из extra и traceback."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "job_id", None):
+            data["job_id"] = record.job_id
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_text or record.exc_info:
+            data["exc"] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний текстовый формат; у записей задания после уровня — [job_id]."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s [%(levelname)s] %(job_prefix)s%(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        job_id = getattr(record, "job_id", None)
+        record.job_prefix = f"[{job_id}] " if job_id else ""
+        return super().format(record)
+
+
+class RotatingLogFile(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler, который ротирует и по размеру (max_bytes), и раз в rotate_seconds.
+
+    Границы ротации по времени кратны rotate_seconds от начала эпохи (для суток — полночь UTC),
+    поэтому перезапуск бота их не сдвигает. Архивы — bot.log.1 … bot.log.<backup_count>.
+    """
+
+    def __init__(self, filename: str, max_bytes: int, rotate_seconds: float, backup_count: int):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.rotate_seconds = rotate_seconds
+        self.rollover_at = self._next_rollover(time.time())
+        if os.path.exists(filename) and self._next_rollover(os.path.getmtime(filename)) <= time.time():
+            self.rollover_at = 0.0  # файл остался с прошлого периода — ротируем при первой записи
+
+    def _next_rollover(self, now: float) -> float:
+        if self.rotate_seconds <= 0:
+            return math.inf
+        return (now // self.rotate_seconds + 1) * self.rotate_seconds
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if time.time() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self.rollover_at = self._next_rollover(time.time())
+
+
+def setup_logging(
+    path: str = "bot.log",
+    max_bytes: int = 10 * 1024 * 1024,
+    rotate_seconds: float = 24 * 3600,
+    backup_count: int = 7,
+    file_format: str = "json",
+    level: int = logging.INFO,
+) -> multiprocessing.Queue:
+    """Настраивает корневой логгер процесса бота и запускает фоновую запись; возвращает очередь
+    для configure_worker. Запись останавливается (с дозаписью очереди) при выходе из процесса."""
+    log_queue = multiprocessing.Queue()
+
+    file_handler = RotatingLogFile(path, max_bytes, rotate_seconds, backup_count)
+    file_handler.setFormatter(JsonFormatter() if file_format == "json" else TextFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(TextFormatter())
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    configure_worker(log_queue, level)
+    return log_queue
+
+
+def configure_worker(log_queue, level: int = logging.INFO) -> None:
+    """Корневой логгер процесса пишет только в очередь log_queue (процесс бота или обработки)."""
+    _job_id.set(None)  # процесс, созданный fork внутри задания, иначе унаследует его id
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(JobIdFilter())
+    root.addHandler(handler)
+    root.setLevel(level)
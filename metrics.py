@@ -0,0 +1,203 @@
+import bisect
+import logging
+import threading
+import time
+from typing import Optional, Sequence
+
+# Границы корзин гистограмм времени (секунды) — от долей секунды до нескольких минут
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Размеры файлов (байты) и число строк
+BYTES_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6)
+ROWS_BUCKETS = (100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+
+
+def _labels_text(names: Sequence[str], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Монотонный счётчик с метками (Prometheus counter)."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels[n]) for n in self.labelnames), 0)
+
+    def items(self) -> list:
+        """[(значения меток, счётчик)] в отсортированном порядке."""
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels_text(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и метками (Prometheus histogram)."""
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        # метки -> [счётчики по корзинам (+Inf последней), сумма, количество]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, **labels) -> Optional[tuple]:
+        """(count, sum, p50, p95) для серии или None, если наблюдений не было.
+
+        Квантили — верхняя граница корзины, как histogram_quantile без интерполяции.
+        """
+        series = self._series.get(tuple(str(labels[n]) for n in self.labelnames))
+        if not series or not series[2]:
+            return None
+        counts, total, count = series
+        return count, total, self._quantile(counts, count, 0.5), self._quantile(counts, count, 0.95)
+
+    def _quantile(self, counts: list, count: int, q: float) -> float:
+        rank, seen = q * count, 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def series(self) -> list:
+        return sorted(self._series)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, c in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += c
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, key, le)} {cumulative}")
+                labels = _labels_text(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class BotMetrics:
+    """Метрики бота: время этапов обработки, ожидание в очереди, загрузка из Telegram, размеры файлов.
+
+    Отдаются в текстовом формате Prometheus (render) и кратким текстом для команды /stats (summary).
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.jobs = Counter("osv_jobs_total", "Обработанные запросы по результату", ["result"])
+        self.stage_seconds = Histogram(
+            "osv_stage_seconds", "Время этапа обработки ОСВ", LATENCY_BUCKETS, ["stage"]
+        )
+        self.job_seconds = Histogram("osv_job_seconds", "Полное время задания в процессе обработки", LATENCY_BUCKETS)
+        self.queue_wait_seconds = Histogram(
+            "osv_queue_wait_seconds", "Ожидание свободного процесса в очереди", LATENCY_BUCKETS
+        )
+        self.download_seconds = Histogram(
+            "osv_download_seconds", "Загрузка файла из Telegram", LATENCY_BUCKETS
+        )
+        self.file_bytes = Histogram("osv_file_bytes", "Размер входного файла", BYTES_BUCKETS)
+        self.rows = Histogram("osv_rows", "Строк в результате", ROWS_BUCKETS)
+        self.columns = Histogram("osv_columns", "Колонок во входном файле", (10, 20, 30, 50, 100))
+
+    def observe_job(self, stats: dict) -> None:
+        """Учитывает stats из process_excel (см. fileHandler.process_excel_with_stats)."""
+        timings = stats.get("timings", {})
+        self.job_seconds.observe(sum(timings.values()))
+        for stage, value in timings.items():
+            self.stage_seconds.observe(value, stage=stage)
+        if "file_bytes" in stats:
+            self.file_bytes.observe(stats["file_bytes"])
+        if "rows" in stats:
+            self.rows.observe(stats["rows"])
+        if "columns" in stats:
+            self.columns.observe(stats["columns"])
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.jobs, self.job_seconds, self.stage_seconds, self.queue_wait_seconds,
+                       self.download_seconds, self.file_bytes, self.rows, self.columns):
+            lines.extend(metric.render())
+        lines += [
+            "# HELP osv_uptime_seconds Время работы бота",
+            "# TYPE osv_uptime_seconds gauge",
+            f"osv_uptime_seconds {_format_value(round(time.time() - self.started, 3))}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Краткая сводка для администратора: счётчики и p50/p95 по этапам."""
+        hours = (time.time() - self.started) / 3600
+        results = ", ".join(f"{result}: {int(count)}" for (result,), count in self.jobs.items()) or "нет"
+        lines = [f"Работает {hours:.1f} ч. Запросы — {results}.", "", "Время (среднее / p50 / p95, с):"]
+
+        def line(title: str, histogram: Histogram, **labels) -> None:
+            snap = histogram.snapshot(**labels)
+            if snap:
+                count, total, p50, p95 = snap
+                lines.append(f"{title}: {total / count:.2f} / ≤{_format_value(p50)} / ≤{_format_value(p95)} (n={count})")
+
+        line("загрузка из Telegram", self.download_seconds)
+        line("ожидание в очереди", self.queue_wait_seconds)
+        line("задание целиком", self.job_seconds)
+        for (stage,) in self.stage_seconds.series():
+            line(f"  {stage}", self.stage_seconds, stage=stage)
+        return "\n".join(lines)
+
+
+async def start_metrics_server(metrics: BotMetrics, host: str, port: int):
+    """Поднимает локальный HTTP /metrics (aiohttp) и возвращает runner для остановки (await runner.cleanup())."""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,272 @@
+import io
+import os
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+# -------------------------------
+# Бэкенды чтения
+# -------------------------------
+# Каждый бэкенд получает путь к файлу или его содержимое (bytes) и отдаёт строки первого листа
+# (с A1) как списки значений «родных» типов: числа — float/int, текст — str, пустые ячейки — None или "".
+# Строки выдаются по одной (генератор), чтобы большой лист можно было читать частями (OsvChunks).
+RowsReader = Callable[[Union[str, bytes]], Iterable[list]]
+
+# Что принимает read_osv: путь, содержимое файла или открытый двоичный файл (BytesIO и т.п.)
+Source = Union[str, os.PathLike, bytes, BinaryIO]
+
+# Те же строки, что pandas.read_excel по умолчанию считает пропуском (keep_default_na=True)
+_NA_STRINGS = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+
+def _rows_calamine(source: Union[str, bytes]) -> Iterator[list]:
+    """Быстрый бэкенд на Rust (python-calamine): .xls, .xlsx, .xlsm."""
+    from python_calamine import load_workbook
+
+    workbook = load_workbook(io.BytesIO(source) if isinstance(source, bytes) else source)
+    sheet = workbook.get_sheet_by_index(0)
+    # iter_rows начинает строки с первой, а колонки — с первой непустой: дополняем слева до A
+    pad = [""] * sheet.start[1] if sheet.start else []
+    for row in sheet.iter_rows():
+        yield pad + row if pad else row
+
+
+def _rows_xlrd(source: Union[str, bytes]) -> Iterator[list]:
+    """Запасной бэкенд для .xls (xlrd)."""
+    import xlrd
+
+    if isinstance(source, bytes):
+        book = xlrd.open_workbook(file_contents=source, on_demand=True)
+    else:
+        book = xlrd.open_workbook(source, on_demand=True)
+    sheet = book.sheet_by_index(0)
+    for r in range(sheet.nrows):
+        row = []
+        for cell in sheet.row(r):
+            if cell.ctype == xlrd.XL_CELL_DATE:
+                row.append(xlrd.xldate.xldate_as_datetime(cell.value, book.datemode))
+            elif cell.ctype == xlrd.XL_CELL_BOOLEAN:
+                row.append(bool(cell.value))
+            elif cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+                row.append(None)
+            else:
+                row.append(cell.value)
+        yield row
+    book.release_resources()
+
+
+def _rows_openpyxl(source: Union[str, bytes]) -> Iterator[list]:
+    """Запасной бэкенд для .xlsx/.xlsm (openpyxl, режим только для чтения)."""
+    from openpyxl import load_workbook
+
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        workbook.close()
+
+
+# Расширение -> бэкенды в порядке предпочтения (первый доступный и успешный выигрывает)
+READERS: dict[str, list[RowsReader]] = {
+    ".xls": [_rows_calamine, _rows_xlrd],
+    ".xlsx": [_rows_calamine, _rows_openpyxl],
+    ".xlsm": [_rows_calamine, _rows_openpyxl],
+}
+
+
+def register_reader(ext: str, reader: RowsReader, first: bool = True) -> None:
+    """Добавляет бэкенд для расширения ext (например, ".xls"): первым или последним в списке."""
+    readers = READERS.setdefault(ext.lower(), [])
+    if first:
+        readers.insert(0, reader)
+    else:
+        readers.append(reader)
+
+
+# -------------------------------
+# Сборка DataFrame
+# -------------------------------
+def _header_names(header: list) -> list:
+    """Имена колонок как у pandas.read_excel(header=0): пустые -> "Unnamed: i", повторы -> "имя.1"."""
+    names, seen = [], {}
+    for i, v in enumerate(header):
+        name = f"Unnamed: {i}" if v is None or v == "" or (isinstance(v, float) and np.isnan(v)) else v
+        if isinstance(name, float) and name.is_integer():
+            name = int(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _rows_to_frame(rows: list) -> pd.DataFrame:
+    """Первая строка — заголовок, остальные — данные; колонки собираются сразу как массивы."""
+    # пустые строки в конце листа не нужны
+    while rows and all(v is None or v == "" for v in rows[-1]):
+        rows.pop()
+    if not rows:
+        return pd.DataFrame()
+
+    width = max(len(r) for r in rows)
+    # пустые колонки справа тоже отбрасываем
+    while width and all(len(r) < width or r[width - 1] is None or r[width - 1] == "" for r in rows):
+        width -= 1
+
+    grid = _grid(rows, width)
+    frame = pd.DataFrame(_data_columns(grid[1:]))
+    frame.columns = _header_names(list(grid[0]))
+    return frame
+
+
+def _grid(rows: list, width: int) -> np.ndarray:
+    """Строки разной длины -> object-матрица ширины width (недостающие ячейки — None)."""
+    grid = np.empty((len(rows), width), dtype=object)
+    for i, row in enumerate(rows):
+        n = min(len(row), width)
+        grid[i, :n] = row[:n]
+    return grid
+
+
+def _data_columns(grid: np.ndarray) -> dict:
+    """Колонки данных: пропуски и NA-строки -> NaN, логические значения -> текст."""
+    columns = {}
+    for c in range(grid.shape[1]):
+        col = pd.Series(grid[:, c], dtype=object)
+        col[col.isin(_NA_STRINGS) | col.isna()] = np.nan
+        # логические ячейки оставляем текстом (как при чтении с dtype=str), чтобы не стали числами 1/0
+        is_bool = col.map(type) == bool
+        if is_bool.any():
+            col[is_bool] = col[is_bool].astype(str)
+        columns[c] = col.to_numpy(dtype=object)
+    return columns
+
+
+def _filled(grid: np.ndarray) -> np.ndarray:
+    """Маска непустых ячеек в смысле _rows_to_frame: пусто — None или ""."""
+    return ~((grid == "") | np.equal(grid, None))
+
+
+def sniff_ext(data: bytes) -> str:
+    """Расширение по сигнатуре содержимого: OLE2 — .xls, zip — .xlsx; иначе ""."""
+    if data[:8] == b"\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1":
+        return ".xls"
+    if data[:4] == b"PK\x03\x04":
+        return ".xlsx"
+    return ""
+
+
+def read_source(source: Source) -> Union[str, bytes]:
+    """Путь оставляет путём, открытый файл дочитывает в bytes."""
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    return source.read()
+
+
+def read_osv(source: Source, ext: Optional[str] = None) -> pd.DataFrame:
+    """Читает первый лист ОСВ (.xls/.xlsx/.xlsm) в DataFrame с object-колонками.
+
+    source — путь, содержимое файла (bytes) или открытый двоичный файл. Формат берётся из ext,
+    иначе из расширения пути, а для содержимого без ext — по сигнатуре (sniff_ext).
+
+    Числа остаются числами (float), текст — строками, пустые ячейки — NaN. Бэкенды перебираются
+    по READERS: сначала calamine, затем xlrd/openpyxl, если calamine не установлен или не справился.
+    """
+    source = read_source(source)
+    return _rows_to_frame(_read_rows(source, ext, lambda rows: list(rows)))
+
+
+def _read_rows(source: Union[str, bytes], ext: Optional[str], consume: Callable):
+    """consume(строки) с первым бэкендом из READERS, который справится; ошибки внутри consume
+    тоже переводят к следующему бэкенду."""
+    if ext is None:
+        ext = os.path.splitext(source)[1] if isinstance(source, str) else sniff_ext(source)
+    ext = ext.lower()
+    readers = READERS.get(ext)
+    if not readers:
+        supported = ", ".join(sorted(READERS))
+        raise RuntimeError(f"Неподдерживаемый формат файла {ext or '(без расширения)'}. Поддерживаются: {supported}.")
+
+    errors = []
+    for reader in readers:
+        try:
+            return consume(reader(source))
+        except ImportError as e:
+            errors.append(f"{reader.__name__}: не установлен ({e.name})")
+        except Exception as e:
+            errors.append(f"{reader.__name__}: {e}")
+
+    raise RuntimeError(
+        f"Не удалось прочитать {ext}. Попробованы бэкенды:\n" + "\n".join(errors) + "\n"
+        "Для быстрого чтения установите python-calamine: pip install python-calamine"
+    )
+
+
+class OsvChunks:
+    """Первый лист ОСВ частями по chunk_rows строк — для больших файлов, без object-таблицы всего листа.
+
+    Итерация выдаёт DataFrame с теми же значениями, что у read_osv, и колонками 0..width-1.
+    Пустые строки в конце листа не выдаются. Пустые колонки справа read_osv отбрасывает, а здесь они
+    известны только после полного прохода: тогда used_width — ширина без них, columns — имена колонок.
+    Бэкенд выбирается по первой строке; ошибка чтения посреди листа уже не переводит к запасному.
+    """
+
+    def __init__(self, source: Source, chunk_rows: int, ext: Optional[str] = None):
+        self.chunk_rows = max(1, chunk_rows)
+        source = read_source(source)
+
+        def first_row(rows):
+            rows = iter(rows)
+            return rows, next(rows, None)
+
+        self._rows, header = _read_rows(source, ext, first_row)
+        self.header = list(header or [])
+        self.width = len(self.header)
+        self.used_width = 0
+
+    @property
+    def columns(self) -> list:
+        return _header_names(self.header[:self.used_width])
+
+    def __iter__(self) -> Iterator[pd.DataFrame]:
+        filled_cols = _filled(_grid([self.header], self.width))[0]
+        held = 0  # пустые строки в конце прочитанного: выдаются, только если дальше есть данные
+        batch = []
+        for row in self._rows:
+            batch.append(row)
+            if len(batch) < self.chunk_rows:
+                continue
+            chunk, held = self._chunk(batch, held, filled_cols)
+            batch = []
+            if chunk is not None:
+                yield chunk
+        if batch:
+            chunk, held = self._chunk(batch, held, filled_cols)
+            if chunk is not None:
+                yield chunk
+        filled = np.flatnonzero(filled_cols)
+        self.used_width = int(filled[-1]) + 1 if filled.size else 0
+
+    def _chunk(self, rows: list, held: int, filled_cols: np.ndarray) -> tuple:
+        """(часть или None, сколько пустых строк придержать) для очередной пачки строк."""
+        grid = _grid(rows, self.width)
+        filled = _filled(grid)
+        filled_cols |= filled.any(axis=0)
+        filled_rows = np.flatnonzero(filled.any(axis=1))
+        if filled_rows.size == 0:
+            return None, held + len(rows)
+        end = int(filled_rows[-1]) + 1
+        if held:
+            grid = np.vstack([np.full((held, self.width), None, dtype=object), grid])
+        return pd.DataFrame(_data_columns(grid[:held + end])), len(rows) - end
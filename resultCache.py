@@ -0,0 +1,113 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional, Union
+
+
+class ResultCache:
+    """Дисковый кэш готовых результатов: ключ — хэш входного файла, процент и версия движка.
+
+    Файлы лежат в directory как <ключ>.xlsx. Время изменения файла обновляется при каждом попадании,
+    поэтому при превышении max_bytes удаляются самые давно использованные (LRU),
+    а записи старше max_age_seconds считаются устаревшими.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_age_seconds: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(source: Union[str, bytes], allowed_deviation_percentage: float, engine_version: str) -> str:
+        """sha256 содержимого файла (путь или bytes) + параметры обработки."""
+        digest = hashlib.sha256()
+        if isinstance(source, bytes):
+            digest.update(source)
+        else:
+            with open(source, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        digest.update(f"|{allowed_deviation_percentage!r}|{engine_version}".encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.xlsx")
+
+    def get(self, key: str) -> Optional[str]:
+        """Путь к сохранённому результату или None (промах)."""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        if age > self.max_age_seconds:
+            self._remove(path)
+            self.misses += 1
+            return None
+        os.utime(path)  # отмечаем использование для LRU
+        self.hits += 1
+        return path
+
+    def put(self, key: str, result: Union[str, bytes]) -> None:
+        """Сохраняет готовый результат (путь к файлу или bytes) в кэш атомарно
+        и при необходимости вытесняет старые записи."""
+        if not self.enabled:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            if isinstance(result, bytes):
+                with os.fdopen(fd, "wb") as f:
+                    f.write(result)
+            else:
+                os.close(fd)
+                shutil.copyfile(result, tmp_path)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            self._remove(tmp_path)
+            logging.exception("Не удалось сохранить результат в кэш")
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        """Удаляет устаревшие записи, затем самые давно использованные, пока кэш больше max_bytes."""
+        now = time.time()
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".xlsx"):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.max_age_seconds:
+                    self._remove(entry.path)
+                else:
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,71 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+
+class SubscriptionCache:
+    """Кэш проверок подписки на канал в памяти процесса.
+
+    Положительный ответ живёт positive_ttl секунд, отрицательный — negative_ttl (обычно короче:
+    пользователь может подписаться в любой момент). Записей не больше max_size, лишние вытесняются
+    по давности использования (LRU). Одновременные проверки одного пользователя объединяются
+    в один запрос к Telegram.
+    """
+
+    def __init__(self, positive_ttl: float, negative_ttl: float, max_size: int):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max(0, max_size)
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, tuple[bool, float]] = OrderedDict()  # user_id -> (подписан, истекает)
+        self._inflight: dict[int, asyncio.Future] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    async def get(self, user_id: int, fetch: Callable[[], Awaitable[bool]]) -> bool:
+        """Ответ из кэша, а при промахе — fetch() (один на всех, кто ждёт этого пользователя)."""
+        if not self.enabled:
+            return await fetch()
+
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            subscribed, expires = entry
+            if time.monotonic() < expires:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return subscribed
+            del self._entries[user_id]
+
+        task = self._inflight.get(user_id)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(fetch())
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda t: self._store(user_id, t))
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    def invalidate(self, user_id: int) -> None:
+        """Забывает ответ для пользователя (например, после /check «я подписался»)."""
+        self._entries.pop(user_id, None)
+        # результат уже идущего запроса не сохраняем: он мог начаться до подписки
+        self._inflight.pop(user_id, None)
+
+    def _store(self, user_id: int, task: asyncio.Future) -> None:
+        if self._inflight.get(user_id) is not task:
+            return
+        del self._inflight[user_id]
+        if task.cancelled() or task.exception() is not None:
+            return  # ошибки (сеть, лимиты API) не кэшируем
+        subscribed = bool(task.result())
+        ttl = self.positive_ttl if subscribed else self.negative_ttl
+        if ttl <= 0:
+            return
+        self._entries[user_id] = (subscribed, time.monotonic() + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl.utils import column_index_from_string
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+N_COLS = 21  # A..U — как в выгрузке iiko; V..AA дописывает расчёт
+
+
+def osv_frame(items: list, seed: int = 0) -> pd.DataFrame:
+    """ОСВ как выгрузка iiko: заголовок, шапка (pandas-строки 7-9, в 9-й — нумерация колонок 1..21),
+    позиции items = [(код, название)] или [(код, название, {буква колонки: значение})] и строка "Итого".
+    Колонки D..U без явного значения заполняются случайными суммами."""
+    rng = np.random.default_rng(seed)
+    blank = [None] * N_COLS
+    rows = [["Оборотно-сальдовая ведомость"] + blank[1:]] + [list(blank) for _ in range(6)]
+    rows.append(["Код", "Наименование"] + blank[2:])
+    rows.append([None, None, None, "Кол-во", "Сумма"] + blank[5:])
+    rows.append(list(range(1, N_COLS + 1)))
+    for code, name, *cells in items:
+        row = [code, name, "кг"] + [round(v, 2) for v in rng.uniform(-500, 5000, N_COLS - 3)]
+        for letter, value in (cells[0] if cells else {}).items():
+            row[column_index_from_string(letter) - 1] = value
+        rows.append(row)
+    rows.append(["Итого"] + blank[1:])
+    return pd.DataFrame(rows, columns=["Отчёт"] + [f"Unnamed: {i}" for i in range(1, N_COLS)], dtype=object)
+
+
+@pytest.fixture
+def osv_file(tmp_path):
+    """Пишет osv_frame(items, seed) в .xlsx и возвращает путь."""
+    def write(items: list, seed: int = 0, name: str = "osv.xlsx") -> str:
+        path = str(tmp_path / name)
+        osv_frame(items, seed).to_excel(path, index=False)
+        return path
+    return write
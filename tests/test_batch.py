@@ -0,0 +1,17 @@
+import pytest
+
+from batchProcess import process_one
+
+ITEMS = [(1000 + k, f"Позиция {k}") for k in range(1, 41)]
+
+
+def test_formulas_writer_reports_totals(osv_file, tmp_path):
+    path = osv_file(ITEMS, seed=5)
+    results = {
+        writer: process_one(path, str(tmp_path / f"{writer}.xlsx"), 0.035, writer)
+        for writer in ("streaming", "formulas")
+    }
+    assert not results["formulas"]["error"]
+    assert results["streaming"]["sum_excess"] > 0
+    for key in ("sum_excess", "sum_shortage"):
+        assert results["formulas"][key] == pytest.approx(results["streaming"][key])
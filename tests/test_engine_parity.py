@@ -0,0 +1,120 @@
+"""Векторный расчёт V..AA (fileHandler.evaluate_osv) против построчного расчёта исходной версии бота.
+
+_reference — перенос цикла из первой версии process_excel без изменений логики: результат
+нового расчёта должен совпадать с ним ячейка в ячейку (числа — с точностью до округления float).
+"""
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fileHandler import evaluate_osv, prepare_osv, to_number
+
+EPS = 1e-9
+LABELS = ["Отклонение излишков", "Отклонение недостач", "Норма отклонения", "Кол-во превышения нормы",
+          "Сумма превышения нормы излишков", "Сумма превышения нормы недостач"]
+ZERO_TURNOVER = {"J": 0, "L": 0, "N": 0}
+NO_PRICES = {"F": 0, "H": 0, "T": 0, "J": 10, "L": 0, "N": 0}  # цена только из K/J
+
+ITEMS = [
+    (1001, "Цена из T/U", {"T": 4, "U": 200, "J": 100, "L": 0, "N": 0, "P": 50, "R": 1}),
+    (1002, "Цена из F/G (G отрицательная)", {"T": 0, "F": 5, "G": -250, "J": 100, "L": 0, "N": 0, "P": 40, "R": 40}),
+    (1003, "Цена из H/I", {"T": 0, "F": 0, "H": -8, "I": 96, "J": 0, "L": 50, "P": 9, "R": -30}),
+    (1004, "Цена из J/K", {**NO_PRICES, "K": 70, "P": 5, "R": 5}),
+    (1005, "Цена из L/M", {**NO_PRICES, "J": 0, "L": -20, "M": 60, "P": 0.5, "R": 7}),
+    (1006, "Цена из N/O", {**NO_PRICES, "J": 0, "N": 40, "O": 80, "P": -6, "R": 0}),
+    (1007, "Цены нет — Z/AA пустые", {**NO_PRICES, "K": "н/д", "P": 9, "R": 9}),
+    (1008, "Излишек при нулевом обороте", {**ZERO_TURNOVER, "P": 3, "R": 0}),
+    (1009, "Недостача при нулевом обороте", {**ZERO_TURNOVER, "P": 0, "R": -4}),
+    (1010, "Всё по нулям", {**ZERO_TURNOVER, "P": 0, "R": 0, "T": 0, "F": 0, "H": 0}),
+    (1011, "Отрицательные в тексте", {"J": "(1 234,50)", "L": "−7 710,11", "P": "-300", "R": "2 335,99"}),
+    (1012, "Ровно на границе нормы", {"J": 100, "L": 0, "N": 0, "P": 3.5, "R": -3.5, "T": 1, "U": 10}),
+    (1013, "Текст в числовой колонке", {"J": "n/a", "P": 12, "R": 1}),
+    (1014, None, {"J": 10, "P": 5, "R": 5, "T": 1, "U": 3}),  # код без названия — служебная строка
+] + [(2000 + k, f"Позиция {k}") for k in range(30)]
+
+
+def _reference(raw: pd.DataFrame, pct: float) -> pd.DataFrame:
+    """Построчный расчёт исходной версии: чистка, to_number, V..AA и суммы в "Итого"."""
+    words = raw.apply(lambda s: s.astype(str).str.contains(r"\b(?:товар|кол-во)\b", case=False, na=False))
+    df = raw.loc[~(words.any(axis=1) & ~raw.index.isin([7, 8, 9]))].reset_index(drop=True).map(to_number)
+    while df.shape[1] < 27:
+        df[f"Unnamed_{df.shape[1]}"] = pd.NA
+    df = df.astype(object)
+    for col, label in enumerate(LABELS, start=21):
+        df.iat[7, col] = label
+
+    def is_number(x) -> bool:
+        return isinstance(x, (int, float)) and not (isinstance(x, float) and np.isnan(x))
+
+    def nzf(x) -> float:
+        try:
+            return 0.0 if x is None or (isinstance(x, float) and np.isnan(x)) else float(x)
+        except Exception:
+            return 0.0
+
+    def ratio(j, k, l, m, n, o, t, u, f, g, h, ii):
+        for base, price, signed in ((t, u, False), (f, g, True), (h, ii, False), (j, k, False), (l, m, False),
+                                    (n, o, False)):
+            if abs(base) > EPS and is_number(price):
+                return float(price) / base if signed else abs(float(price)) / abs(base)
+        return None
+
+    pct_display = f"{pct * 100:.1f}".replace(".", ",") + "%"
+    for i in range(df.shape[0]):
+        if i == 7 or not is_number(df.iat[i, 0]):
+            continue
+        cell = [df.iat[i, c] for c in range(21)]
+        j, l, n, p, r_, t, f, h = (nzf(cell[c]) for c in (9, 11, 13, 15, 17, 19, 5, 7))
+        turnover = abs(j) + abs(l) + abs(n)
+        x_val = pct * turnover
+        df.iat[i, 23] = x_val
+        for col, value, zero_text in ((21, p, "Излишек при нулевом обороте"),
+                                      (22, r_, "Недостача при нулевом обороте")):
+            if turnover <= EPS and abs(value) > EPS:
+                df.iat[i, col] = zero_text
+            elif abs(value) > x_val:
+                df.iat[i, col] = f"Превышение {pct_display} от оборота"
+            else:
+                df.iat[i, col] = "Норма"
+        cond_p, cond_r = abs(p) > x_val, abs(r_) > x_val
+        if cond_p or cond_r:
+            df.iat[i, 24] = min(abs(p) - x_val if cond_p else math.inf, abs(r_) - x_val if cond_r else math.inf)
+        else:
+            df.iat[i, 24] = "Норма"
+        k_ratio = ratio(j, cell[10], l, cell[12], n, cell[14], t, cell[20], f, cell[6], h, cell[8])
+        for col, value, cond in ((25, p, cond_p), (26, r_, cond_r)):
+            df.iat[i, col] = (abs(value) - x_val) * k_ratio if cond and k_ratio is not None else ""
+
+    z = pd.to_numeric(df.iloc[:, 25], errors="coerce").fillna(0)
+    aa = pd.to_numeric(df.iloc[:, 26], errors="coerce").fillna(0)
+    itogo = [i for i in range(df.shape[0])
+             if any(isinstance(v, str) and "итого" in v.casefold() for v in df.iloc[i])]
+    if itogo:
+        df.iat[itogo[-1], 25] = float(z[z.index != itogo[-1]].sum())
+        df.iat[itogo[-1], 26] = float(aa[aa.index != itogo[-1]].sum())
+    return df
+
+
+def _same(got, want) -> bool:
+    if isinstance(want, float) and isinstance(got, (int, float)) and not isinstance(got, bool):
+        return got == pytest.approx(want, rel=1e-12, abs=1e-9)
+    if want is None or (not isinstance(want, str) and pd.isna(want)):
+        return got is None or (not isinstance(got, str) and pd.isna(got)) or got == ""
+    return got == want
+
+
+@pytest.mark.parametrize("pct", [0.0, 0.035, 0.2])
+def test_vectorized_engine_matches_row_by_row(osv_file, pct):
+    path = osv_file(ITEMS, seed=7)
+    want = _reference(pd.read_excel(path, dtype=str), pct)
+    got = evaluate_osv(prepare_osv(path), pct)
+    assert got.shape[0] == want.shape[0]
+    diffs = [
+        (row, col, got.iat[row, col], want.iat[row, col])
+        for row in range(want.shape[0]) for col in range(21, 27)
+        if not _same(got.iat[row, col], want.iat[row, col])
+    ]
+    assert diffs == []
+    assert sum(isinstance(v, str) and v.startswith("Превышение") for v in want.iloc[:, 21]) > 0
@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+
+from fileHandler import process_summary
+from historyStore import HistoryStore, HistoryTarget
+
+
+def _items(rows: list) -> pd.DataFrame:
+    """Таблица как у fileHandler.item_results: [(код, превышение, z)]."""
+    return pd.DataFrame({
+        "item_key": [key for key, _, _ in rows],
+        "name": [f"Позиция {key}" for key, _, _ in rows],
+        "x": 1.0, "y": 1.0,
+        "z": [z for _, _, z in rows],
+        "aa": 0.0,
+        "status_v": "", "status_w": "",
+        "over": [over for _, over, _ in rows],
+    })
+
+
+def test_top_offenders_counts_periods_not_rows(tmp_path):
+    with HistoryStore(str(tmp_path / "history.db")) as store:
+        # код 7 дважды в одной ОСВ (разные группы) — это один период, а не два
+        for period in ("2025-05", "2025-06"):
+            store.record(HistoryTarget("", "owner", period), _items([("7", True, 10.0), ("7", True, 5.0),
+                                                                     ("8", period == "2025-06", 1.0)]), 0.035)
+        offenders = {o.item_key: o for o in store.top_offenders("owner", min_periods=1)}
+    assert (offenders["7"].periods_over, offenders["7"].periods_seen) == (2, 2)
+    assert offenders["7"].sum_excess == pytest.approx(30.0)
+    assert (offenders["8"].periods_over, offenders["8"].periods_seen) == (1, 2)
+    assert list(offenders) == ["7", "8"]
+
+
+def test_history_skips_header_row(osv_file, tmp_path):
+    db = str(tmp_path / "history.db")
+    items = [(1000 + k, f"Позиция {k}") for k in range(1, 31)] + [(1005, "Позиция 5 (другая группа)")]
+    for seed, period in enumerate(("2025-05", "2025-06")):
+        process_summary(osv_file(items, seed=seed), 0.035, history=HistoryTarget(db, "owner", period))
+    with HistoryStore(db) as store:
+        offenders = store.top_offenders("owner", min_periods=1, limit=100)
+        assert store.item_history("owner", "1") == []  # строка нумерации колонок шапки
+        assert len(store.item_history("owner", "1005")) == 4
+    assert offenders and None not in {o.name for o in offenders}
+    assert all(o.periods_over <= o.periods_seen <= 2 for o in offenders)
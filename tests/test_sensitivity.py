@@ -0,0 +1,19 @@
+import pytest
+
+from fileHandler import process_sensitivity, process_summary
+
+ITEMS = [(1000 + k, f"Позиция {k}") for k in range(1, 41)] + [(999, None)]
+PERCENTAGES = [0.0, 0.01, 0.035, 0.2]
+
+
+@pytest.mark.parametrize("memory_budget", [None, 512 << 20])
+def test_sweep_matches_separate_summaries(osv_file, memory_budget):
+    path = osv_file(ITEMS, seed=3)
+    sweep = process_sensitivity(path, PERCENTAGES, memory_budget=memory_budget)
+    assert sweep.items == len(ITEMS) - 1  # без строки нумерации колонок и кода без названия
+    for row in sweep.table.itertuples():
+        summary = process_summary(path, row.percentage)
+        assert (row.surplus, row.shortage, row.items_over) == (
+            summary.surplus, summary.shortage, len(summary.violations))
+        assert row.sum_excess == pytest.approx(summary.sum_excess)
+        assert row.sum_shortage == pytest.approx(summary.sum_shortage)
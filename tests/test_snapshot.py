@@ -0,0 +1,26 @@
+import pytest
+
+from fileHandler import load_snapshot, process_summary
+
+ITEMS = [(1000 + k, f"Позиция {k}") for k in range(1, 21)]
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: data[: len(data) // 2],                                          # обрезан (BadZipFile)
+    lambda data: data[:200] + bytes(b ^ 0xFF for b in data[200:400]) + data[400:],  # испорчен (zlib.error)
+])
+def test_corrupt_snapshot_is_prepared_again(osv_file, tmp_path, damage):
+    path, snapshot = osv_file(ITEMS), tmp_path / "osv.npz"
+    expected = process_summary(path, 0.035, snapshot_path=str(snapshot))
+    snapshot.write_bytes(damage(snapshot.read_bytes()))
+    assert load_snapshot(str(snapshot)) is None
+    summary = process_summary(path, 0.035, snapshot_path=str(snapshot))
+    assert (summary.items, summary.sum_excess) == (expected.items, expected.sum_excess)
+    assert load_snapshot(str(snapshot)) is not None  # снимок записан заново
+
+
+def test_snapshot_save_failure_is_not_fatal(osv_file, tmp_path):
+    snapshot = tmp_path / "osv.npz"
+    snapshot.mkdir()  # на месте снимка — каталог: записать не получится
+    assert process_summary(osv_file(ITEMS), 0.035, snapshot_path=str(snapshot)).items == len(ITEMS)
+    assert not (tmp_path / "osv.npz.tmp").exists()
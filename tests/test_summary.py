@@ -0,0 +1,24 @@
+import pytest
+
+from fileHandler import process_excel, process_summary
+
+ITEMS = [(1000 + k, f"Позиция {k}") for k in range(1, 41)]
+
+
+@pytest.mark.parametrize("memory_budget", [None, 512 << 20])
+def test_summary_counts_only_items(osv_file, memory_budget):
+    # строка нумерации колонок (число в A) и строка с кодом без названия — не позиции
+    path = osv_file(ITEMS + [(999, None)])
+    summary = process_summary(path, 0.035, memory_budget=memory_budget)
+    assert summary.items == len(ITEMS)
+    assert summary.surplus + summary.shortage > 0
+    assert not {"1", "999"} & set(summary.violations["item_key"])
+
+
+def test_summary_totals_match_workbook(osv_file):
+    path = osv_file(ITEMS)
+    stats = {}
+    process_excel(path, None, 0.035, stats=stats)
+    summary = process_summary(path, 0.035)
+    assert summary.sum_excess == pytest.approx(stats["sum_excess"])
+    assert summary.sum_shortage == pytest.approx(stats["sum_shortage"])
@@ -0,0 +1,105 @@
+import glob
+import os
+import time
+from typing import Optional, Union
+
+
+class UploadStore:
+    """Загруженные пользователями файлы между загрузкой и обработкой.
+
+    Небольшие файлы держатся в памяти (bytes). Файл больше spill_bytes — или если в памяти уже
+    лежит max_memory_bytes — пишется во временный файл в spill_dir. Записи старше max_age_seconds
+    удаляет sweep() вместе с файлами, в том числе оставшимися на диске после перезапуска.
+
+    Временные файлы находятся и по одному ключу (без записи в памяти этого процесса): если spill_dir
+    общий, а spill_bytes=0, загрузку, принятую одним процессом бота, может обработать другой.
+    """
+
+    def __init__(self, spill_dir: str, spill_bytes: int, max_memory_bytes: int, max_age_seconds: float):
+        self.spill_dir = spill_dir
+        self.spill_bytes = spill_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.max_age_seconds = max_age_seconds
+        self._entries: dict[str, tuple[Union[bytes, str], float]] = {}  # ключ -> (содержимое или путь, время)
+        self._memory = 0
+        os.makedirs(spill_dir, exist_ok=True)
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._memory
+
+    def wants_spill(self, size: int) -> bool:
+        """Писать ли файл такого размера на диск, а не в память."""
+        return size > self.spill_bytes or self._memory + size > self.max_memory_bytes
+
+    def spill_path(self, key: str, suffix: str) -> str:
+        """Путь для временного файла (ключ уже уникален: id пользователя + id файла в Telegram)."""
+        return os.path.join(self.spill_dir, f"{key}{suffix}")
+
+    def put(self, key: str, source: Union[bytes, str]) -> None:
+        """Запоминает содержимое (bytes) или путь к уже записанному временному файлу."""
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            if isinstance(previous[0], bytes):
+                self._memory -= len(previous[0])
+            elif previous[0] != source:
+                remove_file(previous[0])
+        self._entries[key] = (source, time.time())
+        if isinstance(source, bytes):
+            self._memory += len(source)
+
+    def get(self, key: Optional[str]) -> Union[bytes, str, None]:
+        """bytes или путь к файлу; None, если записи нет (истекла или бот перезапускался)."""
+        entry = self._entries.get(key) if key else None
+        if entry is None:
+            path = self._find_spilled(key) if key else None
+            if path is None:
+                return None
+            entry = (path, time.time())
+        source, _ = entry
+        if isinstance(source, str) and not os.path.exists(source):
+            self.discard(key)
+            return None
+        self._entries[key] = (source, time.time())
+        return source
+
+    def _find_spilled(self, key: str) -> Optional[str]:
+        """Временный файл этого ключа, записанный этим или другим процессом (после перезапуска тоже)."""
+        matches = glob.glob(os.path.join(glob.escape(self.spill_dir), glob.escape(key) + ".*"))
+        return matches[0] if matches else None
+
+    def discard(self, key: Optional[str]) -> None:
+        entry = self._entries.pop(key, None) if key else None
+        if entry is None:
+            remove_file(self._find_spilled(key) if key else None)
+            return
+        source, _ = entry
+        if isinstance(source, bytes):
+            self._memory -= len(source)
+        else:
+            remove_file(source)
+
+    def sweep(self) -> None:
+        """Удаляет устаревшие записи и забытые временные файлы."""
+        deadline = time.time() - self.max_age_seconds
+        for key, (_, touched) in list(self._entries.items()):
+            if touched < deadline:
+                self.discard(key)
+
+        known = {source for source, _ in self._entries.values() if isinstance(source, str)}
+        with os.scandir(self.spill_dir) as it:
+            for entry in it:
+                try:
+                    if entry.path not in known and entry.stat().st_mtime < deadline:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+
+def remove_file(path: Optional[str]) -> None:
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,147 @@
+"""Задания для пула процессов бота.
+
+Модуль лёгкий: pandas, numpy и openpyxl (fileHandler, largeFile) импортируются только внутри заданий,
+то есть в рабочих процессах. Результаты заданий — обычные объекты Python (bytes, путь, кортежи),
+чтобы при их распаковке в процессе бота тяжёлые библиотеки тоже не подгружались.
+"""
+import io
+import logging
+import os
+import time
+from typing import NamedTuple, Optional
+
+from logSetup import configure_worker, job_context
+
+
+def excel_job(*args, job_id: Optional[str] = None, **kwargs) -> tuple:
+    """fileHandler.process_excel_with_stats: (результат process_excel, stats).
+
+    job_id помечает записи лога этого задания в процессе обработки (см. logSetup).
+    """
+    from fileHandler import process_excel_with_stats
+
+    with job_context(job_id):
+        logging.info("Обработка начата", extra={"event": "worker_start", "mode": "xlsx"})
+        return process_excel_with_stats(*args, **kwargs)
+
+
+class TopItem(NamedTuple):
+    """Позиция из краткого итога: код, название, минимальное превышение (Y) и суммы Z/AA."""
+    item_key: str
+    name: Optional[str]
+    y: float
+    z: float
+    aa: float
+
+
+class ChatSummary(NamedTuple):
+    """fileHandler.OsvSummary для ответа в чате: итоги, первые top позиций и таблица превышений вложением."""
+    items: int
+    surplus: int
+    shortage: int
+    sum_excess: float
+    sum_shortage: float
+    top: list
+    table: Optional[bytes]  # None — вложение не нужно или превышений нет
+
+
+def summary_job(file_path, allowed_deviation_percentage: float, top: int = 10, attachment: str = "csv",
+                job_id: Optional[str] = None, **kwargs) -> tuple:
+    """fileHandler.process_summary_with_stats: (ChatSummary, stats); kwargs — как у process_summary.
+
+    attachment — формат таблицы превышений ("csv", "json") или пусто — без таблицы; job_id — как у excel_job.
+    """
+    from fileHandler import process_summary_with_stats, summary_table
+
+    with job_context(job_id):
+        logging.info("Обработка начата", extra={"event": "worker_start", "mode": "summary"})
+        summary, stats = process_summary_with_stats(file_path, allowed_deviation_percentage, **kwargs)
+        violations = summary.violations
+        rows = violations.head(top)
+        top_items = [
+            TopItem(str(key), name if isinstance(name, str) else None, float(y), float(z), float(aa))
+            for key, name, y, z, aa in zip(rows["item_key"], rows["name"], rows["y"], rows["z"], rows["aa"])
+        ]
+        table = summary_table(summary, attachment) if attachment and len(violations) else None
+    return ChatSummary(summary.items, summary.surplus, summary.shortage, summary.sum_excess,
+                       summary.sum_shortage, top_items, table), stats
+
+
+class SensitivityRow(NamedTuple):
+    """Строка таблицы чувствительности (fileHandler.Sensitivity): процент (доля) и итоги при нём."""
+    percentage: float
+    surplus: int
+    shortage: int
+    items_over: int
+    sum_excess: float
+    sum_shortage: float
+
+
+class ChatSensitivity(NamedTuple):
+    """fileHandler.Sensitivity для ответа в чате: число позиций и строки таблицы по возрастанию процента."""
+    items: int
+    rows: list
+
+
+def sensitivity_job(file_path, percentages: list, job_id: Optional[str] = None, **kwargs) -> tuple:
+    """fileHandler.process_sensitivity_with_stats: (ChatSensitivity, stats); kwargs — как у process_sensitivity."""
+    from fileHandler import process_sensitivity_with_stats
+
+    with job_context(job_id):
+        logging.info("Обработка начата", extra={"event": "worker_start", "mode": "sensitivity"})
+        sensitivity, stats = process_sensitivity_with_stats(file_path, percentages, **kwargs)
+        rows = [
+            SensitivityRow(float(pct), int(surplus), int(shortage), int(over), float(z), float(aa))
+            for pct, surplus, shortage, over, z, aa in sensitivity.table.itertuples(index=False, name=None)
+        ]
+    return ChatSensitivity(sensitivity.items, rows), stats
+
+
+# -------------------------------
+# Прогрев рабочих процессов
+# -------------------------------
+def _warmup_osv() -> bytes:
+    """Маленькая ОСВ в раскладке выгрузки iiko (шапка на pandas-индексах 7–9, раздел, позиции, "Итого")."""
+    from openpyxl import Workbook
+
+    width = 21  # A..U
+    rows = [["Расширенная оборотно-сальдовая ведомость"]] + [[]] * 6
+    rows.append(["Код", "Товар"] + [""] * (width - 2))
+    rows.append([""] * 5 + ["Кол-во", "Сумма"] * 8)
+    rows.append([str(i) for i in range(1, width + 1)])
+    rows.append(["Товар", "Группа 1"])
+    for code in range(1, 4):
+        qty = ["10,000", "0", "100,500", "0", "90,000", "5,000", "0,500", "25,000"]
+        row = [f"{code:05d}", f"Позиция {code}", "кг", None, None]
+        for q in qty:
+            row += [q, f"{float(q.replace(',', '.')) * 120:,.2f}".replace(",", " ").replace(".", ",")]
+        rows.append(row)
+    rows.append(["Итого"])
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    for row in rows:
+        ws.append(row)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def warm_up(log_queue=None) -> None:
+    """Инициализатор рабочего процесса: направляет логи в очередь бота (logSetup), импортирует модули
+    обработки и прогоняет маленькую ОСВ, чтобы первое настоящее задание не платило за холодный старт.
+    Ошибки прогрева не мешают работе."""
+    if log_queue is not None:
+        configure_worker(log_queue)
+    started = time.perf_counter()
+    try:
+        import largeFile  # noqa: F401 — режим больших файлов импортируется лениво из process_excel
+        from fileHandler import process_excel, process_summary, summary_table
+
+        source = _warmup_osv()
+        process_excel(source, None)
+        summary_table(process_summary(source))
+    except Exception:
+        logging.exception("Прогрев процесса обработки не удался:")
+        return
+    logging.info(f"Процесс обработки {os.getpid()} прогрет за {time.perf_counter() - started:.2f} с")